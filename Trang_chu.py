@@ -12,6 +12,7 @@ from datetime import datetime
 sys.path.insert(0, str(Path(__file__).parent))
 
 from database.models import init_database, verify_user
+from modules.import_jobs import start_worker
 from config import ROLE_PERMISSIONS, SESSION_TTL_HOURS
 from utils.menu import menu
 
@@ -169,6 +170,8 @@ if not st.session_state.db_initialized:
     with st.spinner("Đang khởi tạo database..."):
         try:
             init_database()
+            # Chạy tiếp job import dở dang từ lần chạy trước
+            start_worker()
             st.session_state.db_initialized = True
         except Exception as e:
             st.error(f"Lỗi khởi tạo database: {e}")
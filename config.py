@@ -174,6 +174,43 @@ HEADER_MAP = {
     "verification_result": "ket_qua_xac_minh"
 }
 
+# ============================================
+# IMPORT SETTINGS
+# ============================================
+
+# Số process trích xuất trang JSF song song (0 = tự động theo số CPU, 1 = tuần tự)
+JSF_EXTRACT_WORKERS = int(os.environ.get("QLNNN_JSF_WORKERS", "0"))
+JSF_MIN_PAGES_PER_WORKER = 8  # File ít trang hơn không đáng để mở process
+# Số thread chuẩn hóa + validation các lô JSF trong lúc lô trước đang ghi DB
+# (ghi DB luôn ở một thread, theo thứ tự lô)
+JSF_PREPARE_WORKERS = int(os.environ.get("QLNNN_JSF_PREPARE_WORKERS", "2"))
+# Trích xuất theo bố cục cột cố định của PA61 (0 = luôn dùng extract_table của pdfplumber)
+JSF_LAYOUT_EXTRACT = os.environ.get("QLNNN_JSF_LAYOUT", "1") != "0"
+
+# Cache bảng trích xuất theo SHA-256 nội dung file (upload lại cùng file không phải đọc lại)
+IMPORT_CACHE_DIR = IMPORTS_DIR / "cache"
+IMPORT_CACHE_MAX_MB = int(os.environ.get("QLNNN_IMPORT_CACHE_MB", "512"))  # Vượt quá -> xóa mục ít dùng nhất (LRU)
+
+# Hàng đợi import chạy nền: file upload được chép vào đây chờ worker xử lý
+IMPORT_JOBS_DIR = IMPORTS_DIR / "jobs"
+JOB_POLL_SECONDS = 2  # Trang Nhập liệu tự làm mới khi còn job đang chạy
+
+# CSV đọc bằng read_csv của DuckDB (không qua pandas), ghi DB theo lô
+CSV_CHUNK_SIZE = 50000
+CSV_ENCODING_SAMPLE_BYTES = 64 * 1024  # Số byte đầu file dùng để đoán encoding
+
+# Excel đọc theo luồng (openpyxl read_only), ghi DB theo lô
+EXCEL_BATCH_SIZE = 20000
+EXCEL_HEADER_SCAN_ROWS = 20  # Số dòng đầu sheet được xét để tìm dòng tiêu đề
+
+# ============================================
+# PASSPORT FILTER (Bloom filter negative cache)
+# ============================================
+
+PASSPORT_FILTER_PATH = DATA_DIR / "passport_filter.npz"
+PASSPORT_FILTER_ERROR_RATE = 0.01  # Target false-positive rate
+PASSPORT_FILTER_MIN_CAPACITY = 100_000  # Keys sized for at build time (at least 2x current)
+
 # ============================================
 # UI SETTINGS
 # ============================================
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Test helpers dùng chung - database tạm cho các test script import/tra cứu
+Các test script nằm ở thư mục gốc nên file này cũng ở đây: pytest tự nạp,
+chạy riêng (python test_x.py) thì import trực tiếp:
+
+    from conftest import TEST_DIR, fresh_database
+"""
+
+import atexit
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import database.connection as db_connection
+import database.passport_filter as passport_filter
+import modules.import_cache as import_cache
+from database.models import init_database
+
+# ===== DATABASE TẠM (không đụng data/qlnnn.db) =====
+TEST_DIR = Path(tempfile.mkdtemp(prefix="qlnnn_test_"))
+
+
+@atexit.register
+def _cleanup():
+    db_connection.close_connection()
+    shutil.rmtree(TEST_DIR, ignore_errors=True)
+
+
+def fresh_database():
+    """Đóng connection, xóa DB tạm và tạo lại schema"""
+    db_connection.close_connection()
+    # Gán lại mỗi lần: test khác có thể đã đổi đường dẫn
+    db_connection.DATABASE_PATH = TEST_DIR / "test.db"
+    passport_filter.PASSPORT_FILTER_PATH = TEST_DIR / "passport_filter.npz"
+    import_cache.IMPORT_CACHE_DIR = TEST_DIR / "cache"
+    for path in TEST_DIR.iterdir():
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    init_database()
+    return db_connection.get_connection()
@@ -3,7 +3,13 @@ QLNNN Offline - Database Models & Schema
 Create tables and initialize database
 """
 
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
 from .connection import get_connection, table_exists
+from .passport_filter import add_passports_from_table, load_passport_filter, rebuild_passport_filter
 import bcrypt
 
 
@@ -35,6 +41,9 @@ CREATE SEQUENCE IF NOT EXISTS seq_raw_immigration_id;
 CREATE TABLE IF NOT EXISTS raw_immigration (
     id INTEGER PRIMARY KEY DEFAULT nextval('seq_raw_immigration_id'),
     so_ho_chieu TEXT NOT NULL,
+    passport_key TEXT,  -- TRIM(UPPER(so_ho_chieu)), khóa upsert cùng ngay_den
+    row_hash UBIGINT,   -- Hash nội dung (compute_row_hash), bỏ qua dòng không đổi khi import lại
+    batch_id INTEGER,   -- import_batches.id của lần import ghi dòng gần nhất
     ho_ten TEXT,
     ngay_sinh DATE,
     quoc_tich TEXT,
@@ -55,6 +64,74 @@ CREATE INDEX IF NOT EXISTS idx_ho_ten ON raw_immigration(ho_ten);
 -- Composite indexes for batch search optimization
 CREATE INDEX IF NOT EXISTS idx_passport_status ON raw_immigration(so_ho_chieu, ket_qua_xac_minh);
 CREATE INDEX IF NOT EXISTS idx_passport_ngay_den ON raw_immigration(so_ho_chieu, ngay_den DESC);
+-- Unique (passport_key, ngay_den), idx_raw_batch: tạo trong ensure_raw_immigration_key() (cần migrate DB cũ)
+
+-- ============================================
+-- IMPORT BATCHES (sổ các lần import, rollback theo lô)
+-- ============================================
+CREATE SEQUENCE IF NOT EXISTS seq_import_batches_id;
+CREATE TABLE IF NOT EXISTS import_batches (
+    id INTEGER PRIMARY KEY DEFAULT nextval('seq_import_batches_id'),
+    file_hash TEXT,
+    source_file TEXT,
+    username TEXT,
+    status TEXT NOT NULL DEFAULT 'running',  -- running / committed / failed / rolled_back
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP,
+    duration_s DOUBLE,
+    timings TEXT,  -- JSON thời gian từng giai đoạn (nếu có)
+    rows_inserted INTEGER DEFAULT 0,
+    rows_updated INTEGER DEFAULT 0,
+    rows_unchanged INTEGER DEFAULT 0,
+    rows_skipped INTEGER DEFAULT 0,
+    error TEXT,
+    rolled_back_at TIMESTAMP,
+    rolled_back_by TEXT
+);
+
+-- Bản trước khi sửa của các dòng mà một batch đã cập nhật (dòng thêm mới không cần)
+CREATE TABLE IF NOT EXISTS import_before_image (
+    batch_id INTEGER NOT NULL,  -- Batch đã ghi đè dòng
+    id INTEGER NOT NULL,        -- raw_immigration.id
+    so_ho_chieu TEXT,
+    passport_key TEXT,
+    ho_ten TEXT,
+    ngay_sinh DATE,
+    quoc_tich TEXT,
+    ngay_den DATE,
+    ngay_di DATE,
+    dia_chi_tam_tru TEXT,
+    ket_qua_xac_minh TEXT,
+    thoi_diem_cap_nhat TIMESTAMP,
+    source_file TEXT,
+    row_hash UBIGINT,
+    prev_batch_id INTEGER       -- batch_id của dòng trước khi bị ghi đè
+);
+
+CREATE INDEX IF NOT EXISTS idx_before_image_batch ON import_before_image(batch_id);
+CREATE INDEX IF NOT EXISTS idx_before_image_prev_batch ON import_before_image(prev_batch_id);
+
+-- ============================================
+-- JOBS (hàng đợi import chạy nền, xem modules/import_jobs.py)
+-- ============================================
+CREATE SEQUENCE IF NOT EXISTS seq_jobs_id;
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY DEFAULT nextval('seq_jobs_id'),
+    file_path TEXT NOT NULL,  -- Bản sao file upload trong data/imports/jobs/
+    source_file TEXT,
+    username TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',  -- queued / running / done / failed
+    progress DOUBLE DEFAULT 0,
+    message TEXT,
+    checkpoint TEXT,  -- JSON: lô cuối đã commit, để chạy tiếp sau khi khởi động lại
+    batch_id INTEGER,
+    timings TEXT,     -- JSON thời gian từng giai đoạn
+    result TEXT,      -- JSON tóm tắt kết quả
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
 
 -- ============================================
 -- REFERENCE TABLES
@@ -105,6 +182,41 @@ CREATE INDEX IF NOT EXISTS idx_student_passport ON ref_student(so_ho_chieu);
 CREATE INDEX IF NOT EXISTS idx_watchlist_passport ON ref_watchlist(so_ho_chieu);
 CREATE INDEX IF NOT EXISTS idx_marriage_passport ON ref_marriage(so_ho_chieu);
 
+-- ============================================
+-- TRAVEL GROUPS (người đi cùng)
+-- Cùng ngày đến + cùng địa chỉ (chuẩn hóa) = cùng nhóm
+-- Bảng dẫn xuất từ raw_immigration, cập nhật tăng dần khi import
+-- ============================================
+CREATE TABLE IF NOT EXISTS travel_group (
+    group_id TEXT NOT NULL,
+    so_ho_chieu TEXT NOT NULL,
+    ngay_den DATE NOT NULL,
+    address_key TEXT NOT NULL,
+    ho_ten TEXT,
+    ngay_sinh DATE,
+    quoc_tich TEXT,
+    dia_chi_tam_tru TEXT,
+    ngay_di DATE,
+    stay_id INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_travel_group_passport ON travel_group(so_ho_chieu);
+CREATE INDEX IF NOT EXISTS idx_travel_group_id ON travel_group(group_id);
+
+-- ============================================
+-- ADDRESS TOKENS (tra cứu theo địa chỉ)
+-- Token địa chỉ (không dấu) -> lượt lưu trú, dẫn xuất từ travel_group
+-- ============================================
+CREATE TABLE IF NOT EXISTS address_token (
+    token TEXT NOT NULL,
+    so_ho_chieu TEXT NOT NULL,
+    ngay_den DATE NOT NULL,
+    stay_id INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS idx_address_token ON address_token(token);
+CREATE INDEX IF NOT EXISTS idx_address_token_stay ON address_token(so_ho_chieu, ngay_den);
+
 -- ============================================
 -- AUDIT LOG
 -- ============================================
@@ -335,6 +447,531 @@ LEFT JOIN ref_marriage MR ON L.passport = TRIM(UPPER(MR.so_ho_chieu));
 """
 
 
+# ============================================
+# DERIVED TABLES
+# ============================================
+
+def address_key_sql(column: str) -> str:
+    """
+    SQL expression normalizing an address for grouping/matching:
+    lowercase, no diacritics, punctuation collapsed to single spaces.
+    
+    Args:
+        column: Column name or SQL expression
+        
+    Returns:
+        SQL expression
+    """
+    return (
+        f"TRIM(regexp_replace(strip_accents(REPLACE(LOWER(COALESCE({column}, '')), 'đ', 'd')), "
+        f"'[^a-z0-9]+', ' ', 'g'))"
+    )
+
+
+def refresh_travel_groups(conn=None, keys_table: str = None) -> int:
+    """
+    Rebuild travel_group rows from raw_immigration.
+    
+    Only the (so_ho_chieu, ngay_den) keys present in `keys_table` are
+    refreshed (incremental, called after each import batch); without
+    `keys_table` the whole table is rebuilt. Runs in the caller's
+    transaction; the caller commits.
+    
+    Args:
+        conn: Database connection (default: shared connection)
+        keys_table: Registered table/view with normalized so_ho_chieu, ngay_den
+        
+    Returns:
+        Number of travel_group rows written
+    """
+    if conn is None:
+        conn = get_connection()
+    
+    if keys_table:
+        key_filter = f"""
+            AND EXISTS (
+                SELECT 1 FROM {keys_table} k
+                WHERE k.so_ho_chieu = TRIM(UPPER(r.so_ho_chieu))
+                  AND TRY_CAST(k.ngay_den AS DATE) = r.ngay_den
+            )
+        """
+        conn.execute(f"""
+            DELETE FROM travel_group
+            WHERE EXISTS (
+                SELECT 1 FROM {keys_table} k
+                WHERE k.so_ho_chieu = travel_group.so_ho_chieu
+                  AND TRY_CAST(k.ngay_den AS DATE) = travel_group.ngay_den
+            )
+        """)
+    else:
+        key_filter = ""
+        conn.execute("DELETE FROM travel_group")
+    
+    # Same dedup rule as view_tong_hop_final: latest update per (passport, ngay_den)
+    inserted = conn.execute(f"""
+        INSERT INTO travel_group (
+            group_id, so_ho_chieu, ngay_den, address_key,
+            ho_ten, ngay_sinh, quoc_tich, dia_chi_tam_tru, ngay_di, stay_id
+        )
+        SELECT
+            md5(CAST(ngay_den AS VARCHAR) || '|' || address_key),
+            passport, ngay_den, address_key,
+            ho_ten, ngay_sinh, quoc_tich, dia_chi_tam_tru, ngay_di, id
+        FROM (
+            SELECT
+                TRIM(UPPER(r.so_ho_chieu)) AS passport,
+                r.ngay_den,
+                {address_key_sql('r.dia_chi_tam_tru')} AS address_key,
+                r.ho_ten,
+                r.ngay_sinh,
+                r.quoc_tich,
+                r.dia_chi_tam_tru,
+                r.ngay_di,
+                r.id,
+                ROW_NUMBER() OVER(
+                    PARTITION BY TRIM(UPPER(r.so_ho_chieu)), r.ngay_den
+                    ORDER BY
+                        r.thoi_diem_cap_nhat DESC,
+                        CASE WHEN r.ngay_di IS NULL THEN 1 ELSE 0 END,
+                        r.ngay_di DESC
+                ) AS rn
+            FROM raw_immigration r
+            WHERE r.so_ho_chieu IS NOT NULL AND r.so_ho_chieu != ''
+              AND r.ngay_den IS NOT NULL
+              {key_filter}
+        )
+        WHERE rn = 1 AND address_key != ''
+    """).fetchone()
+    
+    return inserted[0] if inserted else 0
+
+
+def refresh_address_tokens(conn=None, keys_table: str = None) -> int:
+    """
+    Rebuild address_token rows from travel_group (run after refresh_travel_groups).
+    
+    Each stay gets one row per distinct token of its normalized address.
+    Incremental for the keys in `keys_table`, full rebuild without it.
+    Runs in the caller's transaction; the caller commits.
+    
+    Args:
+        conn: Database connection (default: shared connection)
+        keys_table: Registered table/view with normalized so_ho_chieu, ngay_den
+        
+    Returns:
+        Number of address_token rows written
+    """
+    if conn is None:
+        conn = get_connection()
+    
+    if keys_table:
+        key_filter = f"""
+            WHERE EXISTS (
+                SELECT 1 FROM {keys_table} k
+                WHERE k.so_ho_chieu = g.so_ho_chieu
+                  AND TRY_CAST(k.ngay_den AS DATE) = g.ngay_den
+            )
+        """
+        conn.execute(f"""
+            DELETE FROM address_token
+            WHERE EXISTS (
+                SELECT 1 FROM {keys_table} k
+                WHERE k.so_ho_chieu = address_token.so_ho_chieu
+                  AND TRY_CAST(k.ngay_den AS DATE) = address_token.ngay_den
+            )
+        """)
+    else:
+        key_filter = ""
+        conn.execute("DELETE FROM address_token")
+    
+    inserted = conn.execute(f"""
+        INSERT INTO address_token (token, so_ho_chieu, ngay_den, stay_id)
+        SELECT DISTINCT token, so_ho_chieu, ngay_den, stay_id
+        FROM (
+            SELECT UNNEST(string_split(g.address_key, ' ')) AS token,
+                   g.so_ho_chieu, g.ngay_den, g.stay_id
+            FROM travel_group g
+            {key_filter}
+        )
+        WHERE token != ''
+    """).fetchone()
+    
+    return inserted[0] if inserted else 0
+
+
+def refresh_derived_tables(conn=None, keys_table: str = None) -> Dict[str, int]:
+    """
+    Refresh all data derived from raw_immigration (travel_group, address_token;
+    on a full rebuild also the passport Bloom filter, which imports update in
+    upsert_raw_immigration()).
+    
+    Does not commit: run it inside the transaction of the write it follows
+    (or wrap it in conn.begin()/commit()), so the derived tables never show
+    a half-applied refresh.
+    
+    Args:
+        conn: Database connection (default: shared connection)
+        keys_table: Registered table/view with the imported keys (None = full rebuild)
+        
+    Returns:
+        Dict with rows written per table
+    """
+    if conn is None:
+        conn = get_connection()
+    
+    result = {
+        "travel_group": refresh_travel_groups(conn, keys_table),
+        "address_token": refresh_address_tokens(conn, keys_table),
+    }
+    
+    # Negative cache for batch lookups (in memory + data/). Imported keys are
+    # added by upsert_raw_immigration(), in the same step as the write
+    if not keys_table:
+        result["passport_filter"] = rebuild_passport_filter(conn).count
+    
+    return result
+
+
+# ============================================
+# UPSERT raw_immigration
+# ============================================
+
+RAW_KEY_INDEX = "idx_raw_passport_key_ngay_den"
+
+
+def ensure_raw_immigration_key(conn=None) -> int:
+    """
+    Ensure raw_immigration.passport_key/row_hash/batch_id, the batch_id index
+    and the unique (passport_key, ngay_den) index that upsert_raw_immigration()
+    targets.
+    
+    Databases created before the columns existed are migrated: the key is
+    backfilled and duplicate stays are collapsed onto one row, chosen by the
+    view_tong_hop_final ordering (latest thoi_diem_cap_nhat, then rows with
+    ngay_di before rows without, later ngay_di first) and, when that still
+    ties, the highest id. The view itself had no tie-break, so for such
+    exact ties the kept row may differ from the one it happened to show.
+    The latest verification result of the dropped rows is kept if the kept
+    row has none.
+    
+    Args:
+        conn: Database connection (default: shared connection)
+        
+    Returns:
+        Number of duplicate rows removed
+    """
+    if conn is None:
+        conn = get_connection()
+    
+    existing = {
+        row[0] for row in conn.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_name = 'raw_immigration'
+        """).fetchall()
+    }
+    for column, col_type in (("passport_key", "TEXT"), ("row_hash", "UBIGINT"), ("batch_id", "INTEGER")):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE raw_immigration ADD COLUMN {column} {col_type}")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_raw_batch ON raw_immigration(batch_id)")
+    
+    has_index = conn.execute(
+        "SELECT COUNT(*) FROM duckdb_indexes() WHERE index_name = ?", (RAW_KEY_INDEX,)
+    ).fetchone()[0]
+    if has_index:
+        return 0
+    
+    conn.execute("""
+        UPDATE raw_immigration SET passport_key = TRIM(UPPER(so_ho_chieu))
+        WHERE passport_key IS NULL
+    """)
+    
+    # Same ordering as view_tong_hop_final (id breaks remaining ties)
+    conn.execute("""
+        CREATE OR REPLACE TEMP TABLE raw_key_duplicates AS
+        SELECT id, rn, ket_qua_xac_minh
+        FROM (
+            SELECT
+                id,
+                ROW_NUMBER() OVER w AS rn,
+                FIRST_VALUE(NULLIF(TRIM(ket_qua_xac_minh), '') IGNORE NULLS) OVER (
+                    w ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                ) AS ket_qua_xac_minh,
+                COUNT(*) OVER (PARTITION BY passport_key, ngay_den) AS cnt
+            FROM raw_immigration
+            WHERE ngay_den IS NOT NULL
+            WINDOW w AS (
+                PARTITION BY passport_key, ngay_den
+                ORDER BY
+                    thoi_diem_cap_nhat DESC,
+                    CASE WHEN ngay_di IS NULL THEN 1 ELSE 0 END,
+                    ngay_di DESC,
+                    id DESC
+            )
+        )
+        WHERE cnt > 1
+    """)
+    conn.execute("""
+        UPDATE raw_immigration
+        SET ket_qua_xac_minh = d.ket_qua_xac_minh
+        FROM raw_key_duplicates d
+        WHERE raw_immigration.id = d.id AND d.rn = 1
+          AND d.ket_qua_xac_minh IS NOT NULL
+          AND (raw_immigration.ket_qua_xac_minh IS NULL OR TRIM(raw_immigration.ket_qua_xac_minh) = '')
+    """)
+    removed = conn.execute("""
+        DELETE FROM raw_immigration
+        WHERE id IN (SELECT id FROM raw_key_duplicates WHERE rn > 1)
+    """).fetchone()[0]
+    conn.execute("DROP TABLE raw_key_duplicates")
+    
+    conn.execute(f"CREATE UNIQUE INDEX {RAW_KEY_INDEX} ON raw_immigration(passport_key, ngay_den)")
+    conn.commit()
+    
+    if removed:
+        print(f"✅ raw_immigration: removed {removed} duplicate (passport, ngay_den) rows")
+        # travel_group/address_token may point at removed stay ids
+        conn.begin()
+        refresh_derived_tables(conn)
+        conn.commit()
+    
+    return removed
+
+
+# Business fields of a stay besides its key; ket_qua_xac_minh is left out
+# because an import without a result keeps the stored one
+ROW_HASH_COLUMNS = ["ho_ten", "ngay_sinh", "quoc_tich", "ngay_di", "dia_chi_tam_tru"]
+
+# Fields counted by the "most complete row" rule of the in-batch dedup
+DEDUP_COLUMNS = ROW_HASH_COLUMNS + ["ket_qua_xac_minh"]
+
+
+def _is_filled(values: np.ndarray) -> np.ndarray:
+    """Non-missing, non-blank values"""
+    text = pd.Series(values, dtype=object)
+    return (text.notna() & (text.astype(str).str.strip() != "")).to_numpy()
+
+
+def dedupe_import_rows(df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    In-batch dedup shared by every import path, run once before the write.
+    
+    Rows with the same (passport key, ngay_den) collapse into one,
+    deterministically: the most complete row (most non-empty DEDUP_COLUMNS)
+    wins and ties go to the latest row in file order. If the winner has no
+    ket_qua_xac_minh, the latest non-empty one of its group is carried over.
+    Rows without ngay_den are never duplicates (NULL key).
+    
+    Args:
+        df: Normalized rows (so_ho_chieu, ngay_den, DEDUP_COLUMNS if present)
+        
+    Returns:
+        Tuple of (kept rows in their original order, boolean array of the
+        collapsed rows aligned with df)
+    """
+    collapsed = np.zeros(len(df), dtype=bool)
+    if df.empty:
+        return df, collapsed
+    
+    keys = pd.DataFrame({
+        "passport_key": df["so_ho_chieu"].astype(str).str.strip().str.upper().to_numpy(),
+        "ngay_den": df["ngay_den"].to_numpy(),
+    })
+    in_group = (keys.duplicated(keep=False) & keys["ngay_den"].notna()).to_numpy()
+    if not in_group.any():
+        return df, collapsed
+    
+    # Only rows that have a duplicate take part
+    group = keys[in_group].reset_index(drop=True)
+    group["position"] = np.flatnonzero(in_group)
+    group["filled"] = 0
+    for column in DEDUP_COLUMNS:
+        if column in df.columns:
+            group["filled"] += _is_filled(df[column].to_numpy()[in_group])
+    
+    key_columns = ["passport_key", "ngay_den"]
+    winners = group.sort_values(key_columns + ["filled", "position"], kind="stable").drop_duplicates(
+        key_columns, keep="last"
+    )
+    collapsed[in_group] = True
+    collapsed[winners["position"].to_numpy()] = False
+    
+    if "ket_qua_xac_minh" in df.columns:
+        verification = df["ket_qua_xac_minh"].to_numpy(dtype=object, copy=True)
+        group["verification"] = np.where(
+            _is_filled(verification[in_group]), verification[in_group], None
+        )
+        latest = group.dropna(subset=["verification"]).drop_duplicates(key_columns, keep="last")
+        carry = winners.merge(latest[key_columns + ["verification"]], on=key_columns)
+        carry = carry[~_is_filled(verification[carry["position"].to_numpy()])]
+        if not carry.empty:
+            verification[carry["position"].to_numpy()] = carry["verification"].to_numpy()
+            df = df.assign(ket_qua_xac_minh=verification)
+    
+    return df[~collapsed], collapsed
+
+
+def completeness_sql(alias: str) -> str:
+    """SQL: number of non-empty DEDUP_COLUMNS of row `alias` (rule of dedupe_import_rows)"""
+    return "(" + " + ".join(
+        f"CAST(NULLIF(TRIM(CAST({alias}.{column} AS VARCHAR)), '') IS NOT NULL AS INTEGER)"
+        for column in DEDUP_COLUMNS
+    ) + ")"
+
+
+def compute_row_hash(df: pd.DataFrame) -> pd.Series:
+    """
+    Content hash (uint64) of each row's ROW_HASH_COLUMNS, computed over the
+    whole frame at once. Values are hashed as text (missing = ''), so the
+    same data hashes the same whichever file it came from.
+    
+    Args:
+        df: Normalized rows (dates already formatted as text)
+        
+    Returns:
+        Series of uint64 aligned with df
+    """
+    values = df[ROW_HASH_COLUMNS].astype("string").fillna("")
+    return pd.util.hash_pandas_object(values, index=False)
+
+
+def _row_changed_sql(old: str, new: str) -> str:
+    """SQL condition: stored row `old` differs from imported row `new`"""
+    return (
+        f"({old}.row_hash IS DISTINCT FROM {new}.row_hash "
+        f"OR (NULLIF({new}.ket_qua_xac_minh, '') IS NOT NULL "
+        f"AND {new}.ket_qua_xac_minh IS DISTINCT FROM {old}.ket_qua_xac_minh))"
+    )
+
+
+# Columns of a normalized import frame, in the order upsert_raw_immigration() takes them
+RAW_IMPORT_COLUMNS = [
+    'so_ho_chieu', 'ho_ten', 'ngay_sinh', 'quoc_tich', 'ngay_den',
+    'ngay_di', 'dia_chi_tam_tru', 'ket_qua_xac_minh', 'source_file'
+]
+
+
+def upsert_raw_immigration(conn, df: pd.DataFrame, temp_table: str,
+                           batch_id: int = None) -> Dict[str, int]:
+    """
+    Insert new stays and update changed ones in a single
+    INSERT ... ON CONFLICT (passport_key, ngay_den) DO UPDATE.
+    
+    A matched row is only rewritten (and thoi_diem_cap_nhat bumped) when its
+    row_hash differs or the import brings a new ket_qua_xac_minh; a stored
+    verification result is kept when the import has none. ON CONFLICT cannot
+    touch the same row twice: duplicates in the batch are collapsed first
+    by dedupe_import_rows() (most complete row, then latest). The same rule
+    applies to a row this batch_id already wrote in an earlier chunk.
+    
+    With `batch_id`, written rows are tagged with it and the previous version
+    of each row it is about to update is saved to import_before_image (once
+    per batch), so rollback_batch() can undo the import. The caller wraps the
+    call in conn.begin() ... commit()/rollback(): in autocommit mode the
+    before-images would be committed even if the upsert fails.
+    
+    Afterwards `temp_table` is registered with the (so_ho_chieu, ngay_den)
+    keys of the inserted/changed rows only, ready for refresh_derived_tables();
+    the caller unregisters it and commits. Those passports are already added
+    to the Bloom filter.
+    
+    Args:
+        conn: Database connection
+        df: Normalized rows (RAW_IMPORT_COLUMNS)
+        temp_table: Name to register the batch under
+        batch_id: import_batches.id (None = not recorded)
+        
+    Returns:
+        Dict with inserted, updated (changed), unchanged and duplicates
+        (rows collapsed in the batch)
+    """
+    df, collapsed = dedupe_import_rows(df)
+    df = df.assign(row_hash=compute_row_hash(df))
+    
+    conn.register(temp_table, df)
+    
+    # Rows this import already wrote in an earlier chunk: the dedup rule
+    # decides between them too, and they count as collapsed duplicates
+    same_batch, same_batch_written, same_batch_rule = 0, 0, ""
+    if batch_id is not None:
+        same_batch, same_batch_written = conn.execute(f"""
+            SELECT
+                COUNT(*),
+                COUNT(*) FILTER (
+                    WHERE {_row_changed_sql('r', 't')}
+                      AND {completeness_sql('t')} >= {completeness_sql('r')}
+                )
+            FROM raw_immigration r
+            JOIN {temp_table} t
+              ON r.passport_key = TRIM(UPPER(t.so_ho_chieu))
+             AND r.ngay_den = CAST(t.ngay_den AS DATE)
+            WHERE r.batch_id = ?
+        """, (batch_id,)).fetchone()
+        same_batch_rule = f"""
+            AND (raw_immigration.batch_id IS DISTINCT FROM EXCLUDED.batch_id
+                 OR {completeness_sql('EXCLUDED')} >= {completeness_sql('raw_immigration')})
+        """
+    
+    if batch_id is not None:
+        # Before-images of the rows the upsert below will change
+        conn.execute(f"""
+            INSERT INTO import_before_image
+            SELECT
+                ?, r.id, r.so_ho_chieu, r.passport_key, r.ho_ten, r.ngay_sinh, r.quoc_tich,
+                r.ngay_den, r.ngay_di, r.dia_chi_tam_tru, r.ket_qua_xac_minh,
+                r.thoi_diem_cap_nhat, r.source_file, r.row_hash, r.batch_id
+            FROM raw_immigration r
+            JOIN {temp_table} t
+              ON r.passport_key = TRIM(UPPER(t.so_ho_chieu))
+             AND r.ngay_den = CAST(t.ngay_den AS DATE)
+            WHERE r.batch_id IS DISTINCT FROM ?
+              AND {_row_changed_sql('r', 't')}
+        """, (batch_id, batch_id))
+    
+    before = conn.execute("SELECT COUNT(*) FROM raw_immigration").fetchone()[0]
+    written = conn.execute(f"""
+        INSERT INTO raw_immigration (
+            so_ho_chieu, passport_key, ho_ten, ngay_sinh, quoc_tich, ngay_den,
+            ngay_di, dia_chi_tam_tru, ket_qua_xac_minh, source_file, row_hash, batch_id,
+            thoi_diem_cap_nhat
+        )
+        SELECT
+            t.so_ho_chieu, TRIM(UPPER(t.so_ho_chieu)), t.ho_ten, t.ngay_sinh, t.quoc_tich, t.ngay_den,
+            t.ngay_di, t.dia_chi_tam_tru, t.ket_qua_xac_minh, t.source_file, t.row_hash, ?,
+            CURRENT_TIMESTAMP
+        FROM {temp_table} t
+        ON CONFLICT (passport_key, ngay_den) DO UPDATE SET
+            ho_ten = EXCLUDED.ho_ten,
+            ngay_sinh = EXCLUDED.ngay_sinh,
+            quoc_tich = EXCLUDED.quoc_tich,
+            ngay_di = EXCLUDED.ngay_di,
+            dia_chi_tam_tru = EXCLUDED.dia_chi_tam_tru,
+            ket_qua_xac_minh = COALESCE(NULLIF(EXCLUDED.ket_qua_xac_minh, ''), ket_qua_xac_minh),
+            source_file = EXCLUDED.source_file,
+            row_hash = EXCLUDED.row_hash,
+            batch_id = EXCLUDED.batch_id,
+            thoi_diem_cap_nhat = EXCLUDED.thoi_diem_cap_nhat
+        WHERE {_row_changed_sql('raw_immigration', 'EXCLUDED')}
+        {same_batch_rule}
+        RETURNING passport_key AS so_ho_chieu, ngay_den
+    """, (batch_id,)).df()
+    inserted = conn.execute("SELECT COUNT(*) FROM raw_immigration").fetchone()[0] - before
+    
+    conn.unregister(temp_table)
+    conn.register(temp_table, written)
+    
+    # Bloom filter gets the written keys before the caller commits: a key that
+    # is committed is always in the filter (a rolled-back write only leaves a
+    # false positive), even if the later derived-table refresh fails
+    add_passports_from_table(conn, temp_table)
+    
+    return {
+        "inserted": inserted,
+        "updated": len(written) - inserted - same_batch_written,
+        "unchanged": len(df) - len(written) - (same_batch - same_batch_written),
+        "duplicates": int(collapsed.sum()) + same_batch,
+    }
+
+
 def init_database() -> bool:
     """
     Initialize database with schema and default data
@@ -352,10 +989,28 @@ def init_database() -> bool:
     
     conn.commit()
     
+    # Upsert key (migrates databases created before passport_key)
+    ensure_raw_immigration_key(conn)
+    
     # Create view
     conn.execute(VIEW_SQL)
     conn.commit()
     
+    # Backfill derived tables for databases created before they existed
+    group_count = conn.execute("SELECT COUNT(*) FROM travel_group").fetchone()[0]
+    token_count = conn.execute("SELECT COUNT(*) FROM address_token").fetchone()[0]
+    if group_count == 0 and conn.execute("SELECT COUNT(*) FROM raw_immigration").fetchone()[0] > 0:
+        conn.begin()
+        refresh_derived_tables(conn)
+        conn.commit()
+    elif token_count == 0 and group_count > 0:
+        conn.begin()
+        refresh_address_tokens(conn)
+        conn.commit()
+    
+    # Passport Bloom filter: load from data/ (rebuilt if missing or stale)
+    load_passport_filter(conn)
+    
     # Create default admin user if not exists
     result = conn.execute(
         "SELECT COUNT(*) FROM users WHERE username = 'admin'"
@@ -0,0 +1,307 @@
+"""
+QLNNN Offline - Passport Bloom Filter
+Process-wide negative cache for batch lookups
+
+Bộ lọc Bloom chứa toàn bộ khóa hộ chiếu (TRIM(UPPER(so_ho_chieu))) trong
+raw_immigration. Nếu bộ lọc trả lời "không có" thì chắc chắn hộ chiếu chưa
+từng được nhập -> tra cứu hàng loạt bỏ qua DuckDB cho các số này.
+Chỉ có dương tính giả (phải kiểm tra lại trong DB), không có âm tính giả.
+
+- Rebuilt in bulk from raw_immigration when missing or stale
+- Updated incrementally on each import
+- Persisted to data/ (numpy .npz) so startup only loads it
+"""
+
+import math
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import (
+    PASSPORT_FILTER_PATH,
+    PASSPORT_FILTER_ERROR_RATE,
+    PASSPORT_FILTER_MIN_CAPACITY
+)
+from .connection import get_connection
+
+
+# Two independent 16-byte SipHash keys for double hashing (h1 + i * h2)
+_HASH_KEY_1 = "qlnnn-bloom-k1.."
+_HASH_KEY_2 = "qlnnn-bloom-k2.."
+
+# Its bit positions are stored with the filter; a mismatch (hash scheme changed) forces a rebuild
+_CANARY = "QLNNN-PASSPORT-FILTER"
+
+
+class PassportBloomFilter:
+    """Bloom filter over passport keys, vectorized with numpy"""
+
+    def __init__(self, capacity: int, error_rate: float = PASSPORT_FILTER_ERROR_RATE):
+        """
+        Args:
+            capacity: Expected number of keys
+            error_rate: Target false-positive rate at capacity
+        """
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.count = 0
+        self.bits = np.zeros(self.num_bits, dtype=bool)
+
+    def _positions(self, keys: List[str]) -> np.ndarray:
+        """Bit positions of keys, shape (len(keys), num_hashes)"""
+        values = np.asarray(keys, dtype=object)
+        h1 = pd.util.hash_array(values, hash_key=_HASH_KEY_1, categorize=False)
+        h2 = pd.util.hash_array(values, hash_key=_HASH_KEY_2, categorize=False) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        # uint64 overflow wraps, which is fine for hashing
+        with np.errstate(over="ignore"):
+            combined = h1[:, None] + steps[None, :] * h2[:, None]
+        return combined % np.uint64(self.num_bits)
+
+    def add_many(self, keys: Iterable[str]) -> int:
+        """
+        Add keys to the filter.
+
+        Returns:
+            Number of keys added
+        """
+        keys = [k for k in keys if k]
+        if not keys:
+            return 0
+        self.bits[self._positions(keys).ravel()] = True
+        self.count += len(keys)
+        return len(keys)
+
+    def contains_many(self, keys: List[str]) -> np.ndarray:
+        """
+        Membership test.
+
+        Returns:
+            Boolean array; False = definitely absent, True = possibly present
+        """
+        if not keys:
+            return np.zeros(0, dtype=bool)
+        return self.bits[self._positions(keys)].all(axis=1)
+
+    def estimated_fpr(self) -> float:
+        """False-positive rate estimated from the fraction of set bits"""
+        fill = float(self.bits.mean()) if self.num_bits else 0.0
+        return fill ** self.num_hashes
+
+    def save(self, path: Path, signature: Tuple[int, int]) -> None:
+        """Persist bits and parameters (signature = source table state)"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp.npz")
+        np.savez(
+            tmp_path,
+            bits=np.packbits(self.bits),
+            params=np.array(
+                [self.capacity, self.num_bits, self.num_hashes, self.count, signature[0], signature[1]],
+                dtype=np.int64
+            ),
+            error_rate=np.array([self.error_rate]),
+            canary=self._positions([_CANARY]),
+        )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[Tuple["PassportBloomFilter", Tuple[int, int]]]:
+        """
+        Load a persisted filter.
+
+        Returns:
+            (filter, signature) or None if missing/corrupt/incompatible
+        """
+        if not path.exists():
+            return None
+
+        try:
+            with np.load(path) as data:
+                capacity, num_bits, num_hashes, count, sig_rows, sig_max_id = (int(v) for v in data["params"])
+                bloom = cls(capacity, float(data["error_rate"][0]))
+                if (bloom.num_bits, bloom.num_hashes) != (num_bits, num_hashes):
+                    return None
+                bloom.bits = np.unpackbits(data["bits"])[:num_bits].astype(bool)
+                bloom.count = count
+                canary = data["canary"]
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Passport filter load error: {e}")
+            return None
+
+        # Bit positions of a fixed key must not change (hash scheme/library upgrade)
+        if not np.array_equal(canary, bloom._positions([_CANARY])):
+            return None
+
+        return bloom, (sig_rows, sig_max_id)
+
+
+# ============================================
+# PROCESS-WIDE INSTANCE
+# ============================================
+
+_filter: Optional[PassportBloomFilter] = None
+_lock = threading.Lock()
+_stats = {
+    "lookups": 0,           # Keys checked against the filter
+    "definite_misses": 0,   # Answered "absent" without touching DuckDB
+    "db_checks": 0,         # Passed the filter, checked in DuckDB
+    "false_positives": 0,   # Passed the filter but not in DuckDB
+}
+
+
+def _table_signature(conn) -> Tuple[int, int]:
+    """(row count, max id) of raw_immigration, used to detect a stale file"""
+    row = conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM raw_immigration").fetchone()
+    return int(row[0]), int(row[1])
+
+
+def rebuild_passport_filter(conn=None) -> PassportBloomFilter:
+    """
+    Rebuild the filter in bulk from raw_immigration and persist it.
+
+    Args:
+        conn: Database connection (default: shared connection)
+
+    Returns:
+        The new filter
+    """
+    global _filter
+    if conn is None:
+        conn = get_connection()
+
+    keys = [row[0] for row in conn.execute("""
+        SELECT DISTINCT TRIM(UPPER(so_ho_chieu))
+        FROM raw_immigration
+        WHERE so_ho_chieu IS NOT NULL
+    """).fetchall()]
+
+    bloom = PassportBloomFilter(max(len(keys) * 2, PASSPORT_FILTER_MIN_CAPACITY))
+    bloom.add_many(keys)
+    bloom.save(PASSPORT_FILTER_PATH, _table_signature(conn))
+
+    with _lock:
+        _filter = bloom
+    return bloom
+
+
+def load_passport_filter(conn=None) -> PassportBloomFilter:
+    """
+    Load the persisted filter, rebuilding it if missing or stale.
+    Called at startup (init_database).
+
+    Args:
+        conn: Database connection (default: shared connection)
+
+    Returns:
+        The active filter
+    """
+    global _filter
+    if conn is None:
+        conn = get_connection()
+
+    loaded = PassportBloomFilter.load(PASSPORT_FILTER_PATH)
+    if loaded is not None and loaded[1] == _table_signature(conn):
+        with _lock:
+            _filter = loaded[0]
+        return loaded[0]
+
+    return rebuild_passport_filter(conn)
+
+
+def get_passport_filter() -> PassportBloomFilter:
+    """Get the process-wide filter (loaded on first use)"""
+    if _filter is None:
+        return load_passport_filter()
+    return _filter
+
+
+def add_passports_from_table(conn, keys_table: str) -> int:
+    """
+    Add the passports of an import batch to the filter and persist it.
+
+    Args:
+        conn: Database connection
+        keys_table: Registered table/view with normalized so_ho_chieu
+
+    Returns:
+        Number of keys added
+    """
+    keys = [row[0] for row in conn.execute(f"""
+        SELECT DISTINCT so_ho_chieu FROM {keys_table}
+        WHERE so_ho_chieu IS NOT NULL AND so_ho_chieu != ''
+    """).fetchall()]
+
+    bloom = get_passport_filter()
+
+    # Over capacity: the error rate degrades, size a new filter from the table
+    if bloom.count + len(keys) > bloom.capacity:
+        rebuild_passport_filter(conn)
+        return len(keys)
+
+    with _lock:
+        added = bloom.add_many(keys)
+    bloom.save(PASSPORT_FILTER_PATH, _table_signature(conn))
+    return added
+
+
+def split_definite_misses(keys: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Classify keys with the filter.
+
+    Args:
+        keys: Normalized passport keys
+
+    Returns:
+        (definite misses, candidates to check in DuckDB), both in input order
+    """
+    if not keys:
+        return [], []
+
+    present = get_passport_filter().contains_many(keys)
+    misses = [k for k, p in zip(keys, present) if not p]
+    candidates = [k for k, p in zip(keys, present) if p]
+
+    with _lock:
+        _stats["lookups"] += len(keys)
+        _stats["definite_misses"] += len(misses)
+        _stats["db_checks"] += len(candidates)
+
+    return misses, candidates
+
+
+def record_false_positives(count: int) -> None:
+    """Record candidates that passed the filter but were not in DuckDB"""
+    with _lock:
+        _stats["false_positives"] += count
+
+
+def get_filter_metrics() -> Dict[str, Any]:
+    """
+    Filter size and hit statistics.
+
+    Returns:
+        Dict with keys, capacity, size_kb, num_hashes, estimated_fpr,
+        observed_fpr (false positives / all absent keys checked) and counters
+    """
+    bloom = get_passport_filter()
+    with _lock:
+        stats = dict(_stats)
+
+    absent = stats["definite_misses"] + stats["false_positives"]
+    return {
+        "keys": bloom.count,
+        "capacity": bloom.capacity,
+        "size_kb": round(bloom.num_bits / 8 / 1024, 1),
+        "num_hashes": bloom.num_hashes,
+        "estimated_fpr": bloom.estimated_fpr(),
+        "observed_fpr": stats["false_positives"] / absent if absent else 0.0,
+        **stats,
+    }
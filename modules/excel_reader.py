@@ -0,0 +1,218 @@
+"""
+QLNNN Offline - Excel Reader
+Đọc Excel theo luồng bằng openpyxl read_only, trả về từng lô DataFrame
+
+pd.read_excel dựng toàn bộ workbook (mọi ô kèm style) trong bộ nhớ: file
+bàn giao 300k dòng mất vài phút và vài GB RAM. Ở đây openpyxl đọc từng dòng
+(read_only=True, values_only) và gom thành lô EXCEL_BATCH_SIZE dòng, bộ nhớ
+chỉ giữ một lô.
+
+- Chọn sheet: một tên, danh sách tên, hoặc None = mọi sheet theo thứ tự
+- Dòng tiêu đề: dòng khớp nhiều cột HEADER_MAP nhất trong
+  EXCEL_HEADER_SCAN_ROWS dòng đầu (bỏ qua các dòng tên biểu mẫu phía trên)
+- Giá trị ô giữ nguyên kiểu (chuỗi, số, datetime), cột kiểu object
+- File .xls (openpyxl không đọc được) dùng pd.read_excel rồi chia lô
+"""
+
+from itertools import chain, islice
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+import pandas as pd
+from openpyxl import load_workbook
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import EXCEL_BATCH_SIZE, EXCEL_HEADER_SCAN_ROWS, HEADER_MAP
+from utils.text_utils import normalize_header
+
+
+class ExcelBatch(NamedTuple):
+    """Một lô dòng dữ liệu của một sheet"""
+    sheet: str
+    sheet_index: int  # Vị trí sheet trong các sheet được đọc (0-based)
+    sheet_count: int
+    header_row: int  # Số dòng (trong sheet, 1-based) của dòng tiêu đề
+    first_row: int  # Số dòng (trong sheet) của dòng đầu lô, cho báo cáo validation
+    rows_total: Optional[int]  # Số dòng của sheet theo file (ước lượng, có thể None)
+    df: pd.DataFrame
+
+
+def _is_blank(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, float):
+        return value != value  # NaN (đường .xls)
+    if isinstance(value, str):
+        return not value.strip()
+    return False
+
+
+def _header_score(row: Sequence[Any]) -> int:
+    """Số cột chuẩn (HEADER_MAP) khác nhau mà dòng khớp"""
+    targets = {
+        HEADER_MAP.get(normalize_header(str(value)))
+        for value in row if not _is_blank(value)
+    }
+    targets.discard(None)
+    return len(targets)
+
+
+def detect_header_row(rows: Sequence[Sequence[Any]]) -> Optional[int]:
+    """
+    Tìm dòng tiêu đề trong các dòng đầu sheet.
+
+    Args:
+        rows: Các dòng đầu sheet (giá trị ô)
+
+    Returns:
+        Vị trí dòng khớp nhiều cột HEADER_MAP nhất (dòng đầu nếu bằng nhau);
+        không dòng nào khớp thì dòng không trống đầu tiên; None nếu sheet trống
+    """
+    best, best_score, first_filled = None, 0, None
+    for index, row in enumerate(rows):
+        if first_filled is None and not all(_is_blank(v) for v in row):
+            first_filled = index
+        score = _header_score(row)
+        if score > best_score:
+            best, best_score = index, score
+    return best if best is not None else first_filled
+
+
+def _column_names(row: Sequence[Any]) -> List[str]:
+    """Tên cột từ dòng tiêu đề (ô trống -> 'Unnamed: i', trùng -> thêm '.1', '.2')"""
+    names, seen = [], {}
+    for index, value in enumerate(row):
+        name = f"Unnamed: {index}" if _is_blank(value) else str(value).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _batches_from_rows(
+    rows: Iterable[Sequence[Any]],
+    sheet: str,
+    sheet_index: int,
+    sheet_count: int,
+    rows_total: Optional[int],
+    batch_size: int
+) -> Iterator[ExcelBatch]:
+    """Tìm dòng tiêu đề rồi gom các dòng còn lại của sheet thành lô"""
+    rows = iter(rows)
+    head = list(islice(rows, EXCEL_HEADER_SCAN_ROWS))
+    header_index = detect_header_row(head)
+    if header_index is None:
+        return
+
+    columns = _column_names(head[header_index])
+    width = len(columns)
+    empty_row = (None,) * width
+    header_row = header_index + 1
+    first_row = header_row + 1
+    batch: List[tuple] = []
+    blank_run = 0
+
+    def make_batch() -> ExcelBatch:
+        return ExcelBatch(
+            sheet, sheet_index, sheet_count, header_row, first_row, rows_total,
+            pd.DataFrame(batch, columns=columns, dtype=object)
+        )
+
+    for row in chain(head[header_index + 1:], rows):
+        if all(_is_blank(v) for v in row):
+            # Dòng trống cuối sheet (vùng có định dạng) bị bỏ; dòng trống
+            # giữa bảng được giữ để số dòng trong báo cáo khớp với file
+            blank_run += 1
+            continue
+        if blank_run:
+            batch.extend([empty_row] * blank_run)
+            blank_run = 0
+
+        row = tuple(row)
+        if len(row) != width:
+            row = (row + empty_row)[:width]
+        batch.append(row)
+
+        if len(batch) >= batch_size:
+            yield make_batch()
+            first_row += len(batch)
+            batch = []
+
+    if batch:
+        yield make_batch()
+
+
+def list_excel_sheets(file_path: str) -> List[str]:
+    """Tên các sheet theo thứ tự trong file"""
+    if Path(file_path).suffix.lower() == ".xls":
+        with pd.ExcelFile(file_path) as book:
+            return [str(name) for name in book.sheet_names]
+    workbook = load_workbook(file_path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def _select_sheets(available: List[str], sheet_name: Union[str, List[str], None]) -> List[str]:
+    if sheet_name is None:
+        return list(available)
+    sheets = [sheet_name] if isinstance(sheet_name, str) else list(sheet_name)
+    missing = [s for s in sheets if s not in available]
+    if missing:
+        raise ValueError(f"Không có sheet: {', '.join(missing)}")
+    return sheets
+
+
+def iter_excel_batches(
+    file_path: str,
+    sheet_name: Union[str, List[str], None] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[ExcelBatch]:
+    """
+    Đọc file Excel theo lô, lần lượt từng sheet.
+
+    Args:
+        file_path: Đường dẫn file .xlsx/.xlsm (.xls đọc bằng pandas)
+        sheet_name: Tên sheet, danh sách tên, hoặc None = mọi sheet
+        batch_size: Số dòng mỗi lô (default: EXCEL_BATCH_SIZE)
+
+    Yields:
+        ExcelBatch; cột là tên cột gốc của dòng tiêu đề, sheet trống bị bỏ qua
+
+    Raises:
+        ValueError: Không có sheet với tên đã chọn
+    """
+    if batch_size is None:
+        batch_size = EXCEL_BATCH_SIZE
+
+    if Path(file_path).suffix.lower() == ".xls":
+        sheets = _select_sheets(list_excel_sheets(file_path), sheet_name)
+        for index, sheet in enumerate(sheets):
+            df = pd.read_excel(file_path, sheet_name=sheet, header=None, dtype=object)
+            yield from _batches_from_rows(
+                df.itertuples(index=False, name=None), sheet, index, len(sheets), len(df), batch_size
+            )
+        return
+
+    # Mở workbook một lần: file không ghi kích thước sheet thì openpyxl
+    # phải quét cả sheet khi mở
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheets = _select_sheets(workbook.sheetnames, sheet_name)
+        for index, sheet in enumerate(sheets):
+            worksheet = workbook[sheet]
+            rows_total = worksheet.max_row
+            # Kích thước ghi trong file có thể sai (một số phần mềm ghi A1:A1)
+            # -> đọc đến dòng cuối thực tế
+            worksheet.reset_dimensions()
+            yield from _batches_from_rows(
+                worksheet.iter_rows(values_only=True), sheet, index, len(sheets), rows_total, batch_size
+            )
+    finally:
+        workbook.close()
@@ -35,13 +35,18 @@ EXPORT_COLUMNS = [
 ]
 
 
-def export_to_xlsx(data: List[Dict[str, Any]], filename: str = None) -> str:
+def export_to_xlsx(
+    data: List[Dict[str, Any]],
+    filename: str = None,
+    not_found: List[str] = None
+) -> str:
     """
     Export data to XLSX file
     
     Args:
         data: List of records to export
         filename: Optional custom filename
+        not_found: Passports not found in batch search (optional, extra sheet)
         
     Returns:
         Path to exported file
@@ -135,6 +140,17 @@ def export_to_xlsx(data: List[Dict[str, Any]], filename: str = None) -> str:
     # Freeze header row
     ws.freeze_panes = 'A2'
     
+    # Not found passports (batch search)
+    if not_found:
+        ws_nf = wb.create_sheet("Không tìm thấy")
+        cell = ws_nf.cell(row=1, column=1, value="Số hộ chiếu")
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = header_alignment
+        for row_idx, passport in enumerate(not_found, 2):
+            ws_nf.cell(row=row_idx, column=1, value=passport)
+        ws_nf.column_dimensions['A'].width = 20
+    
     # Save file
     output_path = Path(filename)
     wb.save(output_path)
@@ -0,0 +1,198 @@
+"""
+QLNNN Offline - Import Batches
+Sổ các lần import (import_batches) và rollback theo lô
+
+Mỗi lần import tạo một batch: file hash, người import, thời gian, số dòng.
+Dòng raw_immigration mang batch_id của lần ghi gần nhất; với dòng bị cập
+nhật, bản cũ được lưu vào import_before_image. rollback_batch() xóa các dòng
+của batch rồi chèn lại bản cũ - chỉ động tới các dòng của batch đó.
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from database.connection import get_connection, execute_query
+from database.models import refresh_derived_tables
+
+STATUS_RUNNING = "running"
+STATUS_COMMITTED = "committed"
+STATUS_FAILED = "failed"
+STATUS_ROLLED_BACK = "rolled_back"
+
+RAW_COLUMNS = (
+    "id, so_ho_chieu, passport_key, ho_ten, ngay_sinh, quoc_tich, ngay_den, ngay_di, "
+    "dia_chi_tam_tru, ket_qua_xac_minh, thoi_diem_cap_nhat, source_file, row_hash"
+)
+
+
+def start_batch(conn, file_hash: Optional[str], source_file: str, username: Optional[str] = None) -> int:
+    """
+    Mở một batch import (trạng thái running).
+
+    Args:
+        conn: Database connection
+        file_hash: SHA-256 của file (cache_key), None nếu không có
+        source_file: Tên file gốc
+        username: Người import
+
+    Returns:
+        ID của batch
+    """
+    batch_id = conn.execute(
+        """INSERT INTO import_batches (file_hash, source_file, username, status)
+           VALUES (?, ?, ?, ?) RETURNING id""",
+        (file_hash, source_file, username, STATUS_RUNNING)
+    ).fetchone()[0]
+    conn.commit()
+    return batch_id
+
+
+def finish_batch(conn, batch_id: Optional[int], result: Dict[str, Any],
+                 timings: Optional[Dict[str, float]] = None) -> None:
+    """
+    Đóng batch với số dòng/lỗi lấy từ kết quả import.
+
+    Args:
+        conn: Database connection
+        batch_id: ID từ start_batch() (None = bỏ qua)
+        result: Dict kết quả import (success, rows_*, error/errors)
+        timings: Thời gian từng giai đoạn (giây)
+    """
+    if batch_id is None:
+        return
+
+    error = result.get("error")
+    if not error and result.get("errors"):
+        error = "; ".join(result["errors"][:5])
+
+    conn.execute(
+        """UPDATE import_batches SET
+               status = ?,
+               finished_at = CURRENT_TIMESTAMP,
+               duration_s = epoch(CURRENT_TIMESTAMP) - epoch(started_at),
+               timings = ?,
+               rows_inserted = ?,
+               rows_updated = ?,
+               rows_unchanged = ?,
+               rows_skipped = ?,
+               error = ?
+           WHERE id = ?""",
+        (
+            STATUS_COMMITTED if result.get("success") else STATUS_FAILED,
+            json.dumps(timings) if timings else None,
+            result.get("rows_inserted", 0),
+            result.get("rows_updated", 0),
+            result.get("rows_unchanged", 0),
+            result.get("rows_skipped", 0),
+            error,
+            batch_id,
+        )
+    )
+    conn.commit()
+
+
+def list_batches(limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Các batch import gần nhất (mới nhất trước).
+
+    Args:
+        limit: Số batch tối đa
+
+    Returns:
+        List dict theo cột của import_batches
+    """
+    return execute_query(
+        "SELECT * FROM import_batches ORDER BY id DESC LIMIT ?",
+        (limit,)
+    )
+
+
+def rollback_batch(batch_id: int, username: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Hoàn tác một batch import: xóa dòng batch đã thêm, khôi phục bản cũ của
+    dòng batch đã cập nhật. Mọi câu lệnh lọc theo batch_id (có index), nên
+    chi phí theo kích thước batch chứ không theo kích thước bảng.
+
+    Batch có dòng đã bị batch sau ghi đè phải chờ các batch sau rollback
+    trước (theo thứ tự ngược).
+
+    Args:
+        batch_id: ID batch
+        username: Người thực hiện rollback
+
+    Returns:
+        Dict với success, rows_deleted, rows_restored hoặc error
+    """
+    conn = get_connection()
+
+    row = conn.execute("SELECT status FROM import_batches WHERE id = ?", (batch_id,)).fetchone()
+    if not row:
+        return {"success": False, "error": f"Không tìm thấy batch #{batch_id}"}
+    if row[0] == STATUS_ROLLED_BACK:
+        return {"success": False, "error": f"Batch #{batch_id} đã được rollback"}
+    if row[0] == STATUS_RUNNING:
+        return {"success": False, "error": f"Batch #{batch_id} đang chạy"}
+
+    later = conn.execute(
+        "SELECT DISTINCT batch_id FROM import_before_image WHERE prev_batch_id = ? ORDER BY batch_id",
+        (batch_id,)
+    ).fetchall()
+    if later:
+        return {
+            "success": False,
+            "error": (
+                f"Dữ liệu của batch #{batch_id} đã bị batch sau ghi đè "
+                f"({', '.join(f'#{r[0]}' for r in later)}), cần rollback các batch đó trước"
+            )
+        }
+
+    # Keys chạm tới, để cập nhật lại bảng dẫn xuất sau rollback
+    keys = conn.execute(
+        "SELECT passport_key AS so_ho_chieu, ngay_den FROM raw_immigration WHERE batch_id = ?",
+        (batch_id,)
+    ).df()
+
+    conn.begin()
+    try:
+        removed = conn.execute(
+            "DELETE FROM raw_immigration WHERE batch_id = ?", (batch_id,)
+        ).fetchone()[0]
+        restored = conn.execute(f"""
+            INSERT INTO raw_immigration ({RAW_COLUMNS}, batch_id)
+            SELECT {RAW_COLUMNS}, prev_batch_id
+            FROM import_before_image
+            WHERE batch_id = ?
+        """, (batch_id,)).fetchone()[0]
+        conn.execute("DELETE FROM import_before_image WHERE batch_id = ?", (batch_id,))
+        conn.execute(
+            """UPDATE import_batches
+               SET status = ?, rolled_back_at = CURRENT_TIMESTAMP, rolled_back_by = ?
+               WHERE id = ?""",
+            (STATUS_ROLLED_BACK, username, batch_id)
+        )
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        return {"success": False, "error": str(e)}
+
+    conn.register("temp_rollback_keys", keys)
+    conn.begin()
+    try:
+        refresh_derived_tables(conn, "temp_rollback_keys")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.unregister("temp_rollback_keys")
+
+    return {
+        "success": True,
+        "rows_deleted": removed - restored,
+        "rows_restored": restored,
+        "message": f"Đã rollback batch #{batch_id}: xóa {removed - restored:,} dòng thêm mới, khôi phục {restored:,} dòng"
+    }
@@ -0,0 +1,370 @@
+"""
+QLNNN Offline - Bulk Import
+Import nhiều file (hoặc file .zip) trong một lần, một transaction upsert
+
+Mỗi ngày có hàng chục file JSF. Các file được đọc + chuẩn hóa + validation
+song song trong process con (mỗi process một file), rồi gộp ở process chính:
+các dòng trùng (passport, ngày đến) được gộp theo dedupe_import_rows (dòng
+đầy đủ nhất, bằng nhau thì bản của file sau cùng theo thứ tự đầu vào).
+Toàn bộ được ghi bằng một lần upsert_raw_immigration trong một transaction,
+ghi vào một batch (rollback được cả lần import).
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import pandas as pd
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import JSF_EXTRACT_WORKERS
+from database.connection import get_connection
+from database.models import dedupe_import_rows, refresh_derived_tables, upsert_raw_immigration
+from modules.import_batches import finish_batch, start_batch
+from modules.excel_reader import iter_excel_batches
+from modules.import_cache import file_digest
+from modules.import_data import prepare_import_frame, read_csv_file
+from modules.import_jsf import extract_jsf_data, prepare_jsf_frame, _merge_validation_reports
+
+BULK_EXTENSIONS = {".jsf", ".pdf", ".csv", ".xlsx", ".xls"}
+
+
+def expand_bulk_files(file_paths: List[str], extract_dir: str) -> List[Path]:
+    """
+    Danh sách file cần import theo thứ tự; file .zip được giải nén vào
+    extract_dir (chỉ lấy file có đuôi hỗ trợ, theo thứ tự trong archive).
+
+    Args:
+        file_paths: Đường dẫn file/zip theo thứ tự ưu tiên (sau thắng trước)
+        extract_dir: Thư mục tạm để giải nén
+
+    Returns:
+        List đường dẫn file
+    """
+    files = []
+    for file_path in map(Path, file_paths):
+        if file_path.suffix.lower() != ".zip":
+            if file_path.suffix.lower() in BULK_EXTENSIONS:
+                files.append(file_path)
+            continue
+
+        with zipfile.ZipFile(file_path) as archive:
+            for index, info in enumerate(archive.infolist()):
+                # Chỉ dùng tên file (bỏ thư mục) để không ghi ra ngoài extract_dir
+                name = Path(info.filename).name
+                if info.is_dir() or name.startswith(".") or "__MACOSX" in info.filename:
+                    continue
+                if Path(name).suffix.lower() not in BULK_EXTENSIONS:
+                    continue
+                target = Path(extract_dir) / f"{file_path.stem}_{index}" / name
+                target.parent.mkdir(parents=True, exist_ok=True)
+                with archive.open(info) as src, open(target, "wb") as dst:
+                    while True:
+                        block = src.read(1024 * 1024)
+                        if not block:
+                            break
+                        dst.write(block)
+                files.append(target)
+    return files
+
+
+def _parse_bulk_file(file_path: str) -> Dict[str, Any]:
+    """
+    Đọc + chuẩn hóa + validation một file (chạy trong process con).
+
+    Returns:
+        Dict với source_file, file_hash, df (dòng hợp lệ), rows_read,
+        rows_invalid, validation_report, parse_s; hoặc error
+    """
+    start = time.perf_counter()
+    path = Path(file_path)
+    source_name = path.name
+    result = {"source_file": source_name, "df": None, "rows_read": 0, "rows_invalid": 0}
+
+    try:
+        result["file_hash"] = file_digest(file_path)
+        ext = path.suffix.lower()
+        if ext in (".xlsx", ".xls"):
+            prepared = _prepare_excel_file(file_path, source_name)
+            result["rows_read"] = prepared.pop("rows_read")
+            if result["rows_read"] == 0 and not prepared.get("error"):
+                prepared["error"] = "Không đọc được dữ liệu hoặc file trống"
+        else:
+            if ext in (".jsf", ".pdf"):
+                # Song song theo file, mỗi file đọc tuần tự trong process của nó
+                raw = extract_jsf_data(file_path, workers=1)
+            else:
+                raw = read_csv_file(file_path)
+
+            if raw is None or raw.empty:
+                result["error"] = "Không đọc được dữ liệu hoặc file trống"
+                return result
+
+            if ext in (".jsf", ".pdf"):
+                prepared = prepare_jsf_frame(raw, source_name)
+            else:
+                prepared = prepare_import_frame(raw, source_name)
+            result["rows_read"] = len(raw)
+
+        if prepared.get("error"):
+            result["error"] = prepared["error"]
+            return result
+
+        result["df"] = prepared["df"]
+        result["rows_invalid"] = prepared["rows_invalid_passport"] + prepared["rows_rejected"]
+        result["validation_report"] = prepared["validation_report"]
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        result["parse_s"] = time.perf_counter() - start
+    return result
+
+
+def _prepare_excel_file(file_path: str, source_name: str) -> Dict[str, Any]:
+    """
+    Đọc Excel theo lô (mọi sheet, xem modules/excel_reader) và chuẩn hóa
+    từng lô; sheet không có cột số hộ chiếu bị bỏ qua.
+
+    Returns:
+        Dict như prepare_import_frame (df gộp các lô) kèm rows_read
+    """
+    frames = []
+    rows_read = rows_invalid_passport = rows_rejected = 0
+    validation_report = {"total_errors": 0, "total_warnings": 0, "details": []}
+    sheet_errors = {}
+
+    for batch in iter_excel_batches(file_path):
+        if batch.sheet in sheet_errors:
+            continue
+        prepared = prepare_import_frame(batch.df, source_name, row_offset=batch.first_row)
+        if prepared.get("error"):
+            sheet_errors[batch.sheet] = prepared["error"]
+            continue
+        rows_read += len(batch.df)
+        rows_invalid_passport += prepared["rows_invalid_passport"]
+        rows_rejected += prepared["rows_rejected"]
+        _merge_validation_reports(validation_report, prepared["validation_report"])
+        frames.append(prepared["df"])
+
+    if not frames and sheet_errors:
+        return {"error": next(iter(sheet_errors.values())), "rows_read": rows_read}
+    return {
+        "df": pd.concat(frames, ignore_index=True) if frames else None,
+        "rows_read": rows_read,
+        "rows_invalid_passport": rows_invalid_passport,
+        "rows_rejected": rows_rejected,
+        "validation_report": validation_report,
+    }
+
+
+def _resolve_workers(workers: Optional[int], file_count: int) -> int:
+    """Số process đọc file (config/CPU, giới hạn theo số file)"""
+    if workers is None:
+        workers = JSF_EXTRACT_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, file_count))
+
+
+def _parse_files(
+    files: List[Path],
+    workers: int,
+    progress_callback: Callable[[float, str], None] = None
+) -> List[Dict[str, Any]]:
+    """Đọc các file song song, kết quả theo đúng thứ tự đầu vào"""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(files)
+
+    def report(done: int):
+        if progress_callback:
+            progress_callback(0.8 * done / len(files), f"Đã đọc {done}/{len(files)} file...")
+
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {executor.submit(_parse_bulk_file, str(f)): i for i, f in enumerate(files)}
+                for done, future in enumerate(as_completed(futures), start=1):
+                    results[futures[future]] = future.result()
+                    report(done)
+            return results
+        except (BrokenProcessPool, OSError) as e:
+            # Không tạo được process -> đọc tuần tự các file còn lại
+            print(f"Bulk import parallel parsing unavailable, continuing sequentially: {e}")
+
+    for i, file_path in enumerate(files):
+        if results[i] is None:
+            results[i] = _parse_bulk_file(str(file_path))
+        report(i + 1)
+    return results
+
+
+def import_bulk(
+    file_paths: List[str],
+    progress_callback: Callable[[float, str], None] = None,
+    workers: Optional[int] = None,
+    username: str = None,
+    conn=None,
+    source_name: Optional[str] = None,
+    resume: Optional[Dict[str, Any]] = None,
+    on_checkpoint: Callable[[Dict[str, Any]], None] = None
+) -> Dict[str, Any]:
+    """
+    Import nhiều file JSF/Excel/CSV (hoặc .zip chứa các file đó) trong một lần.
+
+    Các file được đọc song song (process pool), dòng hợp lệ của mọi file được
+    gộp lại; trùng (passport, ngày đến) thì giữ dòng đầy đủ nhất, bằng nhau
+    thì file sau trong danh sách thắng (kết quả xác minh của bản cũ được giữ
+    nếu bản thắng không có). Sau đó ghi bằng một lần upsert trong một
+    transaction và một batch.
+    File đọc lỗi được báo trong errors, các file còn lại vẫn được import.
+
+    Args:
+        file_paths: Đường dẫn các file/zip, theo thứ tự (đầy đủ như nhau thì file sau thắng)
+        progress_callback: Callback function(progress: float, message: str)
+        workers: Số process đọc file (None = JSF_EXTRACT_WORKERS, 0 = theo số CPU, 1 = tuần tự)
+        username: Người import (ghi vào import_batches)
+        conn: Database connection (default: shared connection)
+        source_name: Tên hiển thị của lần import (default: "<n> files")
+        resume: Checkpoint của lần chạy bị ngắt: dùng lại batch đã mở (một
+            transaction nên chưa có gì được commit), các file đọc lại từ đầu
+        on_checkpoint: Callback(state) khi mở batch
+
+    Returns:
+        Dict với kết quả tổng hợp và files: thống kê + tốc độ đọc từng file
+    """
+    if conn is None:
+        conn = get_connection()
+    start = time.perf_counter()
+    timings = {}
+
+    with tempfile.TemporaryDirectory(prefix="qlnnn_bulk_") as extract_dir:
+        files = expand_bulk_files(file_paths, extract_dir)
+        if not files:
+            return {
+                "success": False,
+                "error": "Không có file JSF/Excel/CSV nào để import",
+                "rows_imported": 0,
+                "rows_skipped": 0
+            }
+
+        if progress_callback:
+            progress_callback(0.0, f"Đang đọc {len(files)} file...")
+        parse_start = time.perf_counter()
+        parsed = _parse_files(files, _resolve_workers(workers, len(files)), progress_callback)
+        timings["parse"] = time.perf_counter() - parse_start
+
+    errors = [f"{p['source_file']}: {p['error']}" for p in parsed if p.get("error")]
+    validation_report = {"total_errors": 0, "total_warnings": 0, "details": []}
+    for p in parsed:
+        _merge_validation_reports(validation_report, p.get("validation_report"))
+
+    # Gộp theo thứ tự file; _file = vị trí file để thống kê
+    merge_start = time.perf_counter()
+    frames = [p["df"].assign(_file=i) for i, p in enumerate(parsed) if p.get("df") is not None and not p["df"].empty]
+    if not frames:
+        return {
+            "success": False,
+            "error": errors[0] if errors else "Không có dòng hợp lệ trong các file",
+            "errors": errors or None,
+            "rows_imported": 0,
+            "rows_skipped": sum(p["rows_read"] for p in parsed),
+            "validation_report": validation_report
+        }
+    merged = pd.concat(frames, ignore_index=True)
+
+    # Trùng (passport, ngày đến) trong và giữa các file: quy tắc chung của
+    # dedupe_import_rows (dòng đầy đủ nhất, bằng nhau thì dòng đọc sau cùng;
+    # kết quả xác minh gần nhất được giữ)
+    final_df, superseded = dedupe_import_rows(merged)
+    superseded_per_file = merged.loc[superseded, "_file"].value_counts()
+    final_df = final_df.drop(columns="_file")
+    timings["merge"] = time.perf_counter() - merge_start
+
+    digests = "".join(p.get("file_hash") or "" for p in parsed)
+
+    if progress_callback:
+        progress_callback(0.85, f"Đang ghi {len(final_df):,} dòng vào database...")
+    write_start = time.perf_counter()
+    batch_id = (resume or {}).get("batch_id")
+    try:
+        if batch_id is None:
+            batch_id = start_batch(
+                conn, hashlib.sha256(digests.encode("ascii")).hexdigest(),
+                source_name or f"{len(files)} files", username
+            )
+        if on_checkpoint:
+            on_checkpoint({"batch_id": batch_id})
+        conn.begin()
+        upsert = upsert_raw_immigration(conn, final_df, "temp_bulk_import", batch_id=batch_id)
+        timings["write"] = time.perf_counter() - write_start
+
+        refresh_start = time.perf_counter()
+        refresh_derived_tables(conn, "temp_bulk_import")
+        conn.commit()
+        timings["refresh"] = time.perf_counter() - refresh_start
+    except Exception as e:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result = {
+            "success": False,
+            "error": str(e),
+            "rows_imported": 0,
+            "rows_skipped": len(merged)
+        }
+        finish_batch(conn, batch_id, result)
+        return result
+    finally:
+        try:
+            conn.unregister("temp_bulk_import")
+        except Exception:
+            pass
+
+    timings["total"] = time.perf_counter() - start
+    timings = {k: round(v, 3) for k, v in timings.items()}
+
+    files_report = []
+    for i, p in enumerate(parsed):
+        rows_valid = 0 if p.get("df") is None else len(p["df"])
+        files_report.append({
+            "source_file": p["source_file"],
+            "rows_read": p["rows_read"],
+            "rows_valid": rows_valid,
+            "rows_invalid": p["rows_invalid"],
+            "rows_superseded": int(superseded_per_file.get(i, 0)),
+            "parse_s": round(p["parse_s"], 3),
+            "rows_per_s": round(p["rows_read"] / p["parse_s"]) if p["parse_s"] > 0 else None,
+            "error": p.get("error"),
+        })
+
+    if progress_callback:
+        progress_callback(1.0, "Hoàn thành!")
+
+    result = {
+        "success": not errors,
+        "batch_id": batch_id,
+        "rows_imported": upsert["inserted"] + upsert["updated"] + upsert["unchanged"],
+        "rows_inserted": upsert["inserted"],
+        "rows_updated": upsert["updated"],
+        "rows_unchanged": upsert["unchanged"],
+        "rows_skipped": (
+            sum(f["rows_invalid"] for f in files_report)
+            + int(superseded.sum()) + upsert["duplicates"]
+        ),
+        "rows_superseded": int(superseded.sum()),
+        "files": files_report,
+        "timings": timings,
+        "errors": errors or None,
+        "validation_report": validation_report,
+        "source_file": source_name or f"{len(files)} files"
+    }
+    finish_batch(conn, batch_id, result, timings=timings)
+    return result
@@ -0,0 +1,416 @@
+"""
+QLNNN Offline - Import Cache
+Cache bảng trích xuất theo nội dung file upload (SHA-256)
+
+Admin thường upload lại đúng file JSF/Excel sau một lần import lỗi hoặc dở
+dang. Bảng đã trích xuất được lưu dưới data/imports/cache/<key>/ dạng các
+phần Parquet (ghi/đọc bằng DuckDB, không cần pyarrow) để lần sau bỏ qua bước
+đọc file. Import theo luồng ghi từng phần khi đọc và đọc lại từng phần, nên
+không phải giữ cả bảng trong bộ nhớ.
+
+- Key = SHA-256 của bytes file (kèm biến thể, vd. tên sheet Excel)
+- Giới hạn dung lượng (IMPORT_CACHE_MAX_MB), xóa mục ít dùng nhất trước (LRU)
+- Ghi nhận lần import thành công cuối cùng: nếu dữ liệu DB không đổi kể từ
+  đó thì import lại cùng file chỉ báo "đã import ngày ..."
+"""
+
+import hashlib
+import json
+import shutil
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import duckdb
+import pandas as pd
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+from config import IMPORT_CACHE_DIR, IMPORT_CACHE_MAX_MB
+
+INDEX_FILE = "index.json"
+PARTIAL_SUFFIX = ".partial"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_lock = threading.Lock()
+
+
+def file_digest(file_path: str) -> str:
+    """SHA-256 (hex) của nội dung file, đọc theo block"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(file_path: str, variant: Optional[str] = None, digest: Optional[str] = None) -> str:
+    """
+    Key cache = SHA-256 của nội dung file (kèm biến thể nếu có).
+
+    Args:
+        file_path: Đường dẫn file
+        variant: Phân biệt các bảng khác nhau từ cùng một file (vd. tên sheet)
+        digest: file_digest() đã tính sẵn (tránh đọc file lần nữa)
+
+    Returns:
+        Key của cache
+    """
+    key = digest or file_digest(file_path)
+    if variant:
+        key = hashlib.sha256(f"{key}\0{variant}".encode("utf-8")).hexdigest()
+    return key
+
+
+# ============================================
+# INDEX (metadata các mục cache)
+# ============================================
+
+def _index_path() -> Path:
+    return IMPORT_CACHE_DIR / INDEX_FILE
+
+
+def _read_index() -> Dict[str, Dict[str, Any]]:
+    path = _index_path()
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"Import cache index error: {e}")
+        return {}
+
+
+def _write_index(index: Dict[str, Dict[str, Any]]) -> None:
+    IMPORT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = _index_path()
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(index, ensure_ascii=False, indent=1), encoding="utf-8")
+    tmp_path.replace(path)
+
+
+def _data_dir(key: str) -> Path:
+    return IMPORT_CACHE_DIR / key
+
+
+def _partial_dir(key: str) -> Path:
+    return IMPORT_CACHE_DIR / f"{key}{PARTIAL_SUFFIX}"
+
+
+def _part_path(directory: Path, part_no: int) -> Path:
+    return directory / f"part-{part_no:05d}.parquet"
+
+
+def _dir_size(directory: Path) -> int:
+    return sum(p.stat().st_size for p in directory.glob("*.parquet"))
+
+
+def _drop_table(key: str, entry: Dict[str, Any]) -> None:
+    """Xóa các phần của bảng, giữ metadata import"""
+    shutil.rmtree(_data_dir(key), ignore_errors=True)
+    for field in ("parts", "size", "rows", "last_used"):
+        entry.pop(field, None)
+
+
+def _cacheable(df: pd.DataFrame) -> bool:
+    # Tên cột không phải chuỗi hoặc trùng tên: đọc lại từ Parquet sẽ không ra đúng bảng
+    columns = list(df.columns)
+    return all(isinstance(c, str) for c in columns) and len(set(columns)) == len(columns)
+
+
+def _write_parquet(df: pd.DataFrame, path: Path) -> None:
+    # Connection DuckDB riêng trong bộ nhớ: không đụng transaction của DB chính
+    con = duckdb.connect()
+    try:
+        con.register("cache_df", df)
+        target = path.as_posix().replace("'", "''")
+        con.execute(f"COPY cache_df TO '{target}' (FORMAT PARQUET)")
+    finally:
+        con.close()
+
+
+def _read_parquet(path: Path) -> pd.DataFrame:
+    con = duckdb.connect()
+    try:
+        return con.execute("SELECT * FROM read_parquet(?)", [path.as_posix()]).df()
+    finally:
+        con.close()
+
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _evict(index: Dict[str, Dict[str, Any]], max_bytes: int) -> List[str]:
+    """
+    Xóa bảng của các mục ít dùng nhất cho đến khi tổng dung lượng <= max_bytes.
+    Mục đã từng import thành công giữ lại metadata (imported_at).
+
+    Returns:
+        List key đã bị xóa bảng
+    """
+    cached = [(k, v) for k, v in index.items() if v.get("parts")]
+    total = sum(v.get("size", 0) for _, v in cached)
+    evicted = []
+
+    for key, entry in sorted(cached, key=lambda kv: kv[1].get("last_used", "")):
+        if total <= max_bytes:
+            break
+        total -= entry.get("size", 0)
+        _drop_table(key, entry)
+        if not entry.get("imported_at"):
+            del index[key]
+        evicted.append(key)
+
+    return evicted
+
+
+# ============================================
+# BẢNG TRÍCH XUẤT
+# ============================================
+
+def cached_table_parts(key: str) -> Optional[List[Path]]:
+    """
+    Các file phần của bảng đã trích xuất, theo thứ tự (đánh dấu vừa dùng).
+
+    Returns:
+        List đường dẫn hoặc None nếu chưa có / thiếu file
+    """
+    with _lock:
+        index = _read_index()
+        entry = index.get(key)
+        if not entry or not entry.get("parts"):
+            return None
+
+        directory = _data_dir(key)
+        parts = [_part_path(directory, i) for i in range(entry["parts"])]
+        if not all(p.exists() for p in parts):
+            # File bị xóa ngoài ý muốn -> coi như miss
+            _drop_table(key, entry)
+            _write_index(index)
+            return None
+
+        entry["last_used"] = _now()
+        _write_index(index)
+        return parts
+
+
+def iter_cached_table(parts: List[Path]) -> Iterator[pd.DataFrame]:
+    """Đọc lần lượt từng phần (bộ nhớ giới hạn theo một phần)"""
+    for path in parts:
+        yield _read_parquet(path)
+
+
+def load_cached_table(key: str) -> Optional[pd.DataFrame]:
+    """
+    Đọc cả bảng đã trích xuất từ cache.
+
+    Returns:
+        DataFrame hoặc None nếu chưa có / lỗi đọc
+    """
+    parts = cached_table_parts(key)
+    if parts is None:
+        return None
+
+    try:
+        return pd.concat(iter_cached_table(parts), ignore_index=True)
+    except Exception as e:
+        # File hỏng -> coi như miss
+        print(f"Import cache read error ({key[:12]}): {e}")
+        with _lock:
+            index = _read_index()
+            if key in index:
+                _drop_table(key, index[key])
+                _write_index(index)
+        return None
+
+
+def write_cached_part(key: str, part_no: int, df: pd.DataFrame) -> bool:
+    """
+    Ghi một phần của bảng đang trích xuất (chưa đọc được cho đến khi
+    finish_cached_parts). Vượt IMPORT_CACHE_MAX_MB thì bỏ cả bảng.
+
+    Args:
+        key: Key từ cache_key()
+        part_no: Số thứ tự phần, từ 0
+        df: Dòng của phần này
+
+    Returns:
+        True nếu đã ghi; False = bảng không được cache (đã dọn các phần)
+    """
+    max_bytes = IMPORT_CACHE_MAX_MB * 1024 * 1024
+    if max_bytes <= 0 or df is None or not _cacheable(df):
+        discard_cached_parts(key)
+        return False
+
+    directory = _partial_dir(key)
+    if part_no == 0:
+        shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    try:
+        _write_parquet(df.reset_index(drop=True), _part_path(directory, part_no))
+    except Exception as e:
+        print(f"Import cache write error ({key[:12]}): {e}")
+        discard_cached_parts(key)
+        return False
+
+    if _dir_size(directory) > max_bytes:
+        discard_cached_parts(key)
+        return False
+    return True
+
+
+def finish_cached_parts(key: str, parts: int, rows: int, source_name: str, **meta: Any) -> bool:
+    """
+    Đưa bảng đã ghi đủ các phần vào cache rồi dọn theo LRU.
+
+    Args:
+        key: Key từ cache_key()
+        parts: Số phần đã ghi
+        rows: Tổng số dòng
+        source_name: Tên file gốc (để hiển thị)
+        **meta: Metadata thêm (vd. pages)
+
+    Returns:
+        True nếu bảng còn trong cache
+    """
+    max_bytes = IMPORT_CACHE_MAX_MB * 1024 * 1024
+    partial = _partial_dir(key)
+    if parts <= 0 or not partial.exists():
+        discard_cached_parts(key)
+        return False
+
+    with _lock:
+        directory = _data_dir(key)
+        shutil.rmtree(directory, ignore_errors=True)
+        partial.replace(directory)
+
+        index = _read_index()
+        entry = index.setdefault(key, {})
+        entry.update(meta)
+        entry.update({
+            "source_file": source_name,
+            "parts": parts,
+            "size": _dir_size(directory),
+            "rows": rows,
+            "created_at": _now(),
+            "last_used": _now(),
+        })
+        _evict(index, max_bytes)
+        _write_index(index)
+        return bool(index.get(key, {}).get("parts"))
+
+
+def discard_cached_parts(key: str) -> None:
+    """Xóa các phần đang ghi dở (import dừng giữa chừng / không cache)"""
+    shutil.rmtree(_partial_dir(key), ignore_errors=True)
+
+
+def store_cached_table(key: str, df: pd.DataFrame, source_name: str, **meta: Any) -> bool:
+    """
+    Lưu cả bảng đã trích xuất vào cache (một phần Parquet) rồi dọn theo LRU.
+
+    Args:
+        key: Key từ cache_key()
+        df: Bảng trích xuất
+        source_name: Tên file gốc (để hiển thị)
+        **meta: Metadata thêm (vd. pages)
+
+    Returns:
+        True nếu đã lưu
+    """
+    if df is None or df.empty or not write_cached_part(key, 0, df):
+        return False
+    return finish_cached_parts(key, 1, len(df), source_name, **meta)
+
+
+def get_cache_entry(key: str) -> Optional[Dict[str, Any]]:
+    """Metadata của một mục cache (None nếu chưa có)"""
+    with _lock:
+        return _read_index().get(key)
+
+
+# ============================================
+# TRẠNG THÁI IMPORT
+# ============================================
+
+def _data_signature(conn) -> List[Any]:
+    """
+    Trạng thái raw_immigration: số dòng, id lớn nhất, lần cập nhật cuối.
+    Đổi khi có insert/update/delete sau lần import được ghi nhận.
+    """
+    row = conn.execute("""
+        SELECT COUNT(*), COALESCE(MAX(id), 0), CAST(MAX(thoi_diem_cap_nhat) AS VARCHAR)
+        FROM raw_immigration
+    """).fetchone()
+    return [int(row[0]), int(row[1]), row[2]]
+
+
+def mark_imported(key: Optional[str], conn, rows_imported: int) -> None:
+    """
+    Ghi nhận import thành công của file (gọi sau commit).
+
+    Args:
+        key: Key từ cache_key() (None = bỏ qua)
+        conn: Database connection
+        rows_imported: Số dòng đã ghi
+    """
+    if not key:
+        return
+    with _lock:
+        index = _read_index()
+        entry = index.setdefault(key, {})
+        entry.update({
+            "imported_at": _now(),
+            "rows_imported": rows_imported,
+            "data_signature": _data_signature(conn),
+        })
+        _write_index(index)
+
+
+def check_already_imported(key: str, conn, source_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Kiểm tra file đã import thành công và dữ liệu DB không đổi kể từ đó.
+
+    Returns:
+        Dict kết quả import (already_imported=True) hoặc None nếu cần import
+    """
+    entry = get_cache_entry(key)
+    if not entry or not entry.get("imported_at"):
+        return None
+    if entry.get("data_signature") != _data_signature(conn):
+        return None
+
+    imported_at = datetime.fromisoformat(entry["imported_at"])
+    return {
+        "success": True,
+        "already_imported": True,
+        "imported_at": entry["imported_at"],
+        "message": (
+            f"File đã được import ngày {imported_at.strftime('%d/%m/%Y %H:%M')} "
+            f"({entry.get('rows_imported', 0):,} dòng), dữ liệu không thay đổi kể từ đó"
+        ),
+        "rows_imported": 0,
+        "rows_skipped": 0,
+        "source_file": source_name
+    }
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """
+    Thống kê cache.
+
+    Returns:
+        Dict với entries, tables, size_mb, max_mb
+    """
+    with _lock:
+        index = _read_index()
+    tables = [v for v in index.values() if v.get("parts")]
+    return {
+        "entries": len(index),
+        "tables": len(tables),
+        "size_mb": round(sum(v.get("size", 0) for v in tables) / 1024 / 1024, 1),
+        "max_mb": IMPORT_CACHE_MAX_MB,
+    }
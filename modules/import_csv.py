@@ -0,0 +1,407 @@
+"""
+QLNNN Offline - CSV Import (DuckDB)
+Đọc CSV bằng read_csv của DuckDB, không qua pandas
+
+File CSV export có thể vài GB: pd.read_csv nạp cả file vào bộ nhớ dưới dạng
+object trước khi xử lý. Ở đây DuckDB đọc file (song song, mọi cột là
+VARCHAR nên số hộ chiếu toàn số không mất số 0 đầu), map header theo
+HEADER_MAP, chuẩn hóa + validation bằng SQL vào một bảng tạm, rồi ghi DB
+theo lô CSV_CHUNK_SIZE dòng. Bộ nhớ Python chỉ giữ một lô; bảng dẫn xuất
+(travel_group, address_token, Bloom filter) được làm mới một lần ở cuối.
+
+Encoding được đoán từ các byte đầu file. DuckDB chỉ đọc được utf-8, utf-16
+và latin-1; file cp1252 (hoặc đọc lỗi) trả về None để import_csv dùng lại
+đường pandas.
+"""
+
+import codecs
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+import duckdb
+
+from config import CSV_CHUNK_SIZE, CSV_ENCODING_SAMPLE_BYTES, HEADER_MAP
+from database.models import completeness_sql, refresh_derived_tables, upsert_raw_immigration
+from modules.import_batches import finish_batch, start_batch
+from utils.date_utils import date_parse_sql, date_parts_sql
+from utils.text_utils import normalize_passport_sql, normalize_header
+from utils.validators import validate_import_table
+
+# Giá trị coi là rỗng (như na_values mặc định của pd.read_csv)
+CSV_NULL_STRINGS = ["", "#N/A", "N/A", "NA", "NULL", "NaN", "nan", "None", "null", "n/a", "<NA>"]
+
+DATE_COLUMNS = ["ngay_sinh", "ngay_den", "ngay_di"]
+
+
+def detect_csv_encoding(file_path: str, preferred: str = "utf-8") -> Optional[str]:
+    """
+    Đoán encoding của file CSV từ CSV_ENCODING_SAMPLE_BYTES byte đầu.
+
+    Args:
+        file_path: Đường dẫn file
+        preferred: Encoding người dùng chọn (latin-1 được dùng nếu không phải UTF)
+
+    Returns:
+        "utf-8", "utf-16", "latin-1" (tên encoding của read_csv),
+        hoặc None nếu file có vẻ là cp1252 (DuckDB không đọc được)
+    """
+    with open(file_path, "rb") as f:
+        sample = f.read(CSV_ENCODING_SAMPLE_BYTES)
+
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:
+        # final=False: ký tự nhiều byte bị cắt ở cuối mẫu không tính là lỗi
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # Byte 0x80-0x9F là ký tự in được trong cp1252 nhưng là mã điều khiển trong latin-1
+    if preferred.lower().replace("_", "-") not in ("latin-1", "latin1", "iso-8859-1") and \
+            any(0x80 <= b <= 0x9F for b in sample):
+        return None
+    return "latin-1"
+
+
+def csv_reader_sql(file_path: str, encoding: str) -> str:
+    """
+    Biểu thức read_csv của DuckDB cho file: có header, mọi cột VARCHAR,
+    giá trị rỗng theo CSV_NULL_STRINGS.
+    """
+    path = str(file_path).replace("'", "''")
+    nulls = ", ".join("'" + v.replace("'", "''") + "'" for v in CSV_NULL_STRINGS)
+    return (
+        f"read_csv('{path}', header = true, all_varchar = true, "
+        f"encoding = '{encoding}', nullstr = [{nulls}])"
+    )
+
+
+def map_csv_columns(columns: List[str]) -> Dict[str, str]:
+    """
+    Map header của file sang cột chuẩn qua HEADER_MAP (cột đầu tiên thắng
+    nếu nhiều header cùng map vào một cột).
+
+    Returns:
+        Dict cột chuẩn -> tên cột trong file
+    """
+    mapping = {}
+    for col in columns:
+        target = HEADER_MAP.get(normalize_header(str(col)))
+        if target and target not in mapping:
+            mapping[target] = col
+    if "dia_chi" in mapping:
+        mapping.setdefault("dia_chi_tam_tru", mapping.pop("dia_chi"))
+    return mapping
+
+
+def _stage_sql(reader: str, mapping: Dict[str, str], stage: str) -> str:
+    """Câu lệnh tạo bảng tạm: mỗi dòng file đã chuẩn hóa, ngày đã parse"""
+    def source(name: str) -> str:
+        if name not in mapping:
+            return "NULL"
+        return '"' + mapping[name].replace('"', '""') + '"'
+
+    date_columns = []
+    for name in DATE_COLUMNS:
+        cases = date_parse_sql(f"{name}_parts")
+        date_columns.append(f"COALESCE({', '.join(expr for _, expr in cases)}) AS {name}")
+        labels = " ".join(f"WHEN {expr} IS NOT NULL THEN '{label}'" for label, expr in cases)
+        date_columns.append(
+            f"CASE WHEN {name}_text IS NULL THEN 'empty' {labels} ELSE 'invalid' END AS {name}_format"
+        )
+
+    # row_no = số dòng trong file (dòng 1 là header), dùng trong báo cáo validation
+    return f"""
+        CREATE TEMP TABLE {stage} AS
+        WITH src AS (
+            SELECT ROW_NUMBER() OVER () + 1 AS row_no, *
+            FROM {reader}
+        ),
+        norm AS (
+            SELECT
+                row_no,
+                {normalize_passport_sql(source('so_ho_chieu'))} AS so_ho_chieu,
+                TRIM({source('ho_ten')}) AS ho_ten,
+                UPPER(TRIM({source('quoc_tich')})) AS quoc_tich,
+                TRIM({source('dia_chi_tam_tru')}) AS dia_chi_tam_tru,
+                TRIM({source('ket_qua_xac_minh')}) AS ket_qua_xac_minh,
+                {', '.join(f"NULLIF(TRIM({source(name)}), '') AS {name}_text" for name in DATE_COLUMNS)}
+            FROM src
+        ),
+        parts AS (
+            -- Mỗi ngày chỉ chạy regex một lần, các format đọc từ struct
+            SELECT *, {', '.join(f"{date_parts_sql(name + '_text')} AS {name}_parts" for name in DATE_COLUMNS)}
+            FROM norm
+        )
+        SELECT
+            row_no, so_ho_chieu, ho_ten, quoc_tich, dia_chi_tam_tru, ket_qua_xac_minh,
+            {', '.join(date_columns)},
+            TRUE AS valid
+        FROM parts
+    """
+
+
+def import_csv_native(
+    file_path: str,
+    conn,
+    encoding: str = "utf-8",
+    file_hash: Optional[str] = None,
+    username: Optional[str] = None,
+    progress_callback: Callable[[float, str], None] = None,
+    chunk_size: Optional[int] = None,
+    resume: Optional[Dict[str, Any]] = None,
+    on_checkpoint: Callable[[Dict[str, Any]], None] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Import CSV vào raw_immigration bằng DuckDB (read_csv + SQL).
+
+    Cùng quy tắc với _process_dataframe: header theo HEADER_MAP, chuẩn hóa
+    passport/text/ngày, validation (validate_import_table), upsert theo
+    (passport, ngày đến). Trùng (passport, ngày đến) trong file: dòng sau
+    thắng. Số dòng trong validation_report là số dòng thật trong file.
+
+    Args:
+        file_path: Đường dẫn file CSV
+        conn: Database connection
+        encoding: Encoding người dùng chọn (gợi ý cho detect_csv_encoding)
+        file_hash: SHA-256 của file (ghi vào import_batches)
+        username: Người import
+        progress_callback: Callback function(progress: float, message: str)
+        chunk_size: Số dòng mỗi lô ghi DB (default: CSV_CHUNK_SIZE)
+        resume: Checkpoint cuối cùng của lần chạy bị ngắt (None = từ đầu)
+        on_checkpoint: Callback(state) khi mở batch và sau mỗi lô đã commit
+            (batch_id, dòng bắt đầu lô kế tiếp, số dòng cộng dồn)
+
+    Returns:
+        Dict kết quả import, hoặc None nếu DuckDB không đọc được file
+        (encoding cp1252, file lỗi) - khi đó dùng đường pandas
+    """
+    csv_encoding = detect_csv_encoding(file_path, encoding)
+    if csv_encoding is None:
+        return None
+
+    chunk_size = chunk_size or CSV_CHUNK_SIZE
+    source_name = Path(file_path).name
+    reader = csv_reader_sql(file_path, csv_encoding)
+    stage = f"temp_csv_stage_{uuid.uuid4().hex[:8]}"
+    timings = {}
+
+    def report(progress: float, message: str):
+        if progress_callback:
+            progress_callback(progress, message)
+
+    try:
+        report(0.0, "Đang đọc file CSV...")
+        read_start = time.perf_counter()
+        try:
+            columns = [row[0] for row in conn.execute(f"DESCRIBE SELECT * FROM {reader}").fetchall()]
+            mapping = map_csv_columns(columns)
+            if "so_ho_chieu" not in mapping:
+                return {
+                    "success": False,
+                    "error": "Missing required columns: so_ho_chieu",
+                    "rows_imported": 0,
+                    "rows_skipped": 0
+                }
+            conn.execute(_stage_sql(reader, mapping, stage))
+        except duckdb.Error as e:
+            print(f"DuckDB CSV reader failed for {source_name}, falling back to pandas: {e}")
+            return None
+        timings["read"] = time.perf_counter() - read_start
+
+        total_rows = conn.execute(f"SELECT COUNT(*) FROM {stage}").fetchone()[0]
+        if total_rows == 0:
+            return {
+                "success": False,
+                "error": "File is empty",
+                "rows_imported": 0,
+                "rows_skipped": 0
+            }
+
+        # Dòng không có số hộ chiếu hợp lệ
+        rows_skipped = conn.execute(
+            f"DELETE FROM {stage} WHERE so_ho_chieu = ''"
+        ).fetchone()[0]
+        if rows_skipped == total_rows:
+            return {
+                "success": True,
+                "rows_imported": 0,
+                "rows_skipped": rows_skipped,
+                "source_file": source_name
+            }
+
+        report(0.1, "Đang kiểm tra dữ liệu...")
+        validate_start = time.perf_counter()
+        date_format_hits = {}
+        for name in DATE_COLUMNS:
+            hits = conn.execute(f"SELECT {name}_format, COUNT(*) FROM {stage} GROUP BY 1").fetchall()
+            date_format_hits[name] = {label: count for label, count in hits}
+
+        validation_report = validate_import_table(conn, stage, max_rows=100)
+        rows_rejected = conn.execute(f"SELECT COUNT(*) FROM {stage} WHERE NOT valid").fetchone()[0]
+        timings["validate"] = time.perf_counter() - validate_start
+
+        if rows_rejected == total_rows - rows_skipped:
+            return {
+                "success": False,
+                "error": "All rows failed validation. See report.",
+                "rows_imported": 0,
+                "rows_skipped": rows_skipped + rows_rejected,
+                "validation_report": validation_report
+            }
+
+        # Trùng (passport, ngày đến) trong file: cùng quy tắc với
+        # dedupe_import_rows - dòng đầy đủ nhất thắng, bằng nhau thì dòng sau;
+        # dòng thắng không có kết quả xác minh thì lấy kết quả gần nhất của nhóm
+        dedupe = f"{stage}_dedupe"
+        conn.execute(f"""
+            CREATE TEMP TABLE {dedupe} AS
+            SELECT row_no, rn, latest_result
+            FROM (
+                SELECT
+                    row_no,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY so_ho_chieu, ngay_den
+                        ORDER BY {completeness_sql(stage)} DESC, row_no DESC
+                    ) AS rn,
+                    arg_max(ket_qua_xac_minh, row_no) FILTER (
+                        WHERE NULLIF(TRIM(ket_qua_xac_minh), '') IS NOT NULL
+                    ) OVER (PARTITION BY so_ho_chieu, ngay_den) AS latest_result,
+                    COUNT(*) OVER (PARTITION BY so_ho_chieu, ngay_den) AS group_size
+                FROM {stage}
+                WHERE valid AND ngay_den IS NOT NULL
+            )
+            WHERE group_size > 1
+        """)
+        try:
+            conn.execute(f"""
+                UPDATE {stage}
+                SET ket_qua_xac_minh = d.latest_result
+                FROM {dedupe} d
+                WHERE {stage}.row_no = d.row_no AND d.rn = 1
+                  AND d.latest_result IS NOT NULL
+                  AND NULLIF(TRIM({stage}.ket_qua_xac_minh), '') IS NULL
+            """)
+            duplicates = conn.execute(f"""
+                DELETE FROM {stage}
+                WHERE row_no IN (SELECT row_no FROM {dedupe} WHERE rn > 1)
+            """).fetchone()[0]
+        finally:
+            conn.execute(f"DROP TABLE IF EXISTS {dedupe}")
+
+        resume = resume or {}
+        first_row, last_row = conn.execute(f"SELECT MIN(row_no), MAX(row_no) FROM {stage} WHERE valid").fetchone()
+        totals = {"inserted": 0, "updated": 0, "unchanged": 0, "duplicates": duplicates}
+        timings["write"] = 0.0
+        temp_table = f"temp_csv_chunk_{uuid.uuid4().hex[:8]}"
+        # Khóa đã ghi của mọi lô: bảng dẫn xuất được làm mới một lần ở cuối
+        keys_table = f"{stage}_keys"
+        conn.execute(f"CREATE OR REPLACE TEMP TABLE {keys_table} (so_ho_chieu VARCHAR, ngay_den DATE)")
+
+        batch_id = resume.get("batch_id")
+        if batch_id is None:
+            batch_id = start_batch(conn, file_hash, source_name, username)
+        else:
+            # Import tiếp: bảng stage đọc lại từ file cho cùng row_no, các lô
+            # đã commit được bỏ qua; khóa của chúng vẫn cần làm mới ở cuối
+            first_row = resume.get("row", first_row)
+            for field in ("inserted", "updated", "unchanged", "duplicates"):
+                totals[field] = resume.get(field, totals[field])
+            conn.execute(
+                f"INSERT INTO {keys_table} SELECT passport_key, ngay_den FROM raw_immigration WHERE batch_id = ?",
+                (batch_id,)
+            )
+
+        def checkpoint(next_row: int):
+            if on_checkpoint:
+                on_checkpoint({"batch_id": batch_id, "row": next_row, **totals})
+
+        checkpoint(first_row)
+        try:
+            for start in range(first_row, last_row + 1, chunk_size):
+                write_start = time.perf_counter()
+                chunk = conn.execute(f"""
+                    SELECT
+                        so_ho_chieu, ho_ten, strftime(ngay_sinh, '%Y-%m-%d') AS ngay_sinh, quoc_tich,
+                        strftime(ngay_den, '%Y-%m-%d') AS ngay_den, strftime(ngay_di, '%Y-%m-%d') AS ngay_di,
+                        dia_chi_tam_tru, ket_qua_xac_minh, ? AS source_file
+                    FROM {stage}
+                    WHERE valid AND row_no >= ? AND row_no < ?
+                    ORDER BY row_no
+                """, (source_name, start, start + chunk_size)).df()
+                if chunk.empty:
+                    continue
+
+                # Before-image, upsert và khóa của lô trong cùng một transaction
+                conn.begin()
+                try:
+                    upsert = upsert_raw_immigration(conn, chunk, temp_table, batch_id=batch_id)
+                    conn.execute(f"INSERT INTO {keys_table} SELECT so_ho_chieu, ngay_den FROM {temp_table}")
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    try:
+                        conn.unregister(temp_table)
+                    except Exception:
+                        pass
+
+                for field in ("inserted", "updated", "unchanged", "duplicates"):
+                    totals[field] += upsert[field]
+                checkpoint(start + chunk_size)
+                timings["write"] += time.perf_counter() - write_start
+                report(
+                    0.1 + 0.9 * min((start + chunk_size - first_row) / (last_row - first_row + 1), 1.0),
+                    f"Đã ghi {totals['inserted'] + totals['updated'] + totals['unchanged']:,} dòng..."
+                )
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": str(e),
+                "rows_imported": totals["inserted"] + totals["updated"] + totals["unchanged"],
+                "rows_skipped": rows_skipped + rows_rejected
+            }
+            finish_batch(conn, batch_id, result)
+            return result
+        finally:
+            # Các lô đã commit (kể cả khi lỗi giữa chừng) vẫn được làm mới
+            refresh_start = time.perf_counter()
+            conn.begin()
+            try:
+                refresh_derived_tables(conn, keys_table)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                print(f"CSV import derived tables refresh error: {e}")
+            timings["refresh"] = time.perf_counter() - refresh_start
+            conn.execute(f"DROP TABLE IF EXISTS {keys_table}")
+
+        result = {
+            "success": True,
+            "batch_id": batch_id,
+            "rows_imported": totals["inserted"] + totals["updated"] + totals["unchanged"],
+            "rows_inserted": totals["inserted"],
+            "rows_updated": totals["updated"],
+            "rows_unchanged": totals["unchanged"],
+            "rows_skipped": rows_skipped + rows_rejected + totals["duplicates"],
+            "errors": None,
+            "validation_report": validation_report,
+            "date_format_hits": date_format_hits,
+            "timings": {k: round(v, 3) for k, v in timings.items()},
+            "engine": "duckdb",
+            "encoding": csv_encoding,
+            "source_file": source_name
+        }
+        finish_batch(conn, batch_id, result, timings=result["timings"])
+        report(1.0, "Hoàn thành!")
+        return result
+
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {stage}")
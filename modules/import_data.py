@@ -3,40 +3,261 @@ QLNNN Offline - Import Data Module
 Port từ Bigquerry_Connector.gs - Import Excel/CSV
 """
 
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Callable, List, Dict, Any, Optional, Tuple, Union
 from pathlib import Path
 import pandas as pd
+import numpy as np
 from datetime import datetime
 import sys
+import time
+import uuid
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from database.connection import get_connection
-from utils.date_utils import format_date_for_db, parse_date_vn
-from utils.text_utils import normalize_passport, normalize_header
-from utils.validators import validate_import_row, ImportValidator
+from database.models import RAW_IMPORT_COLUMNS, refresh_derived_tables, upsert_raw_immigration
+from modules.import_batches import finish_batch, start_batch
+from modules.import_csv import import_csv_native
+from modules.excel_reader import iter_excel_batches
+from modules.import_cache import (
+    cache_key, check_already_imported, file_digest,
+    load_cached_table, mark_imported, store_cached_table
+)
+from modules.import_jsf import _merge_validation_reports
+from utils.date_utils import format_date_column
+from utils.text_utils import normalize_passport_series, normalize_header
+from utils.validators import validate_import_frame
 from config import HEADER_MAP, IMPORTS_DIR
 
 
-def import_excel(file_path: str, sheet_name: str = None) -> Dict[str, Any]:
+def import_excel(file_path: str, sheet_name: Union[str, List[str], None] = None, username: str = None,
+                 conn=None, progress_callback: Callable[[float, str], None] = None,
+                 resume: Optional[Dict[str, Any]] = None,
+                 on_checkpoint: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
     """
     Import data from Excel file
+    Streamed with openpyxl read_only (see modules/excel_reader): each batch of
+    EXCEL_BATCH_SIZE rows goes through prepare_import_frame and the upsert,
+    so memory stays bounded by one batch. Derived tables are refreshed once
+    at the end.
     
     Args:
         file_path: Path to Excel file
-        sheet_name: Sheet name (optional, uses first sheet if not specified)
+        sheet_name: Sheet name or list of names (optional, imports every sheet
+            with a passport column if not specified)
+        username: User running the import (recorded in import_batches)
+        conn: Database connection (default: shared connection)
+        progress_callback: Callback function(progress: float, message: str)
+        resume: Last checkpoint of an interrupted run (None = from the start):
+            batches already handled are read again but not written
+        on_checkpoint: Callback(state) after each batch once the import batch
+            is opened (batch_id, batches handled, running totals, sheets)
         
     Returns:
-        Dict with import results
+        Dict with import results and sheets: rows read/imported/skipped per sheet
     """
     try:
-        # Read Excel file
-        if sheet_name:
-            df = pd.read_excel(file_path, sheet_name=sheet_name)
+        if conn is None:
+            conn = get_connection()
+        resume = resume or {}
+        source_name = Path(file_path).name
+        file_hash = file_digest(file_path)
+        if sheet_name is None:
+            variant = "*"
         else:
-            df = pd.read_excel(file_path)
+            variant = sheet_name if isinstance(sheet_name, str) else "|".join(sheet_name)
+        key = cache_key(file_path, variant=f"excel:{variant}", digest=file_hash)
+        already = None if resume else check_already_imported(key, conn, source_name)
+        if already:
+            return already
+        
+        batch_id = resume.get("batch_id")
+        keys_table = f"temp_excel_keys_{uuid.uuid4().hex[:8]}"
+        temp_table = f"temp_excel_batch_{uuid.uuid4().hex[:8]}"
+        totals = {"inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0, "rejected": 0}
+        totals.update(resume.get("totals") or {})
+        sheets: Dict[str, Dict[str, Any]] = {info["sheet"]: info for info in resume.get("sheets") or []}
+        validation_report = {"total_errors": 0, "total_warnings": 0, "details": []}
+        date_format_hits: Dict[str, Dict[str, int]] = {}
+        timings = {"read": 0.0, "write": 0.0}
+        handled = 0  # Số lô đã đọc, kể cả lô của lần chạy trước
+        
+        def checkpoint(batches: int):
+            if on_checkpoint and batch_id is not None:
+                on_checkpoint({
+                    "batch_id": batch_id,
+                    "batches": batches,
+                    "totals": totals,
+                    "sheets": list(sheets.values()),
+                })
+        
+        try:
+            if batch_id is not None:
+                # Import tiếp: khóa của các lô đã commit vẫn cần làm mới ở cuối
+                conn.execute(f"CREATE OR REPLACE TEMP TABLE {keys_table} (so_ho_chieu VARCHAR, ngay_den DATE)")
+                conn.execute(
+                    f"INSERT INTO {keys_table} SELECT passport_key, ngay_den FROM raw_immigration WHERE batch_id = ?",
+                    (batch_id,)
+                )
+            read_start = time.perf_counter()
+            for batch in iter_excel_batches(file_path, sheet_name):
+                timings["read"] += time.perf_counter() - read_start
+                handled += 1
+                if handled <= resume.get("batches", 0):
+                    # Lô đã xử lý ở lần chạy trước (số liệu nằm trong checkpoint)
+                    read_start = time.perf_counter()
+                    continue
+                sheet = sheets.setdefault(batch.sheet, {
+                    "sheet": batch.sheet, "header_row": batch.header_row,
+                    "rows_read": 0, "rows_imported": 0, "rows_skipped": 0, "error": None
+                })
+                if sheet["error"]:
+                    read_start = time.perf_counter()
+                    continue
+                sheet["rows_read"] += len(batch.df)
+                
+                prepared = prepare_import_frame(batch.df, source_name, row_offset=batch.first_row)
+                if prepared.get("error"):
+                    # Sheet không có cột số hộ chiếu (vd. sheet ghi chú) -> bỏ qua cả sheet
+                    sheet["error"] = prepared["error"]
+                    read_start = time.perf_counter()
+                    continue
+                
+                _merge_validation_reports(validation_report, prepared["validation_report"], max_rows=100)
+                for column, hits in prepared["date_format_hits"].items():
+                    column_hits = date_format_hits.setdefault(column, {})
+                    for label, count in hits.items():
+                        column_hits[label] = column_hits.get(label, 0) + count
+                skipped = prepared["rows_invalid_passport"] + prepared["rows_rejected"]
+                totals["rejected"] += prepared["rows_rejected"]
+                
+                if not prepared["df"].empty:
+                    write_start = time.perf_counter()
+                    if batch_id is None:
+                        batch_id = start_batch(conn, file_hash, source_name, username)
+                        conn.execute(f"CREATE OR REPLACE TEMP TABLE {keys_table} (so_ho_chieu VARCHAR, ngay_den DATE)")
+                        # Ghi batch_id trước lô đầu: bị ngắt thì lần sau chạy lại từ đầu với batch này
+                        if on_checkpoint:
+                            on_checkpoint({"batch_id": batch_id})
+                    # Before-image, upsert và khóa của lô trong cùng một transaction
+                    conn.begin()
+                    try:
+                        upsert = upsert_raw_immigration(conn, prepared["df"], temp_table, batch_id=batch_id)
+                        conn.execute(f"INSERT INTO {keys_table} SELECT so_ho_chieu, ngay_den FROM {temp_table}")
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+                    finally:
+                        try:
+                            conn.unregister(temp_table)
+                        except Exception:
+                            pass
+                    for field in ("inserted", "updated", "unchanged"):
+                        totals[field] += upsert[field]
+                    written = upsert["inserted"] + upsert["updated"] + upsert["unchanged"]
+                    sheet["rows_imported"] += written
+                    skipped += upsert["duplicates"]
+                    timings["write"] += time.perf_counter() - write_start
+                
+                sheet["rows_skipped"] += skipped
+                totals["skipped"] += skipped
+                checkpoint(handled)
+                if progress_callback:
+                    rows_done = batch.first_row + len(batch.df) - 1
+                    sheet_progress = min(rows_done / batch.rows_total, 1.0) if batch.rows_total else 0.0
+                    progress_callback(
+                        0.95 * (batch.sheet_index + sheet_progress) / batch.sheet_count,
+                        f"Sheet {batch.sheet}: đã xử lý {sheet['rows_read']:,} dòng..."
+                    )
+                read_start = time.perf_counter()
+        
+        except Exception as e:
+            result = {
+                "success": False,
+                "error": str(e),
+                "rows_imported": totals["inserted"] + totals["updated"] + totals["unchanged"],
+                "rows_skipped": totals["skipped"]
+            }
+            if batch_id is not None:
+                finish_batch(conn, batch_id, result)
+            return result
         
-        return _process_dataframe(df, file_path)
+        finally:
+            if batch_id is not None:
+                # Các lô đã commit (kể cả khi lỗi giữa chừng) vẫn được làm mới
+                refresh_start = time.perf_counter()
+                conn.begin()
+                try:
+                    refresh_derived_tables(conn, keys_table)
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Excel import derived tables refresh error: {e}")
+                timings["refresh"] = time.perf_counter() - refresh_start
+                conn.execute(f"DROP TABLE IF EXISTS {keys_table}")
+        
+        sheets_report = list(sheets.values())
+        rows_read = sum(s["rows_read"] for s in sheets_report)
+        sheet_errors = [f"{s['sheet']}: {s['error']}" for s in sheets_report if s["error"]]
+        
+        if batch_id is None:
+            if rows_read == 0 or len(sheet_errors) == len(sheets_report):
+                error = sheet_errors[0].split(": ", 1)[1] if len(sheet_errors) == 1 else (
+                    "; ".join(sheet_errors) if sheet_errors else "File is empty"
+                )
+                return {
+                    "success": False,
+                    "error": error,
+                    "rows_imported": 0,
+                    "rows_skipped": 0,
+                    "sheets": sheets_report
+                }
+            if totals["rejected"]:
+                return {
+                    "success": False,
+                    "error": "All rows failed validation. See report.",
+                    "rows_imported": 0,
+                    "rows_skipped": totals["skipped"],
+                    "validation_report": validation_report,
+                    "sheets": sheets_report
+                }
+            # Không dòng nào có số hộ chiếu
+            return {
+                "success": True,
+                "rows_imported": 0,
+                "rows_skipped": totals["skipped"],
+                "source_file": source_name,
+                "sheets": sheets_report
+            }
+        
+        rows_imported = totals["inserted"] + totals["updated"] + totals["unchanged"]
+        # Sheet được chọn rõ ràng mà không import được là lỗi; khi đọc mọi
+        # sheet thì sheet không phải bảng dữ liệu chỉ được ghi trong sheets
+        errors = sheet_errors if sheet_name is not None else None
+        if not errors:
+            mark_imported(key, conn, rows_imported)
+        result = {
+            "success": not errors,
+            "batch_id": batch_id,
+            "rows_imported": rows_imported,
+            "rows_inserted": totals["inserted"],
+            "rows_updated": totals["updated"],
+            "rows_unchanged": totals["unchanged"],
+            "rows_skipped": totals["skipped"],
+            "errors": errors or None,
+            "validation_report": validation_report,
+            "date_format_hits": date_format_hits,
+            "sheets": sheets_report,
+            "timings": {k: round(v, 3) for k, v in timings.items()},
+            "source_file": source_name
+        }
+        if errors:
+            result["error"] = "; ".join(errors)
+        finish_batch(conn, batch_id, result, timings=result["timings"])
+        if progress_callback:
+            progress_callback(1.0, "Hoàn thành!")
+        return result
     
     except Exception as e:
         return {
@@ -47,38 +268,66 @@ def import_excel(file_path: str, sheet_name: str = None) -> Dict[str, Any]:
         }
 
 
-def import_csv(file_path: str, encoding: str = "utf-8") -> Dict[str, Any]:
+def import_csv(file_path: str, encoding: str = "utf-8", username: str = None, conn=None,
+               progress_callback: Callable[[float, str], None] = None,
+               resume: Optional[Dict[str, Any]] = None,
+               on_checkpoint: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
     """
     Import data from CSV file
+    Read natively by DuckDB (see modules/import_csv); files DuckDB cannot
+    read (cp1252) go through pandas, with the import cache
     
     Args:
         file_path: Path to CSV file
-        encoding: File encoding (default: utf-8)
+        encoding: File encoding hint (default: utf-8, detected from the file)
+        username: User running the import (recorded in import_batches)
+        conn: Database connection (default: shared connection)
+        progress_callback: Callback function(progress: float, message: str)
+        resume: Last checkpoint of an interrupted run (None = from the start)
+        on_checkpoint: Callback(state) when the batch is opened and after each
+            committed chunk
         
     Returns:
         Dict with import results
     """
     try:
-        # Try common encodings if utf-8 fails
-        encodings = [encoding, "utf-8-sig", "cp1252", "latin1"]
+        if conn is None:
+            conn = get_connection()
+        file_hash = file_digest(file_path)
+        key = cache_key(file_path, variant=f"csv:{encoding}", digest=file_hash)
+        already = None if resume else check_already_imported(key, conn, Path(file_path).name)
+        if already:
+            return already
         
-        df = None
-        for enc in encodings:
-            try:
-                df = pd.read_csv(file_path, encoding=enc)
-                break
-            except UnicodeDecodeError:
-                continue
+        result = import_csv_native(
+            file_path, conn, encoding=encoding, file_hash=file_hash,
+            username=username, progress_callback=progress_callback,
+            resume=resume, on_checkpoint=on_checkpoint
+        )
+        if result is not None:
+            if result.get("success") and result.get("batch_id"):
+                mark_imported(key, conn, result["rows_imported"])
+            return result
         
+        df = load_cached_table(key)
+        from_cache = df is not None
         if df is None:
-            return {
-                "success": False,
-                "error": "Could not decode file with any supported encoding",
-                "rows_imported": 0,
-                "rows_skipped": 0
-            }
+            df = read_csv_file(file_path, encoding)
+            if df is None:
+                return {
+                    "success": False,
+                    "error": "Could not decode file with any supported encoding",
+                    "rows_imported": 0,
+                    "rows_skipped": 0
+                }
+            store_cached_table(key, df, Path(file_path).name)
         
-        return _process_dataframe(df, file_path)
+        result = _process_dataframe(
+            df, file_path, cache_key=key, file_hash=file_hash, username=username, conn=conn,
+            batch_id=(resume or {}).get("batch_id"), on_checkpoint=on_checkpoint
+        )
+        result["from_cache"] = from_cache
+        return result
     
     except Exception as e:
         return {
@@ -89,26 +338,43 @@ def import_csv(file_path: str, encoding: str = "utf-8") -> Dict[str, Any]:
         }
 
 
-def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
+def read_csv_file(file_path: str, encoding: str = "utf-8", dtype=None) -> Optional[pd.DataFrame]:
     """
-    Process a pandas DataFrame and insert into database
-    Optimized for bulk insertion/update
+    Read a CSV file, trying common encodings if the given one fails
     
     Args:
-        df: Pandas DataFrame
-        source_file: Source file name for tracking
-        
+        file_path: Path to CSV file
+        encoding: Encoding tried first
+        dtype: Passed to pd.read_csv (str keeps leading zeros of passport numbers)
+    
     Returns:
-        Dict with import results
+        DataFrame, or None if no supported encoding decodes the file
     """
-    if df.empty:
-        return {
-            "success": False,
-            "error": "File is empty",
-            "rows_imported": 0,
-            "rows_skipped": 0
-        }
+    for enc in [encoding, "utf-8-sig", "cp1252", "latin1"]:
+        try:
+            return pd.read_csv(file_path, encoding=enc, dtype=dtype)
+        except UnicodeDecodeError:
+            continue
+    return None
+
+
+def prepare_import_frame(df: pd.DataFrame, source_name: str, max_report_rows: int = 100,
+                         row_offset: int = 2) -> Dict[str, Any]:
+    """
+    Map headers (HEADER_MAP), normalize and validate an Excel/CSV table into
+    raw_immigration columns. No database access, so it can run in a worker
+    process (see modules/import_bulk).
     
+    Args:
+        df: Table as read from the file
+        source_name: Source file name (source_file column)
+        max_report_rows: Max rows listed in validation_report
+        row_offset: File row number of the first table row, for validation_report
+        
+    Returns:
+        Dict with df (valid rows, RAW_IMPORT_COLUMNS), rows_invalid_passport,
+        rows_rejected, validation_report, date_format_hits; or error
+    """
     # Normalize column names
     column_mapping = {}
     for col in df.columns:
@@ -124,21 +390,11 @@ def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
     missing = [col for col in required if col not in df.columns]
     
     if missing:
-        return {
-            "success": False,
-            "error": f"Missing required columns: {', '.join(missing)}",
-            "rows_imported": 0,
-            "rows_skipped": 0
-        }
-    
-    conn = get_connection()
-    source_name = Path(source_file).name
-    
-    # Prepare data for bulk operation
+        return {"error": f"Missing required columns: {', '.join(missing)}"}
     
     # 1. Normalize passport (Critical)
     initial_count = len(df)
-    df['so_ho_chieu'] = df['so_ho_chieu'].astype(str).apply(normalize_passport)
+    df['so_ho_chieu'] = normalize_passport_series(df['so_ho_chieu'])
     
     # Filter invalid passports
     df = df[df['so_ho_chieu'].astype(bool)]
@@ -147,10 +403,11 @@ def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
 
     if df.empty:
         return {
-            "success": True,
-            "rows_imported": 0,
-            "rows_skipped": rows_skipped,
-            "source_file": source_name
+            "df": df.reindex(columns=RAW_IMPORT_COLUMNS),
+            "rows_invalid_passport": rows_skipped,
+            "rows_rejected": 0,
+            "validation_report": None,
+            "date_format_hits": {}
         }
 
     # 2. Normalize other fields
@@ -174,58 +431,102 @@ def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
     else:
         df['ket_qua_xac_minh'] = None
 
-    # Date formatting
-    def safe_format_date(val):
-        if pd.isna(val) or str(val).lower() == 'nan':
-            return None
-        return format_date_for_db(str(val))
-
+    # Date formatting (column-level, format sniffed per column)
+    date_format_hits = {}
     for date_col in ['ngay_sinh', 'ngay_den', 'ngay_di']:
         if date_col in df.columns:
-             df[date_col] = df[date_col].apply(safe_format_date)
+            df[date_col], date_format_hits[date_col] = format_date_column(df[date_col])
         else:
             df[date_col] = None
 
     # ==========================================
     # VALIDATION
     # ==========================================
-    valid_rows = []
-    validation_report = {
-        "total_errors": 0,
-        "total_warnings": 0,
-        "details": []
+    # Columnar validation: one pass per rule over the whole column
+    validation = validate_import_frame(df, row_offset=row_offset)
+    validation_report = validation.to_report(max_rows=max_report_rows)
+    rows_rejected = len(df) - validation.valid_count
+    
+    # Keep only valid rows
+    df = df[validation.valid_mask].copy()
+        
+    # ==========================================
+
+    # Add source file
+    df['source_file'] = source_name
+
+    # Ensure all columns exist
+    for col in RAW_IMPORT_COLUMNS:
+        if col not in df.columns:
+            df[col] = None
+
+    return {
+        "df": df[RAW_IMPORT_COLUMNS],
+        "rows_invalid_passport": rows_skipped,
+        "rows_rejected": rows_rejected,
+        "validation_report": validation_report,
+        "date_format_hits": date_format_hits
     }
+
+
+def _process_dataframe(df: pd.DataFrame, source_file: str, cache_key: Optional[str] = None,
+                       file_hash: Optional[str] = None, username: Optional[str] = None,
+                       conn=None, batch_id: Optional[int] = None,
+                       on_checkpoint: Callable[[Dict[str, Any]], None] = None) -> Dict[str, Any]:
+    """
+    Process a pandas DataFrame and insert into database
+    Optimized for bulk insertion/update
     
-    # We need to iterate to validate
-    validator = ImportValidator()
+    Args:
+        df: Pandas DataFrame
+        source_file: Source file name for tracking
+        cache_key: Import cache key of the file, recorded as imported on success
+        file_hash: SHA-256 of the file, recorded with the import batch
+        username: User running the import
+        conn: Database connection (default: shared connection)
+        batch_id: Batch opened by an interrupted run to reuse (single
+            transaction: nothing of it was committed)
+        on_checkpoint: Callback(state) once the batch is opened
+        
+    Returns:
+        Dict with import results
+    """
+    if df.empty:
+        return {
+            "success": False,
+            "error": "File is empty",
+            "rows_imported": 0,
+            "rows_skipped": 0
+        }
     
-    # Create a list of dicts for faster iteration
-    records = df.to_dict('records')
+    if conn is None:
+        conn = get_connection()
+    source_name = Path(source_file).name
+    initial_count = len(df)
     
-    for idx, row in enumerate(records):
-        # Reset validator for new row
-        validator.reset()
-        
-        # Run validation
-        validate_import_row(row, idx + 2, validator) # idx + 2 because 0-index + header
-        
-        result = validator.get_result()
-        
-        if result.is_valid:
-            valid_rows.append(row)
-        
-        # Collect errors/warnings if any
-        if result.error_count > 0 or result.warning_count > 0:
-            validation_report["total_errors"] += result.error_count
-            validation_report["total_warnings"] += result.warning_count
-            
-            if len(validation_report["details"]) < 100: # Limit report size
-                validation_report["details"].append(result.to_dict())
+    prepared = prepare_import_frame(df, source_name)
+    if prepared.get("error"):
+        return {
+            "success": False,
+            "error": prepared["error"],
+            "rows_imported": 0,
+            "rows_skipped": 0
+        }
     
-    # Update stats
-    rows_rejected = len(df) - len(valid_rows)
+    rows_skipped = prepared["rows_invalid_passport"]
+    rows_rejected = prepared["rows_rejected"]
+    validation_report = prepared["validation_report"]
+    date_format_hits = prepared["date_format_hits"]
     
-    if not valid_rows:
+    if rows_skipped == initial_count:
+        return {
+            "success": True,
+            "rows_imported": 0,
+            "rows_skipped": rows_skipped,
+            "source_file": source_name
+        }
+    
+    if prepared["df"].empty:
         return {
             "success": False,
             "error": f"All rows failed validation. See report.",
@@ -234,92 +535,57 @@ def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
             "validation_report": validation_report
         }
     
-    # Re-create DataFrame with only valid rows
-    if valid_rows:
-        df = pd.DataFrame(valid_rows)
-    else:
-        # Should be handled by check above, but for safety
-        df = pd.DataFrame(columns=df.columns)
-        
-    # ==========================================
-
-    # Add source file
-    df['source_file'] = source_name
-
-    # Select only necessary columns
-    cols_to_keep = [
-        'so_ho_chieu', 'ho_ten', 'ngay_sinh', 'quoc_tich', 'ngay_den',
-        'ngay_di', 'dia_chi_tam_tru', 'ket_qua_xac_minh', 'source_file'
-    ]
-
-    # Ensure all columns exist
-    for col in cols_to_keep:
-        if col not in df.columns:
-            df[col] = None
-
-    final_df = df[cols_to_keep]
+    final_df = prepared["df"]
 
     try:
-        # Register dataframe as a view
-        conn.register('temp_import_data', final_df)
-
-        # 1. Update existing records
-        # Update logic: Match on passport AND arrival date (ngay_den)
-        # Note: We use COALESCE for ket_qua_xac_minh to preserve existing verification if input is null
-        conn.execute("""
-            UPDATE raw_immigration
-            SET
-                ho_ten = t.ho_ten,
-                ngay_sinh = t.ngay_sinh,
-                quoc_tich = t.quoc_tich,
-                ngay_di = t.ngay_di,
-                dia_chi_tam_tru = t.dia_chi_tam_tru,
-                ket_qua_xac_minh = CASE
-                    WHEN t.ket_qua_xac_minh IS NOT NULL AND t.ket_qua_xac_minh != '' THEN t.ket_qua_xac_minh
-                    ELSE raw_immigration.ket_qua_xac_minh
-                END,
-                source_file = t.source_file,
-                thoi_diem_cap_nhat = CURRENT_TIMESTAMP
-            FROM temp_import_data t
-            WHERE raw_immigration.so_ho_chieu = t.so_ho_chieu
-              AND raw_immigration.ngay_den = t.ngay_den
-        """)
+        if batch_id is None:
+            batch_id = start_batch(conn, file_hash, source_name, username)
+        if on_checkpoint:
+            on_checkpoint({"batch_id": batch_id})
+        
+        # One transaction: before-images are never committed without the upsert
+        conn.begin()
+        
+        # 1. Upsert on (passport, ngay_den): only new/changed rows are written,
+        #    existing verification kept if import has none
+        upsert = upsert_raw_immigration(conn, final_df, 'temp_import_data', batch_id=batch_id)
 
-        # 2. Insert new records
-        conn.execute("""
-            INSERT INTO raw_immigration (
-                so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den,
-                ngay_di, dia_chi_tam_tru, ket_qua_xac_minh, source_file, thoi_diem_cap_nhat
-            )
-            SELECT
-                t.so_ho_chieu, t.ho_ten, t.ngay_sinh, t.quoc_tich, t.ngay_den,
-                t.ngay_di, t.dia_chi_tam_tru, t.ket_qua_xac_minh, t.source_file, CURRENT_TIMESTAMP
-            FROM temp_import_data t
-            WHERE NOT EXISTS (
-                SELECT 1 FROM raw_immigration r
-                WHERE r.so_ho_chieu = t.so_ho_chieu
-                  AND r.ngay_den = t.ngay_den
-            )
-        """)
+        # 2. Refresh derived tables (travel groups, address tokens) for the written keys
+        refresh_derived_tables(conn, 'temp_import_data')
 
         conn.commit()
+        rows_imported = upsert["inserted"] + upsert["updated"] + upsert["unchanged"]
+        mark_imported(cache_key, conn, rows_imported)
 
-        return {
+        result = {
             "success": True,
-            "rows_imported": len(final_df),
-            "rows_skipped": rows_skipped + rows_rejected,
+            "batch_id": batch_id,
+            "rows_imported": rows_imported,
+            "rows_inserted": upsert["inserted"],
+            "rows_updated": upsert["updated"],
+            "rows_unchanged": upsert["unchanged"],
+            "rows_skipped": rows_skipped + rows_rejected + upsert["duplicates"],
             "errors": None,
             "validation_report": validation_report,
+            "date_format_hits": date_format_hits,
             "source_file": source_name
         }
+        finish_batch(conn, batch_id, result)
+        return result
 
     except Exception as e:
-        return {
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result = {
             "success": False,
             "error": str(e),
             "rows_imported": 0,
             "rows_skipped": initial_count
         }
+        finish_batch(conn, batch_id, result)
+        return result
     finally:
         # Always try to cleanup the view
         try:
@@ -328,66 +594,171 @@ def _process_dataframe(df: pd.DataFrame, source_file: str) -> Dict[str, Any]:
             pass
 
 
-def import_verification_results(file_path: str) -> Dict[str, Any]:
+VERIFICATION_COLUMNS = ["so_ho_chieu", "ket_qua_xac_minh"]
+
+
+def _read_verification_frame(file_path: str) -> Optional[pd.DataFrame]:
+    """
+    Read the passport/verification columns of a CAX result file.
+    Excel is streamed sheet by sheet (modules/excel_reader); only the two
+    needed columns of each batch are kept.
+    
+    Returns:
+        DataFrame with VERIFICATION_COLUMNS, or None if no table has both
+    """
+    if file_path.endswith('.csv'):
+        frames = [pd.read_csv(file_path, dtype=str)]
+    else:
+        frames = (batch.df for batch in iter_excel_batches(file_path))
+    
+    parts = []
+    for frame in frames:
+        column_mapping = {}
+        for col in frame.columns:
+            normalized = normalize_header(str(col))
+            if normalized in HEADER_MAP and HEADER_MAP[normalized] not in column_mapping.values():
+                column_mapping[col] = HEADER_MAP[normalized]
+        frame = frame.rename(columns=column_mapping)
+        # Sheet không có đủ hai cột (vd. sheet ghi chú) -> bỏ qua
+        if all(col in frame.columns for col in VERIFICATION_COLUMNS):
+            parts.append(frame[VERIFICATION_COLUMNS])
+    
+    if not parts:
+        return None
+    return pd.concat(parts, ignore_index=True)
+
+
+def import_verification_results(file_path: str, username: str = None, conn=None) -> Dict[str, Any]:
     """
     Import verification results from CAX (Công an xã)
     Updates ket_qua_xac_minh field for existing records
     
+    Set-based: the file is normalized in one vectorized pass, registered as
+    a temp table and applied with a single UPDATE ... FROM joined on the
+    stored passport_key. Only records whose result actually changes are
+    written, as one import batch (rollback_batch() restores them), and the
+    derived tables are refreshed for those stays in the same transaction.
+    A passport listed twice keeps its last result.
+    
     Args:
         file_path: Path to Excel/CSV file with verification results
+        username: User running the import (recorded in import_batches)
+        conn: Database connection (default: shared connection)
         
     Returns:
-        Dict with update results
+        Dict with rows_updated (records changed), rows_unchanged (matched
+        records already holding the result), matched/unmatched passport
+        counts and unmatched_passports (in file order)
     """
     try:
-        # Detect file type
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
-        
-        # Normalize columns
-        column_mapping = {}
-        for col in df.columns:
-            normalized = normalize_header(str(col))
-            if normalized in HEADER_MAP:
-                column_mapping[col] = HEADER_MAP[normalized]
-        
-        df = df.rename(columns=column_mapping)
+        df = _read_verification_frame(file_path)
         
         # Required columns
-        if "so_ho_chieu" not in df.columns or "ket_qua_xac_minh" not in df.columns:
+        if df is None:
             return {
                 "success": False,
                 "error": "File phải có cột 'so_ho_chieu' và 'ket_qua_xac_minh'",
                 "rows_updated": 0
             }
         
-        conn = get_connection()
-        rows_updated = 0
+        if conn is None:
+            conn = get_connection()
+        rows_read = len(df)
         
-        for _, row in df.iterrows():
-            passport = normalize_passport(str(row.get("so_ho_chieu", "")))
-            ket_qua = str(row.get("ket_qua_xac_minh", "")).strip()
-            
-            if not passport or not ket_qua:
-                continue
+        # 1. Normalize (vectorized); rows without passport or result are skipped
+        passports = normalize_passport_series(df["so_ho_chieu"])
+        results = df["ket_qua_xac_minh"].where(df["ket_qua_xac_minh"].notna(), "").astype(str).str.strip()
+        updates = pd.DataFrame({"so_ho_chieu": passports, "ket_qua_xac_minh": results})
+        updates = updates[updates["so_ho_chieu"].astype(bool) & updates["ket_qua_xac_minh"].astype(bool)]
+        updates = updates.drop_duplicates("so_ho_chieu", keep="last").reset_index(drop=True)
+        updates["stt"] = updates.index
+        
+        if updates.empty:
+            return {
+                "success": True,
+                "rows_updated": 0,
+                "rows_unchanged": 0,
+                "rows_skipped": rows_read,
+                "matched": 0,
+                "unmatched": 0,
+                "unmatched_passports": []
+            }
+        
+        batch_id = start_batch(conn, file_digest(file_path), Path(file_path).name, username)
+        conn.register('temp_verification', updates)
+        try:
+            unmatched_passports = [row[0] for row in conn.execute("""
+                SELECT t.so_ho_chieu
+                FROM temp_verification t
+                WHERE NOT EXISTS (SELECT 1 FROM raw_immigration r WHERE r.passport_key = t.so_ho_chieu)
+                ORDER BY t.stt
+            """).fetchall()]
+            records_matched = conn.execute("""
+                SELECT COUNT(*)
+                FROM raw_immigration r
+                JOIN temp_verification t ON r.passport_key = t.so_ho_chieu
+            """).fetchone()[0]
             
-            # Update matching records
-            result = conn.execute("""
-                UPDATE raw_immigration 
-                SET ket_qua_xac_minh = ?, thoi_diem_cap_nhat = CURRENT_TIMESTAMP
-                WHERE UPPER(so_ho_chieu) = ?
-            """, (ket_qua, passport))
+            # 2. One UPDATE ... FROM, before-images first so the batch can be rolled back
+            conn.begin()
+            conn.execute(f"""
+                INSERT INTO import_before_image
+                SELECT
+                    ?, r.id, r.so_ho_chieu, r.passport_key, r.ho_ten, r.ngay_sinh, r.quoc_tich,
+                    r.ngay_den, r.ngay_di, r.dia_chi_tam_tru, r.ket_qua_xac_minh,
+                    r.thoi_diem_cap_nhat, r.source_file, r.row_hash, r.batch_id
+                FROM raw_immigration r
+                JOIN temp_verification t ON r.passport_key = t.so_ho_chieu
+                WHERE r.ket_qua_xac_minh IS DISTINCT FROM t.ket_qua_xac_minh
+            """, (batch_id,))
+            rows_updated = conn.execute("""
+                UPDATE raw_immigration AS r
+                SET ket_qua_xac_minh = t.ket_qua_xac_minh,
+                    thoi_diem_cap_nhat = CURRENT_TIMESTAMP,
+                    batch_id = ?
+                FROM temp_verification t
+                WHERE r.passport_key = t.so_ho_chieu
+                  AND r.ket_qua_xac_minh IS DISTINCT FROM t.ket_qua_xac_minh
+            """, (batch_id,)).fetchone()[0]
             
-            rows_updated += 1
-        
-        conn.commit()
+            # 3. Same refresh as every other write path, for the changed stays
+            #    (their before-images are exactly the rows updated above)
+            conn.execute("""
+                CREATE OR REPLACE TEMP TABLE temp_verification_keys AS
+                SELECT passport_key AS so_ho_chieu, ngay_den
+                FROM import_before_image
+                WHERE batch_id = ?
+            """, (batch_id,))
+            refresh_derived_tables(conn, "temp_verification_keys")
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            result = {"success": False, "error": str(e), "rows_updated": 0}
+            finish_batch(conn, batch_id, result)
+            return result
+        finally:
+            try:
+                conn.unregister('temp_verification')
+            except Exception:
+                pass
+            conn.execute("DROP TABLE IF EXISTS temp_verification_keys")
         
-        return {
+        result = {
             "success": True,
-            "rows_updated": rows_updated
+            "batch_id": batch_id,
+            "rows_updated": rows_updated,
+            "rows_unchanged": records_matched - rows_updated,
+            "rows_skipped": rows_read - len(updates),
+            "matched": len(updates) - len(unmatched_passports),
+            "unmatched": len(unmatched_passports),
+            "unmatched_passports": unmatched_passports,
+            "source_file": Path(file_path).name
         }
+        finish_batch(conn, batch_id, result)
+        return result
     
     except Exception as e:
         return {
@@ -397,83 +768,250 @@ def import_verification_results(file_path: str) -> Dict[str, Any]:
         }
 
 
+# Reference tables: columns loaded from the file (passport first) and date columns
+REF_TABLES = {
+    "ref_labor": {"columns": ["so_ho_chieu", "vi_tri", "noi_lam_viec", "ngay_cap"], "dates": ["ngay_cap"]},
+    "ref_student": {"columns": ["so_ho_chieu", "truong", "nganh"], "dates": []},
+    "ref_watchlist": {"columns": ["so_ho_chieu", "dien", "so_cong_van", "ngay_nhap"], "dates": ["ngay_nhap"]},
+    "ref_marriage": {"columns": ["so_ho_chieu", "ho_ten_vn", "dia_chi", "dien"], "dates": []},
+}
+REF_MODES = ("full", "incremental")
+
+
+def _iter_reference_frames(file_path: str):
+    """(file row number of the first row, raw table) batches of a reference file"""
+    if file_path.endswith('.csv'):
+        df = read_csv_file(file_path, dtype=str)
+        if df is None:
+            raise ValueError("Could not decode file with any supported encoding")
+        yield 2, df
+    else:
+        for batch in iter_excel_batches(file_path):
+            yield batch.first_row, batch.df
+
+
+def _prepare_reference_frame(df: pd.DataFrame, table_columns: List[str], date_columns: List[str],
+                             row_offset: int) -> Dict[str, Any]:
+    """
+    Map headers, normalize (vectorized) and validate one batch of a
+    reference file.
+    
+    Returns:
+        Dict with df (valid rows: row_no + table_columns, dates as YYYY-MM-DD),
+        present (table columns found in the file), rows_no_passport,
+        validation (FrameValidationResult), date_format_hits
+    """
+    column_mapping = {}
+    for col in df.columns:
+        normalized = normalize_header(str(col))
+        target = normalized if normalized in table_columns else HEADER_MAP.get(normalized)
+        if target in table_columns and target not in column_mapping.values():
+            column_mapping[col] = target
+    df = df.rename(columns=column_mapping)
+    present = [c for c in table_columns if c in df.columns]
+    
+    staged = pd.DataFrame({"row_no": np.arange(len(df)) + row_offset}, index=df.index)
+    passport = df["so_ho_chieu"] if "so_ho_chieu" in df.columns else pd.Series("", index=df.index, dtype=object)
+    staged["so_ho_chieu"] = normalize_passport_series(passport)
+    
+    date_format_hits = {}
+    for col in table_columns[1:]:
+        if col not in df.columns:
+            staged[col] = None
+        elif col in date_columns:
+            staged[col], date_format_hits[col] = format_date_column(df[col])
+        else:
+            text = df[col].where(df[col].notna(), "").astype(str).str.strip()
+            staged[col] = text.where(text != "", None)
+    
+    # Dòng không có số hộ chiếu (dòng trống, dòng ghi chú) bị bỏ, không tính là lỗi
+    has_passport = staged["so_ho_chieu"].astype(bool).to_numpy()
+    validation = validate_import_frame(staged[["so_ho_chieu"]], row_offset=row_offset)
+    keep = has_passport & validation.valid_mask.to_numpy()
+    validation.errors = validation.errors[validation.errors["code"] != "passport_empty"]
+    
+    return {
+        "df": staged[keep],
+        "present": present,
+        "rows_no_passport": int((~has_passport).sum()),
+        "validation": validation,
+        "date_format_hits": date_format_hits
+    }
+
+
 def import_reference_table(
     file_path: str, 
     table_name: str,
-    required_columns: List[str]
+    required_columns: Optional[List[str]] = None,
+    mode: str = "full",
+    conn=None
 ) -> Dict[str, Any]:
     """
-    Import data into a reference table (ref_labor, ref_watchlist, etc.)
+    Import data into a reference table (ref_labor, ref_student, ref_watchlist,
+    ref_marriage)
+    
+    The file is normalized batch by batch (vectorized) into a temp staging
+    table, deduplicated by passport (last row wins) and validated with the
+    passport rules of validate_import_frame. The staging table is then
+    applied in one transaction:
+    - full: the table content is replaced (DELETE + INSERT), so searches see
+      either the old or the new list, never a half-loaded one
+    - incremental: rows are merged with INSERT ... ON CONFLICT (so_ho_chieu);
+      only the columns present in the file are updated
     
     Args:
         file_path: Path to data file
-        table_name: Target table name
-        required_columns: List of required columns
+        table_name: Target table name (a key of REF_TABLES)
+        required_columns: Columns the file must have (default: so_ho_chieu)
+        mode: "full" or "incremental"
+        conn: Database connection (default: shared connection)
         
     Returns:
-        Import results
+        Import results with rows_rejected/rows_duplicate, validation_report
+        and timings of each stage
     """
+    spec = REF_TABLES.get(table_name)
+    if spec is None or mode not in REF_MODES:
+        return {
+            "success": False,
+            "error": f"Unknown reference table or mode: {table_name} ({mode})",
+            "rows_imported": 0
+        }
+    table_columns = spec["columns"]
+    required = list(required_columns or ["so_ho_chieu"])
+    if conn is None:
+        conn = get_connection()
+    
+    stage = f"temp_{table_name}_{uuid.uuid4().hex[:8]}"
+    timings = {"read": 0.0, "stage": 0.0}
+    present: List[str] = []
+    rows_read = rows_no_passport = rows_rejected = 0
+    validation_report = {"total_errors": 0, "total_warnings": 0, "details": []}
+    date_format_hits: Dict[str, Dict[str, int]] = {}
+    
     try:
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        else:
-            df = pd.read_excel(file_path)
+        # 1. Staging table (all text, dates as YYYY-MM-DD)
+        conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE {stage} (
+                row_no BIGINT, seq BIGINT, {", ".join(f"{c} VARCHAR" for c in table_columns)}
+            )
+        """)
+        read_start = time.perf_counter()
+        for row_offset, frame in _iter_reference_frames(file_path):
+            timings["read"] += time.perf_counter() - read_start
+            stage_start = time.perf_counter()
+            
+            prepared = _prepare_reference_frame(frame, table_columns, spec["dates"], row_offset)
+            missing = [c for c in required if c not in prepared["present"]]
+            if missing:
+                # Sheet khác (ghi chú...) không có cột bắt buộc -> bỏ qua
+                read_start = time.perf_counter()
+                continue
+            for col in prepared["present"]:
+                if col not in present:
+                    present.append(col)
+            for column, hits in prepared["date_format_hits"].items():
+                column_hits = date_format_hits.setdefault(column, {})
+                for label, count in hits.items():
+                    column_hits[label] = column_hits.get(label, 0) + count
+            
+            validation = prepared["validation"]
+            _merge_validation_reports(validation_report, validation.to_report(max_rows=100), max_rows=100)
+            # seq: thứ tự đọc (qua các sheet), dòng sau thắng khi trùng số hộ chiếu
+            valid = prepared["df"].assign(seq=prepared["df"]["row_no"] - row_offset + rows_read)
+            rows_read += len(frame)
+            rows_no_passport += prepared["rows_no_passport"]
+            rows_rejected += len(frame) - prepared["rows_no_passport"] - len(prepared["df"])
+            conn.register("temp_ref_batch", valid)
+            try:
+                conn.execute(f"""
+                    INSERT INTO {stage} (row_no, seq, {", ".join(table_columns)})
+                    SELECT row_no, seq, {", ".join(table_columns)} FROM temp_ref_batch
+                """)
+            finally:
+                conn.unregister("temp_ref_batch")
+            timings["stage"] += time.perf_counter() - stage_start
+            read_start = time.perf_counter()
         
-        # Normalize columns
-        column_mapping = {}
-        for col in df.columns:
-            normalized = normalize_header(str(col))
-            column_mapping[col] = normalized
+        if not present:
+            return {
+                "success": False,
+                "error": f"Missing columns: {', '.join(required)}",
+                "rows_imported": 0
+            }
         
-        df = df.rename(columns=column_mapping)
+        # 2. Dedupe by passport: keep the last row
+        dedupe_start = time.perf_counter()
+        rows_duplicate = conn.execute(f"""
+            DELETE FROM {stage}
+            WHERE seq NOT IN (SELECT MAX(seq) FROM {stage} GROUP BY so_ho_chieu)
+        """).fetchone()[0]
+        rows_staged = conn.execute(f"SELECT COUNT(*) FROM {stage}").fetchone()[0]
+        timings["dedupe"] = time.perf_counter() - dedupe_start
         
-        # Check required columns
-        missing = [c for c in required_columns if c not in df.columns]
-        if missing:
+        if rows_staged == 0:
             return {
                 "success": False,
-                "error": f"Missing columns: {', '.join(missing)}",
-                "rows_imported": 0
+                "error": "Không có dòng hợp lệ, bảng không thay đổi",
+                "rows_imported": 0,
+                "rows_rejected": rows_rejected,
+                "validation_report": validation_report
             }
         
-        conn = get_connection()
+        columns = table_columns if mode == "full" else present
+        select = ", ".join(
+            f"TRY_CAST({c} AS DATE)" if c in spec["dates"] else c for c in columns
+        )
         
-        # Build insert SQL
-        columns = [c for c in df.columns if c in required_columns or c == "so_ho_chieu"]
-        placeholders = ", ".join(["?" for _ in columns])
-        column_names = ", ".join(columns)
-        
-        rows_imported = 0
-        
-        for _, row in df.iterrows():
-            values = []
-            for col in columns:
-                val = row.get(col)
-                if pd.isna(val):
-                    values.append(None)
-                elif col == "so_ho_chieu":
-                    values.append(normalize_passport(str(val)))
-                else:
-                    values.append(str(val).strip())
-            
-            if not values[0]:  # Skip if no passport
-                continue
-            
-            try:
+        # 3. Apply in one transaction
+        apply_start = time.perf_counter()
+        before = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+        conn.begin()
+        try:
+            if mode == "full":
+                rows_deleted = conn.execute(f"DELETE FROM {table_name}").fetchone()[0]
                 conn.execute(f"""
-                    INSERT OR REPLACE INTO {table_name} ({column_names})
-                    VALUES ({placeholders})
-                """, tuple(values))
-                rows_imported += 1
-            except Exception:
-                continue
-        
-        conn.commit()
+                    INSERT INTO {table_name} ({", ".join(columns)})
+                    SELECT {select} FROM {stage} ORDER BY seq
+                """)
+                rows_inserted, rows_updated = rows_staged, 0
+            else:
+                updates = [c for c in columns if c != "so_ho_chieu"]
+                if updates:
+                    on_conflict = f"""DO UPDATE SET {", ".join(f"{c} = EXCLUDED.{c}" for c in updates)}
+                        WHERE {" OR ".join(f"{table_name}.{c} IS DISTINCT FROM EXCLUDED.{c}" for c in updates)}"""
+                else:
+                    on_conflict = "DO NOTHING"
+                written = conn.execute(f"""
+                    INSERT INTO {table_name} ({", ".join(columns)})
+                    SELECT {select} FROM {stage} ORDER BY seq
+                    ON CONFLICT (so_ho_chieu) {on_conflict}
+                """).fetchone()[0]
+                rows_deleted = 0
+                rows_inserted = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0] - before
+                rows_updated = written - rows_inserted
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        timings["swap" if mode == "full" else "merge"] = time.perf_counter() - apply_start
         
         return {
             "success": True,
-            "rows_imported": rows_imported,
-            "table": table_name
+            "table": table_name,
+            "mode": mode,
+            "rows_read": rows_read,
+            "rows_imported": rows_staged,
+            "rows_inserted": rows_inserted,
+            "rows_updated": rows_updated,
+            "rows_unchanged": rows_staged - rows_inserted - rows_updated,
+            "rows_deleted": rows_deleted,
+            "rows_skipped": rows_no_passport,
+            "rows_rejected": rows_rejected,
+            "rows_duplicate": rows_duplicate,
+            "validation_report": validation_report,
+            "date_format_hits": date_format_hits,
+            "timings": {k: round(v, 3) for k, v in timings.items()}
         }
     
     except Exception as e:
@@ -482,3 +1020,5 @@ def import_reference_table(
             "error": str(e),
             "rows_imported": 0
         }
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {stage}")
@@ -0,0 +1,316 @@
+"""
+QLNNN Offline - Import Jobs
+Hàng đợi import chạy nền, một worker thread duy nhất ghi DB
+
+Trang Nhập liệu chỉ chép file upload vào data/imports/jobs/ và thêm một dòng
+vào bảng jobs; worker xử lý lần lượt từng job theo thứ tự, ghi tiến độ,
+thời gian từng giai đoạn và lỗi vào bảng để trang đọc lại. Tab trình duyệt
+không bị khóa và làm mới trang không mất import.
+
+Nhiều file (hoặc một file .zip) có thể đi chung một job, import gộp trong
+một transaction (xem modules/import_bulk).
+
+Mọi import ghi checkpoint khi mở batch; JSF, Excel và CSV (DuckDB) ghi thêm
+sau mỗi lô đã commit. Job đang chạy dở khi app tắt được chạy tiếp ở lần khởi
+động kế tiếp: từ lô sau lô đã commit, với chính batch đã mở (import gộp và CSV
+qua pandas ghi trong một transaction nên làm lại từ đầu). Batch đã mở mà import
+không dùng lại được đánh dấu lỗi để có thể rollback.
+"""
+
+import json
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import sys
+sys.path.append(str(Path(__file__).parent.parent))
+
+from config import IMPORT_JOBS_DIR
+from database.connection import get_connection, execute_query
+from modules.import_batches import STATUS_RUNNING, finish_batch
+from modules.import_bulk import import_bulk
+from modules.import_data import import_csv, import_excel
+from modules.import_jsf import import_jsf_chunked
+
+STATE_QUEUED = "queued"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+PROGRESS_INTERVAL = 0.5  # Giây tối thiểu giữa hai lần ghi tiến độ
+IDLE_WAIT = 30  # Giây chờ job mới trước khi kiểm tra lại bảng
+
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def submit_import_job(file_name: str, data: bytes, username: Optional[str] = None) -> int:
+    """
+    Đưa một file vào hàng đợi import.
+
+    Args:
+        file_name: Tên file gốc (giữ nguyên làm source_file)
+        data: Nội dung file
+        username: Người import
+
+    Returns:
+        ID của job
+    """
+    name = Path(file_name).name
+    job_dir = IMPORT_JOBS_DIR / uuid.uuid4().hex
+    job_dir.mkdir(parents=True, exist_ok=True)
+    path = job_dir / name
+    path.write_bytes(data)
+
+    conn = get_connection()
+    job_id = conn.execute(
+        "INSERT INTO jobs (file_path, source_file, username) VALUES (?, ?, ?) RETURNING id",
+        (str(path), name, username)
+    ).fetchone()[0]
+    conn.commit()
+
+    start_worker()
+    _wakeup.set()
+    return job_id
+
+
+def submit_bulk_import_job(files: List[Tuple[str, bytes]], username: Optional[str] = None) -> int:
+    """
+    Đưa nhiều file vào hàng đợi như một lần import gộp (import_bulk).
+    Thứ tự file được giữ: trùng (passport, ngày đến) mà đầy đủ như nhau thì file sau thắng.
+
+    Args:
+        files: List (tên file, nội dung) theo thứ tự
+        username: Người import
+
+    Returns:
+        ID của job
+    """
+    job_dir = IMPORT_JOBS_DIR / uuid.uuid4().hex
+    for index, (file_name, data) in enumerate(files):
+        # Mỗi file một thư mục con đánh số để giữ thứ tự và tên gốc
+        path = job_dir / f"{index:04d}" / Path(file_name).name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+    conn = get_connection()
+    job_id = conn.execute(
+        "INSERT INTO jobs (file_path, source_file, username) VALUES (?, ?, ?) RETURNING id",
+        (str(job_dir), f"{len(files)} files", username)
+    ).fetchone()[0]
+    conn.commit()
+
+    start_worker()
+    _wakeup.set()
+    return job_id
+
+
+def start_worker() -> None:
+    """Khởi động worker (một lần mỗi process); job dở dang được chạy tiếp trước"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = threading.Thread(target=_worker_loop, name="import-jobs", daemon=True)
+            _worker.start()
+
+
+def get_jobs(limit: int = 20) -> List[Dict[str, Any]]:
+    """
+    Các job gần nhất (mới nhất trước), cột JSON đã giải mã.
+
+    Args:
+        limit: Số job tối đa
+
+    Returns:
+        List dict theo cột của bảng jobs
+    """
+    jobs = execute_query("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,))
+    for job in jobs:
+        for field in ("checkpoint", "timings", "result"):
+            job[field] = json.loads(job[field]) if job[field] else None
+    return jobs
+
+
+def has_active_jobs() -> bool:
+    """Còn job đang chờ hoặc đang chạy"""
+    result = get_connection().execute(
+        "SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)", (STATE_QUEUED, STATE_RUNNING)
+    ).fetchone()
+    return result[0] > 0
+
+
+# ============================================
+# WORKER
+# ============================================
+
+def _worker_loop() -> None:
+    # Connection riêng cho thread (cùng database với connection dùng chung)
+    conn = get_connection().cursor()
+    while True:
+        _wakeup.clear()
+        job = _next_job(conn)
+        if job is None:
+            _wakeup.wait(timeout=IDLE_WAIT)
+            continue
+        try:
+            _run_job(conn, job)
+        except Exception as e:
+            _finish_job(conn, job, {"success": False, "error": str(e)}, {})
+
+
+def _next_job(conn) -> Optional[Dict[str, Any]]:
+    """Job dở dang (running từ lần chạy trước) trước, sau đó job chờ cũ nhất"""
+    result = conn.execute("""
+        SELECT id, file_path, source_file, username, checkpoint
+        FROM jobs
+        WHERE state IN (?, ?)
+        ORDER BY CASE WHEN state = ? THEN 0 ELSE 1 END, id
+        LIMIT 1
+    """, (STATE_QUEUED, STATE_RUNNING, STATE_RUNNING))
+    row = result.fetchone()
+    if row is None:
+        return None
+    return dict(zip([d[0] for d in result.description], row))
+
+
+def _run_job(conn, job: Dict[str, Any]) -> None:
+    """Chạy một job import, ghi tiến độ/checkpoint/kết quả vào bảng jobs"""
+    job_id = job["id"]
+    checkpoint = json.loads(job["checkpoint"]) if job["checkpoint"] else None
+    if checkpoint:
+        # Chỉ chạy tiếp batch còn dở; batch đã đóng (import xong nhưng job
+        # chưa kịp ghi kết quả) -> chạy lại, import cache báo "đã import"
+        status = conn.execute(
+            "SELECT status FROM import_batches WHERE id = ?", (checkpoint.get("batch_id"),)
+        ).fetchone()
+        if not status or status[0] != STATUS_RUNNING:
+            checkpoint = None
+
+    conn.execute("""
+        UPDATE jobs
+        SET state = ?, message = ?, error = NULL,
+            started_at = COALESCE(started_at, CURRENT_TIMESTAMP)
+        WHERE id = ?
+    """, (STATE_RUNNING, "Tiếp tục từ lô đã ghi..." if checkpoint else "Đang xử lý...", job_id))
+    conn.commit()
+    queued_s = conn.execute(
+        "SELECT epoch(started_at) - epoch(created_at) FROM jobs WHERE id = ?", (job_id,)
+    ).fetchone()[0]
+
+    path = Path(job["file_path"])
+    if not path.exists():
+        _finish_job(conn, job, {"success": False, "error": f"Không tìm thấy file {job['source_file']}"}, {})
+        return
+
+    last_progress = [0.0]
+
+    def on_progress(progress: float, message: str):
+        now = time.perf_counter()
+        if progress < 1.0 and now - last_progress[0] < PROGRESS_INTERVAL:
+            return
+        last_progress[0] = now
+        conn.execute("UPDATE jobs SET progress = ?, message = ? WHERE id = ?", (progress, message, job_id))
+
+    def on_checkpoint(state: Dict[str, Any]):
+        conn.execute(
+            "UPDATE jobs SET checkpoint = ?, batch_id = ? WHERE id = ?",
+            (json.dumps(state), state["batch_id"], job_id)
+        )
+
+    start = time.perf_counter()
+    ext = path.suffix.lower()
+    if path.is_dir() or ext == ".zip":
+        files = sorted(path.glob("*/*")) if path.is_dir() else [path]
+        result = import_bulk(
+            [str(f) for f in files], progress_callback=on_progress, username=job["username"],
+            conn=conn, source_name=job["source_file"], resume=checkpoint, on_checkpoint=on_checkpoint
+        )
+    elif ext in (".jsf", ".pdf"):
+        result = import_jsf_chunked(
+            str(path), progress_callback=on_progress, username=job["username"],
+            conn=conn, resume=checkpoint, on_checkpoint=on_checkpoint
+        )
+    elif ext == ".csv":
+        result = import_csv(
+            str(path), username=job["username"], conn=conn, progress_callback=on_progress,
+            resume=checkpoint, on_checkpoint=on_checkpoint
+        )
+    else:
+        on_progress(0.0, "Đang đọc file Excel...")
+        result = import_excel(
+            str(path), username=job["username"], conn=conn, progress_callback=on_progress,
+            resume=checkpoint, on_checkpoint=on_checkpoint
+        )
+
+    timings = {"queued": round(queued_s or 0, 3)}
+    timings.update(result.get("timings") or {})
+    timings["total"] = round(time.perf_counter() - start, 3)
+    _finish_job(conn, job, result, timings)
+
+
+def _fail_open_batch(conn, job_id: int, result: Dict[str, Any]) -> None:
+    """
+    Batch job đã mở (checkpoint) mà vẫn running sau khi import trả về: lần
+    chạy lại dừng trước khi dùng lại batch -> đánh dấu lỗi để có thể rollback
+    """
+    row = conn.execute("""
+        SELECT b.id
+        FROM jobs j JOIN import_batches b ON b.id = j.batch_id
+        WHERE j.id = ? AND b.status = ?
+    """, (job_id, STATUS_RUNNING)).fetchone()
+    if row:
+        error = result.get("error") or "Import bị gián đoạn, batch không được dùng lại"
+        finish_batch(conn, row[0], {**result, "success": False, "error": error})
+
+
+def _finish_job(conn, job: Dict[str, Any], result: Dict[str, Any], timings: Dict[str, float]) -> None:
+    """Ghi kết quả cuối của job và xóa bản sao file"""
+    _fail_open_batch(conn, job["id"], result)
+
+    if result.get("already_imported"):
+        message = result["message"]
+    elif result.get("success"):
+        message = (
+            f"Hoàn thành: {result.get('rows_inserted', 0):,} mới, "
+            f"{result.get('rows_updated', 0):,} cập nhật, "
+            f"{result.get('rows_unchanged', 0):,} không đổi"
+        )
+    else:
+        message = result.get("error") or "Import lỗi"
+
+    # Báo cáo validation chỉ giữ số lượng
+    summary = {k: v for k, v in result.items() if k != "validation_report"}
+    report = result.get("validation_report")
+    if report:
+        summary["validation_errors"] = report.get("total_errors", 0)
+        summary["validation_warnings"] = report.get("total_warnings", 0)
+
+    error = result.get("error")
+    if not error and result.get("errors"):
+        error = "; ".join(result["errors"][:5])
+
+    conn.execute("""
+        UPDATE jobs
+        SET state = ?, progress = 1.0, message = ?, batch_id = COALESCE(?, batch_id),
+            timings = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+    """, (
+        STATE_DONE if result.get("success") else STATE_FAILED,
+        message,
+        result.get("batch_id"),
+        json.dumps(timings),
+        json.dumps(summary, ensure_ascii=False, default=str),
+        error,
+        job["id"],
+    ))
+    conn.commit()
+
+    job_dir = Path(job["file_path"])
+    if not job_dir.is_dir():
+        job_dir = job_dir.parent
+    if job_dir.parent == IMPORT_JOBS_DIR:
+        shutil.rmtree(job_dir, ignore_errors=True)
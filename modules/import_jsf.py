@@ -4,20 +4,38 @@ Xử lý import dữ liệu tạm trú từ file JSF (PDF)
 Tích hợp với logic lọc trùng và validation hiện có
 """
 
+import ctypes
 import os
+import queue
 import sys
-from typing import Dict, Any, Optional
+import threading
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Any, Iterator, List, NamedTuple, Optional, Tuple
 from pathlib import Path
 import pandas as pd
 import pdfplumber
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from pdfplumber.utils import extract_text
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from database.connection import get_connection
-from utils.date_utils import format_date_for_db
-from utils.text_utils import normalize_passport, normalize_header
-from utils.validators import validate_import_row, ImportValidator
-from config import HEADER_MAP
+from database.models import RAW_IMPORT_COLUMNS, refresh_derived_tables, upsert_raw_immigration
+from modules.import_batches import finish_batch, start_batch
+from modules.import_cache import (
+    cache_key, cached_table_parts, check_already_imported, discard_cached_parts,
+    file_digest, finish_cached_parts, get_cache_entry, iter_cached_table,
+    load_cached_table, mark_imported, store_cached_table, write_cached_part
+)
+from utils.date_utils import format_date_column
+from utils.text_utils import normalize_passport_series, normalize_header
+from utils.validators import validate_import_frame
+from config import HEADER_MAP, JSF_EXTRACT_WORKERS, JSF_MIN_PAGES_PER_WORKER, JSF_LAYOUT_EXTRACT, JSF_PREPARE_WORKERS
 
 
 # =============================================
@@ -46,48 +64,399 @@ JSF_HEADER_MAP = {
 CHUNK_SIZE = 5000
 
 
-def extract_jsf_data(file_path: str) -> Optional[pd.DataFrame]:
+# =============================================
+# TRÍCH XUẤT THEO BỐ CỤC CỐ ĐỊNH (PA61)
+# =============================================
+# Báo cáo PA61 luôn cùng một bố cục cột. Thay vì để pdfplumber (pdfminer)
+# phân tích toàn bộ content stream và dò lưới bảng ở từng trang, ranh giới
+# cột được học một lần từ header trang 1; các trang sau chỉ lấy hộp ký tự
+# và đường kẻ qua pdfium (C), chia ký tự vào ô theo tọa độ rồi ghép chữ
+# bằng chính extract_text của pdfplumber (địa chỉ nhiều dòng -> '\n').
+# Trang nào không khớp bố cục thì quay về page.extract_table().
+
+# Sai số tọa độ (pt) khi so đường kẻ với ranh giới cột/dòng
+LAYOUT_TOLERANCE = 1.0
+# Đường kẻ: hình chữ nhật có một cạnh mỏng hơn ngưỡng này (pt)
+LINE_MAX_THICKNESS = 2.0
+
+# pdfium không an toàn đa luồng (mỗi phiên Streamlit là một thread)
+_pdfium_lock = threading.Lock()
+
+
+class JsfLayout(NamedTuple):
+    """Bố cục bảng học từ trang 1 (tọa độ theo hệ của pdfplumber)"""
+    rotation: int
+    columns: Tuple[float, ...]  # Ranh giới cột x, từ trái sang phải (số cột + 1)
+
+
+def _page_transform(page: "pdfium.PdfPage") -> Callable[[float, float], Tuple[float, float]]:
     """
-    Trích xuất dữ liệu từ file JSF (PDF) thành DataFrame.
+    Hàm đổi điểm (x, y) PDF sang (x, top) của pdfplumber, theo MediaBox
+    và góc xoay trang (cùng phép biến đổi pdfminer áp cho trang).
+    """
+    x0, y0, x1, y1 = page.get_mediabox()
+    rotation = page.get_rotation()
+    if rotation == 90:
+        height = x1 - x0
+        return lambda x, y: (y - y0, height - (x1 - x))
+    if rotation == 180:
+        height = y1 - y0
+        return lambda x, y: (x1 - x, height - (y1 - y))
+    if rotation == 270:
+        height = x1 - x0
+        return lambda x, y: (y1 - y, height - (x - x0))
+    height = y1 - y0
+    return lambda x, y: (x - x0, height - (y - y0))
+
+
+def _to_bbox(transform, left: float, bottom: float, right: float, top: float) -> Tuple[float, float, float, float]:
+    """Hộp PDF -> (x0, top, x1, bottom) của pdfplumber"""
+    ax, atop = transform(left, bottom)
+    bx, btop = transform(right, top)
+    return min(ax, bx), min(atop, btop), max(ax, bx), max(atop, btop)
+
+
+def _cluster_positions(values: List[float]) -> List[float]:
+    """Gom các tọa độ gần nhau (<= LAYOUT_TOLERANCE) thành giá trị trung bình"""
+    clusters = []
+    for value in sorted(values):
+        if clusters and value - clusters[-1][-1] <= LAYOUT_TOLERANCE:
+            clusters[-1].append(value)
+        else:
+            clusters.append([value])
+    return [sum(c) / len(c) for c in clusters]
+
+
+def _snap(value: float, centers: List[float]) -> float:
+    """Tọa độ cụm (từ _cluster_positions) gần value nhất"""
+    i = bisect_right(centers, value)
+    candidates = centers[max(i - 1, 0):i + 1]
+    return min(candidates, key=lambda c: abs(c - value))
+
+
+def _extract_page_by_layout(page: "pdfium.PdfPage", layout: JsfLayout) -> Optional[list]:
+    """
+    Trích xuất bảng của một trang theo bố cục cố định.
+    
+    Ô được dựng như lưới của pdfplumber: mỗi cột có các đường ngang riêng
+    (ô có thể cao khác nhau giữa các cột), các dòng của bảng là các cạnh
+    trên của ô, cột không có ô bắt đầu ở dòng đó -> None. Đường dọc phải
+    trùng ranh giới cột đã học.
     
-    Args:
-        file_path: Đường dẫn file JSF
-        
     Returns:
-        DataFrame hoặc None nếu lỗi
+        Bảng (list các dòng) như extract_table(), [] nếu trang không có bảng,
+        None nếu trang không khớp bố cục
     """
-    all_dfs = []
+    if page.get_rotation() != layout.rotation:
+        return None
+    
+    transform = _page_transform(page)
+    columns = layout.columns
+    n_cols = len(columns) - 1
+    
+    def column_at(x: float) -> Optional[int]:
+        # Chỉ số ranh giới cột trùng x (tính cả nét vẽ), None nếu không trùng
+        i = min(range(len(columns)), key=lambda i: abs(columns[i] - x))
+        return i if abs(columns[i] - x) <= LAYOUT_TOLERANCE else None
+    
+    # 1. Đường kẻ: mọi path phải là đoạn ngang hoặc dọc mảnh.
+    #    Đường ngang của bảng nối hai ranh giới cột (bỏ gạch chân ở tiêu đề trang)
+    horizontal, vertical = [], []
+    for obj in page.get_objects(filter=[pdfium_c.FPDF_PAGEOBJ_PATH]):
+        x0, top, x1, bottom = _to_bbox(transform, *obj.get_bounds())
+        if bottom - top <= LINE_MAX_THICKNESS:
+            first, last = column_at(x0), column_at(x1)
+            if first is not None and last is not None and first < last:
+                horizontal.append(((top + bottom) / 2, first, last))
+        elif x1 - x0 <= LINE_MAX_THICKNESS:
+            col = column_at((x0 + x1) / 2)
+            if col is None:
+                return None
+            vertical.append((col, top, bottom))
+        else:
+            return None
+    
+    if not horizontal and not vertical:
+        return []
+    
+    # 2. Cạnh ngang theo từng cột (tọa độ đã gom cụm trên toàn trang)
+    centers = _cluster_positions([y for y, _, _ in horizontal])
+    col_edges = [set() for _ in range(n_cols)]
+    for y, first, last in horizontal:
+        y = _snap(y, centers)
+        for col in range(first, last):
+            col_edges[col].add(y)
+    col_edges = [sorted(edges) for edges in col_edges]
+    if any(len(edges) < 2 for edges in col_edges):
+        return None
+    
+    # Đường dọc theo từng ranh giới cột, nối các đoạn liền nhau
+    coverage = [[] for _ in columns]
+    for col, top, bottom in sorted(vertical):
+        spans = coverage[col]
+        if spans and top <= spans[-1][1] + LAYOUT_TOLERANCE:
+            spans[-1][1] = max(spans[-1][1], bottom)
+        else:
+            spans.append([top, bottom])
+    
+    def covered(boundary: int, top: float, bottom: float) -> bool:
+        return any(a <= top + LAYOUT_TOLERANCE and b >= bottom - LAYOUT_TOLERANCE for a, b in coverage[boundary])
+    
+    # Ô = khoảng giữa hai cạnh ngang có đường dọc cả hai bên. Thiếu cạnh
+    # trái (dòng tràn từ trang trước, chỉ cột địa chỉ có khung) -> không có
+    # ô; chỉ thiếu cạnh phải -> ô gộp nhiều cột, không theo bố cục
+    is_cell = []
+    for col, edges in enumerate(col_edges):
+        flags = []
+        for top, bottom in zip(edges, edges[1:]):
+            left = covered(col, top, bottom)
+            if left and not covered(col + 1, top, bottom):
+                return None
+            flags.append(left)
+        is_cell.append(flags)
+    
+    # 3. Chia ký tự vào ô theo tâm ký tự (như Table.extract của pdfplumber)
+    cells = [[[] for _ in range(len(edges) - 1)] for edges in col_edges]
+    
+    origin_x, origin_y = ctypes.c_double(), ctypes.c_double()
+    textpage = page.get_textpage()
+    try:
+        for index in range(textpage.count_chars()):
+            # Bỏ ký tự pdfium tự sinh (khoảng trắng, xuống dòng)
+            if pdfium_c.FPDFText_IsGenerated(textpage.raw, index):
+                continue
+            _, top, x1, bottom = _to_bbox(transform, *textpage.get_charbox(index, loose=True))
+            # x0 = điểm gốc (như pdfplumber); dấu kết hợp (vd. dấu nặng) có độ rộng 0
+            pdfium_c.FPDFText_GetCharOrigin(textpage.raw, index, ctypes.byref(origin_x), ctypes.byref(origin_y))
+            x0 = transform(origin_x.value, origin_y.value)[0]
+            x1 = max(x0, x1)
+            col = bisect_right(columns, (x0 + x1) / 2) - 1
+            if not 0 <= col < n_cols:
+                continue
+            row = bisect_right(col_edges[col], (top + bottom) / 2) - 1
+            if 0 <= row < len(cells[col]):
+                cells[col][row].append({
+                    "text": chr(pdfium_c.FPDFText_GetUnicode(textpage.raw, index)),
+                    "x0": x0, "x1": x1, "top": top, "bottom": bottom,
+                    "doctop": top, "upright": True,
+                })
+    finally:
+        textpage.close()
+    
+    # 4. Dòng của bảng = các cạnh trên của ô, theo thứ tự từ trên xuống
+    row_tops = sorted({top for edges in col_edges for top in edges[:-1]})
+    table = []
+    for row_top in row_tops:
+        row = []
+        for col, edges in enumerate(col_edges):
+            i = bisect_right(edges, row_top) - 1
+            if i < len(cells[col]) and edges[i] == row_top and is_cell[col][i]:
+                chars = cells[col][i]
+                row.append(extract_text(chars) if chars else "")
+            else:
+                row.append(None)
+        table.append(row)
+    return table
+
+
+def _learn_jsf_layout(file_path: str) -> Optional[JsfLayout]:
+    """
+    Học ranh giới cột từ header bảng trang 1 (pdfplumber), rồi kiểm tra
+    trích xuất theo bố cục cho kết quả giống hệt extract_table() trên trang 1.
+    
+    Returns:
+        JsfLayout hoặc None nếu file không theo bố cục PA61 (dùng extract_table)
+    """
+    if not JSF_LAYOUT_EXTRACT:
+        return None
     
     try:
         with pdfplumber.open(file_path) as pdf:
-            if not pdf.pages:
+            page = pdf.pages[0]
+            table = page.find_table()
+            if table is None or not table.rows:
                 return None
-            
-            for i, page in enumerate(pdf.pages, 1):
-                table = page.extract_table()
-                if table:
-                    # Trang đầu có header
-                    if i == 1:
-                        df = pd.DataFrame(table[1:], columns=table[0])
-                    else:
-                        # Các trang sau, kiểm tra xem row đầu có phải header không
-                        first_row = table[0]
-                        if first_row and str(first_row[0]).upper() == 'STT':
-                            # Bỏ qua header trùng
-                            df = pd.DataFrame(table[1:], columns=table[0])
-                        else:
-                            # Không có header, dùng header từ trang 1
-                            df = pd.DataFrame(table, columns=all_dfs[0].columns if all_dfs else None)
-                    
-                    all_dfs.append(df)
-                    
+            header_cells = table.rows[0].cells
+            expected = table.extract()
+            rotation = page.rotation
+        
+        if any(cell is None for cell in header_cells) or str(expected[0][0]).upper() != 'STT':
+            return None
+        layout = JsfLayout(
+            rotation=int(rotation) % 360,
+            columns=tuple(cell[0] for cell in header_cells) + (header_cells[-1][2],)
+        )
+        
+        with _pdfium_lock:
+            doc = pdfium.PdfDocument(file_path)
+            try:
+                actual = _extract_page_by_layout(doc[0], layout)
+            finally:
+                doc.close()
     except Exception as e:
-        print(f"Error reading JSF: {e}")
+        print(f"JSF layout detection failed, using extract_table: {e}")
         return None
+    
+    return layout if actual == expected else None
+
+
+def _extract_page_tables(
+    file_path: str,
+    first_page: int,
+    last_page: int,
+    layout: Optional[JsfLayout] = None
+) -> List[Tuple[int, list]]:
+    """
+    Trích xuất bảng của các trang [first_page, last_page] (đánh số từ 1).
+    Chạy trong process con: mỗi worker tự mở file PDF.
+    
+    Returns:
+        List (số trang, bảng) theo thứ tự trang, bỏ qua trang không có bảng
+    """
+    return list(_iter_pages_sequential(file_path, first_page, layout, last_page))
+
+
+def _page_slices(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """Chia [1, page_count] thành các đoạn liên tiếp, gần bằng nhau"""
+    size, extra = divmod(page_count, workers)
+    slices = []
+    start = 1
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0) - 1
+        if end >= start:
+            slices.append((start, end))
+        start = end + 1
+    return slices
 
-    if not all_dfs:
-        return None
 
+def _resolve_workers(workers: Optional[int], page_count: int) -> int:
+    """Số worker thực tế (config/CPU, giới hạn theo số trang)"""
+    if workers is None:
+        workers = JSF_EXTRACT_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return max(1, min(workers, page_count // JSF_MIN_PAGES_PER_WORKER))
+
+
+def _iter_pages_sequential(
+    file_path: str,
+    first_page: int = 1,
+    layout: Optional[JsfLayout] = None,
+    last_page: Optional[int] = None
+) -> Iterator[Tuple[int, list]]:
+    """
+    Đọc tuần tự từ first_page, giải phóng cache từng trang sau khi trích xuất.
+    Có layout: trích xuất theo bố cục, trang không khớp dùng extract_table().
+    """
+    if layout:
+        with _pdfium_lock:
+            doc = pdfium.PdfDocument(file_path)
+    else:
+        doc = None
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            if last_page is None:
+                last_page = len(pdf.pages)
+            for page_no in range(first_page, last_page + 1):
+                table = None
+                if doc is not None:
+                    with _pdfium_lock:
+                        pdfium_page = doc[page_no - 1]
+                        table = _extract_page_by_layout(pdfium_page, layout)
+                        pdfium_page.close()
+                if table is None:
+                    page = pdf.pages[page_no - 1]
+                    table = page.extract_table()
+                    page.close()
+                if table:
+                    yield page_no, table
+    finally:
+        if doc is not None:
+            with _pdfium_lock:
+                doc.close()
+
+
+def _iter_page_tables(
+    file_path: str,
+    page_count: int,
+    workers: int,
+    layout: Optional[JsfLayout] = None,
+    first_page: int = 1
+) -> Iterator[Tuple[int, list]]:
+    """
+    Sinh (số trang, bảng) theo đúng thứ tự trang, từ first_page.
+    
+    workers > 1: các đoạn trang được trích xuất song song trong process pool,
+    chỉ giữ tối đa 2 đoạn/worker đang chờ để bộ nhớ không phụ thuộc kích
+    thước file. Nếu không chạy được process thì đọc tuần tự phần còn lại.
+    """
+    if workers <= 1:
+        yield from _iter_pages_sequential(file_path, first_page, layout)
+        return
+    
+    remaining = page_count - first_page + 1
+    slices = deque(
+        (first + first_page - 1, last + first_page - 1)
+        for first, last in _page_slices(remaining, remaining // JSF_MIN_PAGES_PER_WORKER)
+    )
+    next_page = first_page
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            while slices or pending:
+                # Giữ thứ tự đoạn trang, giới hạn số đoạn đang chờ
+                while slices and len(pending) < workers * 2:
+                    first, last = slices.popleft()
+                    pending.append((first, last, executor.submit(_extract_page_tables, file_path, first, last, layout)))
+                first, last, future = pending.popleft()
+                tables = future.result()
+                yield from tables
+                next_page = last + 1
+    except (BrokenProcessPool, OSError) as e:
+        # Không tạo được process (môi trường hạn chế) -> đọc tuần tự phần còn lại
+        print(f"JSF parallel extraction unavailable, continuing sequentially from page {next_page}: {e}")
+        yield from _iter_pages_sequential(file_path, next_page, layout)
+
+
+def _tables_to_dataframe(
+    page_tables: List[Tuple[int, list]],
+    columns: Optional[list] = None
+) -> Tuple[Optional[pd.DataFrame], Optional[list]]:
+    """
+    Ghép bảng các trang thành một DataFrame.
+    Trang đầu có header; trang sau nếu không có dòng header 'STT'
+    thì dùng header của bảng đầu tiên.
+    
+    Args:
+        page_tables: List (số trang, bảng) theo thứ tự trang
+        columns: Header của bảng đầu tiên, khi ghép tiếp các lô trang sau
+        
+    Returns:
+        Tuple (DataFrame hoặc None, header để truyền cho lô tiếp theo)
+    """
+    all_dfs = []
+    
+    for page_no, table in page_tables:
+        # Trang đầu có header
+        if page_no == 1:
+            df = pd.DataFrame(table[1:], columns=table[0])
+        else:
+            # Các trang sau, kiểm tra xem row đầu có phải header không
+            first_row = table[0]
+            if first_row and str(first_row[0]).upper() == 'STT':
+                # Bỏ qua header trùng
+                df = pd.DataFrame(table[1:], columns=table[0])
+            else:
+                # Không có header, dùng header từ trang 1
+                df = pd.DataFrame(table, columns=columns)
+        
+        if columns is None:
+            columns = list(df.columns)
+        all_dfs.append(df)
+    
+    if not all_dfs:
+        return None, columns
+    
     # Ghép tất cả bảng
     df_all = pd.concat(all_dfs, ignore_index=True)
     
@@ -95,7 +464,155 @@ def extract_jsf_data(file_path: str) -> Optional[pd.DataFrame]:
     if 'STT' in df_all.columns:
         df_all = df_all[pd.to_numeric(df_all['STT'], errors='coerce').notna()]
     
-    return df_all
+    return df_all, columns
+
+
+def extract_jsf_data(file_path: str, workers: Optional[int] = None) -> Optional[pd.DataFrame]:
+    """
+    Trích xuất dữ liệu từ file JSF (PDF) thành DataFrame.
+    
+    File theo bố cục PA61 được trích xuất theo tọa độ (xem _learn_jsf_layout),
+    các file khác dùng extract_table() của pdfplumber.
+    
+    Việc trích xuất là xử lý CPU thuần Python, nên các đoạn trang được chia
+    cho một ProcessPoolExecutor; mỗi worker tự mở file và trả về bảng của
+    đoạn trang của mình. Việc ghép (kể cả mượn header trang 1) làm tuần tự
+    theo đúng thứ tự trang.
+    
+    Args:
+        file_path: Đường dẫn file JSF
+        workers: Số process (None = JSF_EXTRACT_WORKERS, 0 = theo số CPU, 1 = tuần tự)
+        
+    Returns:
+        DataFrame hoặc None nếu lỗi
+    """
+    try:
+        with pdfplumber.open(file_path) as pdf:
+            page_count = len(pdf.pages)
+        
+        if page_count == 0:
+            return None
+        
+        page_tables = list(_iter_page_tables(
+            file_path, page_count, _resolve_workers(workers, page_count), _learn_jsf_layout(file_path)
+        ))
+    except Exception as e:
+        print(f"Error reading JSF: {e}")
+        return None
+    
+    df, _ = _tables_to_dataframe(page_tables)
+    return df
+
+
+def iter_jsf_batches(
+    file_path: str,
+    batch_rows: int = None,
+    workers: Optional[int] = None,
+    on_page: Callable[[int, int], None] = None,
+    first_page: int = 1
+) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    """
+    Trích xuất JSF theo lô trang (generator), mỗi trang chỉ đọc một lần.
+    Bộ nhớ giới hạn theo kích thước lô thay vì toàn bộ file.
+    
+    Args:
+        file_path: Đường dẫn file JSF
+        batch_rows: Số dòng tối thiểu mỗi lô (default: CHUNK_SIZE)
+        workers: Số process trích xuất (xem extract_jsf_data)
+        on_page: Callback(số trang đã đọc, tổng số trang) sau mỗi trang có bảng
+        first_page: Trang bắt đầu (> 1 khi import tiếp từ lô đã commit)
+        
+    Yields:
+        (DataFrame của lô, trang cuối của lô, tổng số trang)
+    """
+    if batch_rows is None:
+        batch_rows = CHUNK_SIZE
+    
+    with pdfplumber.open(file_path) as pdf:
+        page_count = len(pdf.pages)
+    
+    if page_count < first_page:
+        return
+    
+    columns = None
+    buffer = []
+    buffered_rows = 0
+    last_page = 0
+    
+    layout = _learn_jsf_layout(file_path)
+    if first_page > 1:
+        # Các trang sau có thể không lặp lại header -> lấy header từ trang 1
+        for page_no, table in _iter_pages_sequential(file_path, 1, layout, last_page=1):
+            _, columns = _tables_to_dataframe([(page_no, table)])
+    
+    remaining = page_count - first_page + 1
+    page_tables = _iter_page_tables(
+        file_path, page_count, _resolve_workers(workers, remaining), layout, first_page
+    )
+    for page_no, table in page_tables:
+        buffer.append((page_no, table))
+        buffered_rows += len(table)
+        last_page = page_no
+        if on_page:
+            on_page(page_no, page_count)
+        
+        if buffered_rows >= batch_rows:
+            df, columns = _tables_to_dataframe(buffer, columns)
+            buffer, buffered_rows = [], 0
+            if df is not None and not df.empty:
+                yield df, last_page, page_count
+    
+    if buffer:
+        df, columns = _tables_to_dataframe(buffer, columns)
+        if df is not None and not df.empty:
+            yield df, last_page, page_count
+
+
+def _iter_cached_batches(
+    parts: List[Path],
+    total_rows: int,
+    batch_rows: int,
+    page_count: int,
+    on_page: Callable[[int, int], None] = None,
+    start_row: int = 0
+) -> Iterator[Tuple[pd.DataFrame, int, int]]:
+    """
+    Chia bảng đã trích xuất (các phần trong import cache) thành các lô như
+    iter_jsf_batches, bắt đầu từ dòng start_row. Đọc lần lượt từng phần nên
+    bộ nhớ chỉ giữ khoảng một phần + một lô. Số trang của mỗi lô ước lượng
+    theo tỷ lệ dòng, chỉ dùng cho tiến độ.
+    """
+    buffer: List[pd.DataFrame] = []
+    buffered = 0
+    position = 0  # Số dòng đã đọc từ cache
+    sent = start_row
+    
+    def emit(frame: pd.DataFrame):
+        end = sent + len(frame)
+        page = max(1, round(end / max(total_rows, 1) * page_count))
+        if on_page:
+            on_page(page, page_count)
+        return frame.reset_index(drop=True), page, page_count
+    
+    for part in iter_cached_table(parts):
+        # Bỏ các dòng đã commit ở lần chạy trước
+        part_start, position = position, position + len(part)
+        if position <= start_row:
+            continue
+        if part_start < start_row:
+            part = part.iloc[start_row - part_start:]
+        
+        buffer.append(part)
+        buffered += len(part)
+        while buffered >= batch_rows:
+            merged = pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0]
+            yield emit(merged.iloc[:batch_rows])
+            sent += batch_rows
+            rest = merged.iloc[batch_rows:]
+            buffer, buffered = ([rest], len(rest)) if len(rest) else ([], 0)
+    
+    if buffered:
+        yield emit(pd.concat(buffer, ignore_index=True) if len(buffer) > 1 else buffer[0])
 
 
 def normalize_jsf_columns(df: pd.DataFrame) -> pd.DataFrame:
@@ -124,12 +641,14 @@ def normalize_jsf_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df.rename(columns=column_mapping)
 
 
-def normalize_jsf_dates(df: pd.DataFrame) -> pd.DataFrame:
+def normalize_jsf_dates(df: pd.DataFrame, hits: Optional[Dict[str, Dict[str, int]]] = None) -> pd.DataFrame:
     """
     Chuẩn hóa các cột ngày tháng về format YYYY-MM-DD cho database.
+    Parse theo cột (format_date_column); ngày không đọc được -> None.
     
     Args:
         df: DataFrame
+        hits: Dict nhận số lượng giá trị theo từng format, theo cột (optional)
         
     Returns:
         DataFrame với ngày đã chuẩn hóa
@@ -138,63 +657,57 @@ def normalize_jsf_dates(df: pd.DataFrame) -> pd.DataFrame:
     
     for col in date_columns:
         if col in df.columns:
-            df[col] = df[col].apply(lambda x: format_date_for_db(str(x)) if pd.notna(x) and str(x).strip() else None)
+            df[col], col_hits = format_date_column(df[col])
+            if hits is not None:
+                hits[col] = col_hits
     
     return df
 
 
-def import_jsf(file_path: str) -> Dict[str, Any]:
+def prepare_jsf_frame(
+    df: pd.DataFrame,
+    source_name: str,
+    row_offset: int = 2,
+    max_report_rows: int = 50,
+    date_format_hits: Optional[Dict[str, Dict[str, int]]] = None
+) -> Dict[str, Any]:
     """
-    Import dữ liệu từ file JSF vào database.
-    Bao gồm lọc trùng và validation.
+    Chuẩn hóa + validation bảng JSF thô thành các cột của raw_immigration.
+    Không đụng tới DB, nên chạy được trong process con (xem modules/import_bulk).
     
     Args:
-        file_path: Đường dẫn file JSF
+        df: Bảng trích xuất (cột gốc của JSF)
+        source_name: Tên file nguồn (cột source_file)
+        row_offset: Số dòng (trong file) của dòng đầu bảng, cho báo cáo validation
+        max_report_rows: Số dòng tối đa trong validation_report
+        date_format_hits: Dict nhận thống kê format ngày (optional)
         
     Returns:
-        Dict với kết quả import
+        Dict với df (dòng hợp lệ, cột RAW_IMPORT_COLUMNS), rows_invalid_passport,
+        rows_rejected, validation_report; hoặc error nếu thiếu cột số hộ chiếu
     """
-    # 1. Trích xuất dữ liệu từ JSF
-    df = extract_jsf_data(file_path)
-    
-    if df is None or df.empty:
-        return {
-            "success": False,
-            "error": "Không thể đọc dữ liệu từ file JSF hoặc file trống",
-            "rows_imported": 0,
-            "rows_skipped": 0
-        }
-    
-    initial_count = len(df)
-    
-    # 2. Chuẩn hóa tên cột
-    df = normalize_jsf_columns(df)
+    # Chuẩn hóa cột
+    df = normalize_jsf_columns(df.copy())
     
-    # 3. Kiểm tra cột bắt buộc
+    # Kiểm tra cột bắt buộc
     if 'so_ho_chieu' not in df.columns:
-        return {
-            "success": False,
-            "error": "Không tìm thấy cột 'Số hộ chiếu' trong file JSF",
-            "rows_imported": 0,
-            "rows_skipped": 0
-        }
-    
-    # 4. Chuẩn hóa passport
-    df['so_ho_chieu'] = df['so_ho_chieu'].astype(str).apply(normalize_passport)
+        return {"error": "Không tìm thấy cột 'Số hộ chiếu'"}
     
-    # Loại bỏ dòng không có passport hợp lệ
+    # Chuẩn hóa passport, loại dòng không có passport hợp lệ
+    initial_count = len(df)
+    df['so_ho_chieu'] = normalize_passport_series(df['so_ho_chieu'])
     df = df[df['so_ho_chieu'].astype(bool)]
     rows_invalid_passport = initial_count - len(df)
     
     if df.empty:
         return {
-            "success": False,
-            "error": "Tất cả các dòng đều có số hộ chiếu không hợp lệ",
-            "rows_imported": 0,
-            "rows_skipped": initial_count
+            "df": df.reindex(columns=RAW_IMPORT_COLUMNS),
+            "rows_invalid_passport": rows_invalid_passport,
+            "rows_rejected": 0,
+            "validation_report": None
         }
     
-    # 5. Chuẩn hóa các trường khác
+    # Chuẩn hóa các trường
     if 'ho_ten' in df.columns:
         df['ho_ten'] = df['ho_ten'].astype(str).str.strip().replace('nan', None)
     else:
@@ -211,147 +724,159 @@ def import_jsf(file_path: str) -> Dict[str, Any]:
     else:
         df['dia_chi_tam_tru'] = None
     
-    # 6. Chuẩn hóa ngày tháng
-    df = normalize_jsf_dates(df)
-    
-    # 7. Validation
-    valid_rows = []
-    validation_report = {
-        "total_errors": 0,
-        "total_warnings": 0,
-        "details": []
-    }
-    
-    validator = ImportValidator()
-    records = df.to_dict('records')
-    
-    for idx, row in enumerate(records):
-        validator.reset()
-        validate_import_row(row, idx + 2, validator)
-        result = validator.get_result()
-        
-        if result.is_valid:
-            valid_rows.append(row)
-        
-        if result.error_count > 0 or result.warning_count > 0:
-            validation_report["total_errors"] += result.error_count
-            validation_report["total_warnings"] += result.warning_count
-            
-            if len(validation_report["details"]) < 50:
-                validation_report["details"].append(result.to_dict())
-    
-    rows_validation_failed = len(df) - len(valid_rows)
-    
-    if not valid_rows:
-        return {
-            "success": False,
-            "error": "Tất cả các dòng đều không qua được validation",
-            "rows_imported": 0,
-            "rows_skipped": initial_count,
-            "validation_report": validation_report
-        }
+    # Chuẩn hóa ngày
+    df = normalize_jsf_dates(df, date_format_hits)
     
-    # Tạo DataFrame từ valid rows
-    df = pd.DataFrame(valid_rows)
+    # Validation (vector hóa theo cột)
+    validation = validate_import_frame(df, row_offset=row_offset)
+    validation_report = validation.to_report(max_rows=max_report_rows)
+    rows_rejected = len(df) - validation.valid_count
     
-    # 8. Thêm source file
-    source_name = Path(file_path).name
+    df = df[validation.valid_mask].copy()
     df['source_file'] = source_name
     
-    # 9. Chuẩn bị cột cho database
-    cols_to_keep = [
-        'so_ho_chieu', 'ho_ten', 'ngay_sinh', 'quoc_tich', 'ngay_den',
-        'ngay_di', 'dia_chi_tam_tru', 'source_file'
-    ]
-    
-    # Thêm cột ket_qua_xac_minh nếu chưa có
-    if 'ket_qua_xac_minh' not in df.columns:
-        df['ket_qua_xac_minh'] = None
-    cols_to_keep.append('ket_qua_xac_minh')
-    
-    # Đảm bảo tất cả cột tồn tại
-    for col in cols_to_keep:
+    # Đảm bảo tất cả cột tồn tại (ket_qua_xac_minh thường không có trong JSF)
+    for col in RAW_IMPORT_COLUMNS:
         if col not in df.columns:
             df[col] = None
     
-    final_df = df[cols_to_keep]
+    return {
+        "df": df[RAW_IMPORT_COLUMNS],
+        "rows_invalid_passport": rows_invalid_passport,
+        "rows_rejected": rows_rejected,
+        "validation_report": validation_report
+    }
+
+
+def import_jsf(file_path: str, username: str = None) -> Dict[str, Any]:
+    """
+    Import dữ liệu từ file JSF vào database.
+    Bao gồm lọc trùng và validation. File đã trích xuất trước đó (cùng
+    SHA-256) được đọc từ import cache thay vì chạy lại pdfplumber.
+    
+    Args:
+        file_path: Đường dẫn file JSF
+        username: Người import (ghi vào import_batches)
+        
+    Returns:
+        Dict với kết quả import
+    """
+    source_name = Path(file_path).name
+    file_hash = file_digest(file_path)
+    key = cache_key(file_path, variant="jsf", digest=file_hash)
     
-    # 10. Insert/Update vào database với logic lọc trùng
+    conn = None
+    batch_id = None
+    initial_count = 0
     try:
         conn = get_connection()
         
-        # Register dataframe as view
-        conn.register('temp_jsf_import', final_df)
-        
-        # Update existing records (match on passport + ngay_den)
-        conn.execute("""
-            UPDATE raw_immigration
-            SET
-                ho_ten = t.ho_ten,
-                ngay_sinh = t.ngay_sinh,
-                quoc_tich = t.quoc_tich,
-                ngay_di = t.ngay_di,
-                dia_chi_tam_tru = t.dia_chi_tam_tru,
-                ket_qua_xac_minh = CASE
-                    WHEN t.ket_qua_xac_minh IS NOT NULL AND t.ket_qua_xac_minh != '' THEN t.ket_qua_xac_minh
-                    ELSE raw_immigration.ket_qua_xac_minh
-                END,
-                source_file = t.source_file,
-                thoi_diem_cap_nhat = CURRENT_TIMESTAMP
-            FROM temp_jsf_import t
-            WHERE raw_immigration.so_ho_chieu = t.so_ho_chieu
-              AND raw_immigration.ngay_den = t.ngay_den
-        """)
-        
-        # Get count of updated rows
-        updated_result = conn.execute("""
-            SELECT COUNT(*) as cnt FROM raw_immigration r
-            WHERE EXISTS (
-                SELECT 1 FROM temp_jsf_import t
-                WHERE r.so_ho_chieu = t.so_ho_chieu
-                  AND r.ngay_den = t.ngay_den
-            )
-        """).fetchone()
-        rows_updated = updated_result[0] if updated_result else 0
-        
-        # Insert new records
-        conn.execute("""
-            INSERT INTO raw_immigration (
-                so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den,
-                ngay_di, dia_chi_tam_tru, ket_qua_xac_minh, source_file, thoi_diem_cap_nhat
-            )
-            SELECT
-                t.so_ho_chieu, t.ho_ten, t.ngay_sinh, t.quoc_tich, t.ngay_den,
-                t.ngay_di, t.dia_chi_tam_tru, t.ket_qua_xac_minh, t.source_file, CURRENT_TIMESTAMP
-            FROM temp_jsf_import t
-            WHERE NOT EXISTS (
-                SELECT 1 FROM raw_immigration r
-                WHERE r.so_ho_chieu = t.so_ho_chieu
-                  AND r.ngay_den = t.ngay_den
-            )
-        """)
+        # Đã import và dữ liệu không đổi -> không làm gì
+        already = check_already_imported(key, conn, source_name)
+        if already:
+            return already
+        
+        # 1. Trích xuất dữ liệu từ JSF (hoặc lấy từ cache)
+        df = load_cached_table(key)
+        from_cache = df is not None
+        if df is None:
+            df = extract_jsf_data(file_path)
+            if df is not None and not df.empty:
+                store_cached_table(key, df, source_name)
+        
+        if df is None or df.empty:
+            return {
+                "success": False,
+                "error": "Không thể đọc dữ liệu từ file JSF hoặc file trống",
+                "rows_imported": 0,
+                "rows_skipped": 0
+            }
+        
+        initial_count = len(df)
+        
+        # 2. Chuẩn hóa cột, passport, các trường, ngày tháng + validation
+        date_format_hits = {}
+        prepared = prepare_jsf_frame(df, source_name, date_format_hits=date_format_hits)
+        
+        # 3. Kiểm tra cột bắt buộc
+        if prepared.get("error"):
+            return {
+                "success": False,
+                "error": "Không tìm thấy cột 'Số hộ chiếu' trong file JSF",
+                "rows_imported": 0,
+                "rows_skipped": 0
+            }
+        
+        rows_invalid_passport = prepared["rows_invalid_passport"]
+        rows_validation_failed = prepared["rows_rejected"]
+        validation_report = prepared["validation_report"]
+        
+        if rows_invalid_passport == initial_count:
+            return {
+                "success": False,
+                "error": "Tất cả các dòng đều có số hộ chiếu không hợp lệ",
+                "rows_imported": 0,
+                "rows_skipped": initial_count
+            }
+        
+        if prepared["df"].empty:
+            return {
+                "success": False,
+                "error": "Tất cả các dòng đều không qua được validation",
+                "rows_imported": 0,
+                "rows_skipped": initial_count,
+                "validation_report": validation_report
+            }
+        
+        final_df = prepared["df"]
         
-        rows_inserted = len(final_df) - rows_updated
+        # 4. Insert/Update vào database với logic lọc trùng
+        batch_id = start_batch(conn, file_hash, source_name, username)
+        
+        # Before-image, upsert và bảng dẫn xuất trong cùng một transaction
+        conn.begin()
+        
+        # Upsert theo (passport, ngày đến): chỉ ghi dòng mới/thay đổi, giữ kết quả xác minh cũ nếu file không có
+        upsert = upsert_raw_immigration(conn, final_df, 'temp_jsf_import', batch_id=batch_id)
+        rows_inserted = upsert["inserted"]
+        rows_updated = upsert["updated"]
+        rows_unchanged = upsert["unchanged"]
+        
+        # Cập nhật bảng dẫn xuất (nhóm đi cùng, token địa chỉ) cho các (passport, ngày đến) vừa ghi
+        refresh_derived_tables(conn, 'temp_jsf_import')
         
         conn.commit()
+        mark_imported(key, conn, rows_inserted + rows_updated + rows_unchanged)
         
-        return {
+        result = {
             "success": True,
-            "rows_imported": len(final_df),
+            "batch_id": batch_id,
+            "rows_imported": rows_inserted + rows_updated + rows_unchanged,
             "rows_inserted": rows_inserted,
             "rows_updated": rows_updated,
-            "rows_skipped": rows_invalid_passport + rows_validation_failed,
+            "rows_unchanged": rows_unchanged,
+            "rows_skipped": rows_invalid_passport + rows_validation_failed + upsert["duplicates"],
             "validation_report": validation_report,
+            "date_format_hits": date_format_hits,
+            "from_cache": from_cache,
             "source_file": source_name
         }
+        finish_batch(conn, batch_id, result)
+        return result
         
     except Exception as e:
-        return {
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        result = {
             "success": False,
             "error": str(e),
             "rows_imported": 0,
             "rows_skipped": initial_count
         }
+        finish_batch(conn, batch_id, result)
+        return result
     finally:
         try:
             conn.unregister('temp_jsf_import')
@@ -408,150 +933,74 @@ def import_jsf_to_excel(file_path: str, output_path: str = None) -> Dict[str, An
     }
 
 
-def _process_and_import_chunk(
-    chunk_df: pd.DataFrame, 
-    source_name: str, 
-    conn
-) -> Dict[str, Any]:
+def _prepare_chunk(chunk_df: pd.DataFrame, source_name: str, row_offset: int = 2) -> Dict[str, Any]:
     """
-    Xử lý và import một chunk DataFrame vào database.
-    Hàm nội bộ, được gọi bởi import_jsf_chunked().
+    Chuẩn hóa + validation một lô (giai đoạn song song của import_jsf_chunked).
+    Không đụng tới DB, chạy trong thread pool.
     
     Args:
-        chunk_df: DataFrame chunk để xử lý
+        chunk_df: DataFrame lô thô
         source_name: Tên file nguồn
-        conn: Database connection
+        row_offset: Số dòng (trong file) của dòng đầu lô, cho báo cáo validation
         
     Returns:
-        Dict với số dòng inserted/updated
+        Kết quả prepare_jsf_frame, thêm prepare_s (thời gian xử lý)
     """
-    # Chuẩn hóa cột
-    df = normalize_jsf_columns(chunk_df.copy())
-    
-    # Kiểm tra cột bắt buộc
-    if 'so_ho_chieu' not in df.columns:
-        return {"error": "Không tìm thấy cột 'Số hộ chiếu'", "inserted": 0, "updated": 0}
-    
-    # Chuẩn hóa passport
-    df['so_ho_chieu'] = df['so_ho_chieu'].astype(str).apply(normalize_passport)
-    df = df[df['so_ho_chieu'].astype(bool)]
-    
-    if df.empty:
-        return {"inserted": 0, "updated": 0, "skipped": len(chunk_df)}
-    
-    # Chuẩn hóa các trường
-    if 'ho_ten' in df.columns:
-        df['ho_ten'] = df['ho_ten'].astype(str).str.strip().replace('nan', None)
-    else:
-        df['ho_ten'] = None
-    
-    if 'quoc_tich' in df.columns:
-        df['quoc_tich'] = df['quoc_tich'].astype(str).str.strip().str.upper().replace('NAN', None)
-    else:
-        df['quoc_tich'] = None
-    
-    if 'dia_chi_tam_tru' in df.columns:
-        df['dia_chi_tam_tru'] = df['dia_chi_tam_tru'].astype(str).str.replace(r'\n', ', ', regex=True).str.strip().replace('nan', None)
-    else:
-        df['dia_chi_tam_tru'] = None
-    
-    # Chuẩn hóa ngày
-    df = normalize_jsf_dates(df)
-    
-    # Validation
-    valid_rows = []
-    validator = ImportValidator()
-    records = df.to_dict('records')
-    
-    for idx, row in enumerate(records):
-        validator.reset()
-        validate_import_row(row, idx + 2, validator)
-        if validator.get_result().is_valid:
-            valid_rows.append(row)
-    
-    if not valid_rows:
-        return {"inserted": 0, "updated": 0, "skipped": len(chunk_df)}
-    
-    # Tạo DataFrame từ valid rows
-    df = pd.DataFrame(valid_rows)
-    df['source_file'] = source_name
-    
-    # Chuẩn bị cột
-    cols_to_keep = [
-        'so_ho_chieu', 'ho_ten', 'ngay_sinh', 'quoc_tich', 'ngay_den',
-        'ngay_di', 'dia_chi_tam_tru', 'source_file'
-    ]
-    
-    if 'ket_qua_xac_minh' not in df.columns:
-        df['ket_qua_xac_minh'] = None
-    cols_to_keep.append('ket_qua_xac_minh')
+    start = time.perf_counter()
+    prepared = prepare_jsf_frame(chunk_df, source_name, row_offset=row_offset)
+    prepared["prepare_s"] = time.perf_counter() - start
+    return prepared
+
+
+def _write_prepared_chunk(
+    prepared: Dict[str, Any],
+    chunk_rows: int,
+    conn,
+    batch_id: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    Ghi một lô đã chuẩn hóa vào database và commit.
+    Hàm nội bộ, được gọi bởi import_jsf_chunked() (chỉ từ thread ghi DB).
     
-    for col in cols_to_keep:
-        if col not in df.columns:
-            df[col] = None
+    Args:
+        prepared: Kết quả _prepare_chunk() của lô
+        chunk_rows: Số dòng thô của lô
+        conn: Database connection
+        batch_id: import_batches.id của lần import
+        
+    Returns:
+        Dict với số dòng inserted/updated/unchanged và validation_report của chunk
+    """
+    if prepared.get("error"):
+        return {"error": prepared["error"], "inserted": 0, "updated": 0}
     
-    final_df = df[cols_to_keep]
+    final_df = prepared["df"]
+    validation_report = prepared["validation_report"]
+    if final_df.empty:
+        return {"inserted": 0, "updated": 0, "skipped": chunk_rows, "validation_report": validation_report}
     
     # Import vào database
     import uuid
     temp_table = f"temp_chunk_{uuid.uuid4().hex[:8]}"
     
+    # Before-image, upsert và bảng dẫn xuất của lô trong cùng một transaction
+    conn.begin()
     try:
-        conn.register(temp_table, final_df)
-        
-        # Update existing
-        conn.execute(f"""
-            UPDATE raw_immigration
-            SET
-                ho_ten = t.ho_ten,
-                ngay_sinh = t.ngay_sinh,
-                quoc_tich = t.quoc_tich,
-                ngay_di = t.ngay_di,
-                dia_chi_tam_tru = t.dia_chi_tam_tru,
-                ket_qua_xac_minh = CASE
-                    WHEN t.ket_qua_xac_minh IS NOT NULL AND t.ket_qua_xac_minh != '' THEN t.ket_qua_xac_minh
-                    ELSE raw_immigration.ket_qua_xac_minh
-                END,
-                source_file = t.source_file,
-                thoi_diem_cap_nhat = CURRENT_TIMESTAMP
-            FROM {temp_table} t
-            WHERE raw_immigration.so_ho_chieu = t.so_ho_chieu
-              AND raw_immigration.ngay_den = t.ngay_den
-        """)
-        
-        # Count updated
-        updated_result = conn.execute(f"""
-            SELECT COUNT(*) FROM raw_immigration r
-            WHERE EXISTS (
-                SELECT 1 FROM {temp_table} t
-                WHERE r.so_ho_chieu = t.so_ho_chieu
-                  AND r.ngay_den = t.ngay_den
-            )
-        """).fetchone()
-        rows_updated = updated_result[0] if updated_result else 0
-        
-        # Insert new
-        conn.execute(f"""
-            INSERT INTO raw_immigration (
-                so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den,
-                ngay_di, dia_chi_tam_tru, ket_qua_xac_minh, source_file, thoi_diem_cap_nhat
-            )
-            SELECT
-                t.so_ho_chieu, t.ho_ten, t.ngay_sinh, t.quoc_tich, t.ngay_den,
-                t.ngay_di, t.dia_chi_tam_tru, t.ket_qua_xac_minh, t.source_file, CURRENT_TIMESTAMP
-            FROM {temp_table} t
-            WHERE NOT EXISTS (
-                SELECT 1 FROM raw_immigration r
-                WHERE r.so_ho_chieu = t.so_ho_chieu
-                  AND r.ngay_den = t.ngay_den
-            )
-        """)
-        
-        rows_inserted = len(final_df) - rows_updated
+        upsert = upsert_raw_immigration(conn, final_df, temp_table, batch_id=batch_id)
+        refresh_derived_tables(conn, temp_table)
         conn.commit()
         
-        return {"inserted": rows_inserted, "updated": rows_updated, "skipped": len(chunk_df) - len(final_df)}
+        return {
+            "inserted": upsert["inserted"],
+            "updated": upsert["updated"],
+            "unchanged": upsert["unchanged"],
+            "skipped": chunk_rows - len(final_df) + upsert["duplicates"],
+            "validation_report": validation_report
+        }
         
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         try:
             conn.unregister(temp_table)
@@ -559,104 +1008,324 @@ def _process_and_import_chunk(
             pass
 
 
-from typing import Callable
+def _merge_validation_reports(total: Dict[str, Any], part: Optional[Dict[str, Any]], max_rows: int = 50) -> None:
+    """Cộng dồn validation_report của một chunk vào báo cáo tổng"""
+    if not part:
+        return
+    total["total_errors"] += part.get("total_errors", 0)
+    total["total_warnings"] += part.get("total_warnings", 0)
+    room = max_rows - len(total["details"])
+    if room > 0:
+        total["details"].extend(part.get("details", [])[:room])
+
+
+def _stage_throughput(rows: int, timings: Dict[str, float]) -> Dict[str, Optional[float]]:
+    """Số dòng/giây của từng giai đoạn pipeline (None nếu không đo được)"""
+    return {
+        stage: round(rows / timings[stage], 1) if timings.get(stage) else None
+        for stage in ("extract", "prepare", "write")
+    }
+
 
 def import_jsf_chunked(
     file_path: str, 
     progress_callback: Callable[[float, str], None] = None,
-    chunk_size: int = None
+    chunk_size: int = None,
+    workers: Optional[int] = None,
+    username: str = None,
+    conn=None,
+    resume: Optional[Dict[str, Any]] = None,
+    on_checkpoint: Callable[[Dict[str, Any]], None] = None,
+    prepare_workers: Optional[int] = None
 ) -> Dict[str, Any]:
     """
-    Import JSF với chunk processing cho file lớn.
-    Chia file thành các chunks và import từng phần với progress callback.
+    Import JSF theo luồng (streaming) cho file lớn.
+    
+    Các lô trang đi qua pipeline trích xuất -> chuẩn hóa + validation ->
+    upsert, file chỉ được trích xuất một lần và bộ nhớ giới hạn theo kích
+    thước lô. Trích xuất chạy trên một thread riêng, chuẩn hóa + validation
+    trên thread pool (prepare_workers), nên lô sau được xử lý trong lúc lô
+    trước đang ghi DB. Việc ghi DB và progress callback chỉ ở thread gọi
+    hàm, lần lượt theo thứ tự lô. Hàng đợi giữa các giai đoạn có giới hạn:
+    trích xuất chỉ đi trước bên ghi tối đa prepare_workers + 1 lô.
+    
+    File đã trích xuất trước đó (cùng SHA-256) được chia lô từ import cache;
+    lần trích xuất đầu tiên đọc hết file không lỗi thì bảng được lưu vào cache.
+    
+    Khi mở batch và sau mỗi lô đã ghi, on_checkpoint nhận trạng thái (trang/dòng
+    cuối đã commit, batch_id, số dòng cộng dồn); truyền lại trạng thái đó qua resume
+    để import tiếp từ lô sau thay vì làm lại từ đầu (xem modules/import_jobs).
     
     Args:
         file_path: Đường dẫn file JSF
         progress_callback: Callback function(progress: float, message: str)
-                          progress từ 0.0 đến 1.0
-        chunk_size: Số dòng mỗi chunk (default: CHUNK_SIZE = 5000)
+                          progress từ 0.0 đến 1.0, theo số trang đã xử lý
+        chunk_size: Số dòng mỗi lô ghi DB (default: CHUNK_SIZE = 5000)
+        workers: Số process trích xuất (xem extract_jsf_data)
+        username: Người import (ghi vào import_batches)
+        conn: Database connection (default: shared connection)
+        resume: Checkpoint cuối cùng của lần chạy bị ngắt (None = từ đầu)
+        on_checkpoint: Callback(checkpoint) khi mở batch và sau mỗi lô
+        prepare_workers: Số thread chuẩn hóa + validation (default: JSF_PREPARE_WORKERS)
         
     Returns:
-        Dict với kết quả import tổng hợp
+        Dict với kết quả import tổng hợp; throughput = số dòng/giây của
+        từng giai đoạn (extract, prepare, write)
     """
     if chunk_size is None:
         chunk_size = CHUNK_SIZE
+    if prepare_workers is None:
+        prepare_workers = JSF_PREPARE_WORKERS
+    prepare_workers = max(1, prepare_workers)
+    if conn is None:
+        conn = get_connection()
+    resume = resume or {}
     
-    # 1. Trích xuất toàn bộ dữ liệu từ JSF
-    if progress_callback:
-        progress_callback(0.0, "Đang đọc file JSF...")
-    
-    df = extract_jsf_data(file_path)
+    source_name = Path(file_path).name
+    file_hash = file_digest(file_path)
+    key = cache_key(file_path, variant="jsf", digest=file_hash)
     
-    if df is None or df.empty:
-        return {
+    batch_id = resume.get("batch_id")
+    try:
+        # Đã import và dữ liệu không đổi -> không làm gì
+        already = None if resume else check_already_imported(key, conn, source_name)
+        if already:
+            if progress_callback:
+                progress_callback(1.0, already["message"])
+            return already
+        
+        cached_parts = cached_table_parts(key)
+        from_cache = cached_parts is not None
+        cached_rows = cached_pages = 0
+        if from_cache:
+            entry = get_cache_entry(key) or {}
+            cached_rows = entry.get("rows") or 0
+            cached_pages = entry.get("pages") or 0
+            if not cached_pages:
+                with pdfplumber.open(file_path) as pdf:
+                    cached_pages = len(pdf.pages)
+        
+        if batch_id is None:
+            batch_id = start_batch(conn, file_hash, source_name, username)
+            if on_checkpoint:
+                # Ghi batch_id trước lô đầu: bị ngắt thì lần sau chạy lại từ đầu với batch này
+                on_checkpoint({"batch_id": batch_id})
+    except Exception as e:
+        result = {
             "success": False,
-            "error": "Không thể đọc dữ liệu từ file JSF hoặc file trống",
+            "error": str(e),
             "rows_imported": 0,
             "rows_skipped": 0
         }
-    
-    total_rows = len(df)
-    source_name = Path(file_path).name
-    
-    if progress_callback:
-        progress_callback(0.1, f"Đã đọc {total_rows:,} dòng, bắt đầu import...")
-    
-    # 2. Nếu file nhỏ, dùng import thông thường
-    if total_rows <= chunk_size:
-        if progress_callback:
-            progress_callback(0.5, "File nhỏ, import trực tiếp...")
-        result = import_jsf(file_path)
-        if progress_callback:
-            progress_callback(1.0, "Hoàn thành!")
+        # Batch đã mở (lần chạy trước) -> đánh dấu lỗi để có thể rollback
+        try:
+            finish_batch(conn, batch_id, result)
+        except Exception:
+            pass
         return result
     
-    # 3. Chia thành chunks và import
-    conn = get_connection()
-    total_chunks = (total_rows + chunk_size - 1) // chunk_size
-    
-    total_inserted = 0
-    total_updated = 0
-    total_skipped = 0
+    if progress_callback:
+        progress_callback(0.0, "Đang đọc bảng từ cache..." if from_cache else "Đang đọc file JSF...")
+    
+    # Trạng thái trích xuất, cập nhật từ thread đọc file
+    pages = {"read": resume.get("page", 0), "total": 0}
+    # Import tiếp: bảng cache chia từ dòng đã commit; trích xuất từ trang sau
+    # trang đã commit, hoặc (không biết trang) từ đầu rồi bỏ các dòng đã commit
+    first_page = resume.get("page", 0) + 1
+    skip_rows = resume.get("rows", 0) if first_page == 1 else 0
+    
+    def on_page(page_no: int, page_count: int):
+        pages["read"], pages["total"] = page_no, page_count
+    
+    # Hàng đợi giới hạn: thread đọc file chỉ đi trước bên ghi DB tối đa
+    # prepare_workers + 1 lô (đang chuẩn hóa hoặc chờ ghi)
+    batches: "queue.Queue" = queue.Queue(maxsize=prepare_workers + 1)
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=prepare_workers, thread_name_prefix="jsf-prepare")
+    # Thời gian làm việc của thread đọc file (không tính lúc chờ hàng đợi)
+    extract_busy = {"s": 0.0, "since": 0.0}
+    rows_sent = [resume.get("rows", 0)]
+    
+    def send(item) -> bool:
+        # put() có timeout để thread không kẹt nếu bên ghi DB đã dừng
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def dispatch(item) -> bool:
+        # Lô được đưa vào thread pool ngay, bên ghi DB nhận future theo thứ tự
+        chunk_df, last_page, page_count = item
+        future = pool.submit(_prepare_chunk, chunk_df, source_name, rows_sent[0] + 2)
+        rows_sent[0] += len(chunk_df)
+        extract_busy["s"] += time.perf_counter() - extract_busy["since"]
+        sent = send(("batch", (future, len(chunk_df), last_page, page_count)))
+        extract_busy["since"] = time.perf_counter()
+        return sent
+    
+    def produce():
+        extract_busy["since"] = time.perf_counter()
+        try:
+            if from_cache:
+                batches_iter = _iter_cached_batches(
+                    cached_parts, cached_rows, chunk_size, cached_pages, on_page,
+                    start_row=resume.get("rows", 0)
+                )
+                for item in batches_iter:
+                    if not dispatch(item):
+                        return
+                return
+            
+            # Lần trích xuất đầu: ghi cache từng lô (mỗi lô một phần Parquet)
+            caching = first_page == 1
+            cached = {"parts": 0, "rows": 0}
+            skip = skip_rows
+            try:
+                for item in iter_jsf_batches(file_path, chunk_size, workers, on_page, first_page):
+                    if caching:
+                        caching = write_cached_part(key, cached["parts"], item[0])
+                        cached["parts"] += 1
+                        cached["rows"] += len(item[0])
+                    if skip >= len(item[0]):
+                        skip -= len(item[0])
+                        continue
+                    if skip:
+                        item = (item[0].iloc[skip:], item[1], item[2])
+                        skip = 0
+                    if not dispatch(item):
+                        return
+                # Đọc hết file không lỗi -> giữ bảng cho lần upload lại
+                if caching and cached["parts"]:
+                    finish_cached_parts(
+                        key, cached["parts"], cached["rows"], source_name, pages=pages["total"]
+                    )
+                    caching = False
+            finally:
+                if caching:
+                    discard_cached_parts(key)
+        except Exception as e:
+            send(("error", e))
+        finally:
+            extract_busy["s"] += time.perf_counter() - extract_busy["since"]
+            send(("done", None))
+    
+    reader = threading.Thread(target=produce, name="jsf-reader", daemon=True)
+    reader.start()
+    
+    total_rows = resume.get("rows", 0)
+    total_inserted = resume.get("inserted", 0)
+    total_updated = resume.get("updated", 0)
+    total_unchanged = resume.get("unchanged", 0)
+    total_skipped = resume.get("skipped", 0)
+    total_chunks = resume.get("chunks", 0)
     errors = []
+    validation_report = {"total_errors": 0, "total_warnings": 0, "details": []}
+    timings = {"extract_wait": 0.0, "prepare": 0.0, "prepare_wait": 0.0, "write": 0.0}
     
-    for i, chunk_start in enumerate(range(0, total_rows, chunk_size)):
-        chunk_end = min(chunk_start + chunk_size, total_rows)
-        chunk_df = df.iloc[chunk_start:chunk_end]
-        
-        # Cập nhật progress
-        if progress_callback:
-            progress = 0.1 + (0.85 * (i + 1) / total_chunks)
-            progress_callback(
-                progress, 
-                f"Đang xử lý chunk {i + 1}/{total_chunks} ({chunk_end:,}/{total_rows:,} dòng)..."
-            )
-        
-        # Import chunk
-        try:
-            chunk_result = _process_and_import_chunk(chunk_df, source_name, conn)
-            total_inserted += chunk_result.get("inserted", 0)
-            total_updated += chunk_result.get("updated", 0)
-            total_skipped += chunk_result.get("skipped", 0)
+    def report(message: str):
+        if progress_callback and pages["total"]:
+            progress_callback(min(pages["read"] / pages["total"], 1.0) * 0.99, message)
+    
+    try:
+        while True:
+            wait_start = time.perf_counter()
+            try:
+                kind, payload = batches.get(timeout=0.25)
+            except queue.Empty:
+                timings["extract_wait"] += time.perf_counter() - wait_start
+                report(f"Đang đọc trang {pages['read']}/{pages['total']}...")
+                continue
+            timings["extract_wait"] += time.perf_counter() - wait_start
+            
+            if kind == "done":
+                break
+            if kind == "error":
+                errors.append(f"Đọc file: {payload}")
+                continue
+            
+            future, chunk_rows, last_page, page_count = payload
+            total_chunks += 1
             
-            if chunk_result.get("error"):
-                errors.append(f"Chunk {i + 1}: {chunk_result['error']}")
+            # Import lô (chờ thread pool chuẩn hóa xong nếu chưa xong)
+            write_start = time.perf_counter()
+            try:
+                prepared = future.result()
+                timings["prepare"] += prepared.get("prepare_s", 0.0)
+                timings["prepare_wait"] += time.perf_counter() - write_start
+                write_start = time.perf_counter()
+                chunk_result = _write_prepared_chunk(prepared, chunk_rows, conn, batch_id=batch_id)
+                total_inserted += chunk_result.get("inserted", 0)
+                total_updated += chunk_result.get("updated", 0)
+                total_unchanged += chunk_result.get("unchanged", 0)
+                total_skipped += chunk_result.get("skipped", 0)
+                _merge_validation_reports(validation_report, chunk_result.get("validation_report"))
                 
-        except Exception as e:
-            errors.append(f"Chunk {i + 1}: {str(e)}")
+                if chunk_result.get("error"):
+                    errors.append(f"Chunk {total_chunks}: {chunk_result['error']}")
+                    
+            except Exception as e:
+                errors.append(f"Chunk {total_chunks}: {str(e)}")
+            timings["write"] += time.perf_counter() - write_start
+            
+            total_rows += chunk_rows
+            if on_checkpoint:
+                on_checkpoint({
+                    # Trang của lô từ cache chỉ là ước lượng -> không dùng để resume
+                    "page": 0 if from_cache else last_page,
+                    "rows": total_rows,
+                    "batch_id": batch_id,
+                    "chunks": total_chunks,
+                    "inserted": total_inserted,
+                    "updated": total_updated,
+                    "unchanged": total_unchanged,
+                    "skipped": total_skipped,
+                })
+            report(
+                f"Đã xử lý trang {last_page}/{page_count} "
+                f"({total_rows:,} dòng, chunk {total_chunks})..."
+            )
+    finally:
+        stop.set()
+        reader.join(timeout=5)
+        pool.shutdown(wait=True, cancel_futures=True)
+    timings["extract"] = extract_busy["s"]
+    
+    if total_rows == 0:
+        result = {
+            "success": False,
+            "error": errors[0] if errors else "Không thể đọc dữ liệu từ file JSF hoặc file trống",
+            "rows_imported": 0,
+            "rows_skipped": 0
+        }
+        finish_batch(conn, batch_id, result)
+        return result
+    
+    if not errors:
+        mark_imported(key, conn, total_inserted + total_updated + total_unchanged)
     
     if progress_callback:
         progress_callback(1.0, "Hoàn thành!")
     
-    return {
+    result = {
         "success": len(errors) == 0,
-        "rows_imported": total_inserted + total_updated,
+        "batch_id": batch_id,
+        "rows_imported": total_inserted + total_updated + total_unchanged,
         "rows_inserted": total_inserted,
         "rows_updated": total_updated,
+        "rows_unchanged": total_unchanged,
         "rows_skipped": total_skipped,
         "total_chunks": total_chunks,
         "chunk_size": chunk_size,
+        "pages": pages["total"],
+        "timings": {k: round(v, 3) for k, v in timings.items()},
+        "throughput": _stage_throughput(total_rows - resume.get("rows", 0), timings),
         "errors": errors if errors else None,
+        "validation_report": validation_report,
+        "from_cache": from_cache,
         "source_file": source_name
     }
-
+    finish_batch(conn, batch_id, result, timings=result["timings"])
+    return result
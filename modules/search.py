@@ -6,22 +6,42 @@ Optimized Version:
 - Extracted SEARCH_COLUMNS constant (DRY)
 - Eliminated redundant COUNT query via window function
 - Pre-normalize keywords in Python for better index utilization
+- Not-found passports computed once per batch via SQL anti-join
+- Bloom-filter negative cache: definite misses never reach DuckDB
+- Keyset (cursor) pagination for batch search
+- Tiered, relevance-ranked single search with early termination
+- Per-passport stay timeline (raw entries + merged islands)
+- Address search over a tokenized address index
 """
 
 from typing import List, Dict, Any, Optional, Tuple
 from functools import lru_cache
+from datetime import date, timedelta
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 
 from database.connection import get_connection, execute_query
+from database.models import address_key_sql
+from database.passport_filter import (
+    get_passport_filter,
+    record_false_positives,
+    split_definite_misses
+)
 from utils.text_utils import (
     normalize_passport, 
     normalize_for_search, 
     split_passports,
     remove_diacritics
 )
+from utils.pagination import (
+    NULL_SORT_DATE,
+    build_keyset_condition,
+    decode_cursor,
+    encode_cursor,
+    query_fingerprint
+)
 from config import PAGE_SIZE, MAX_BATCH_SIZE
 
 
@@ -61,13 +81,43 @@ STATUS_PRIORITY_CASE = """
 """
 
 
+# Max results of single search
+SINGLE_SEARCH_LIMIT = 100
+
+# Match quality score per search tier (higher = better)
+MATCH_SCORES = {
+    "exact": 1.0,
+    "prefix": 0.8,
+    "name_token": 0.6,
+    "substring": 0.4,
+}
+
+# Name key for token matching: upper case, accents removed (Đ is not a combining accent)
+NAME_KEY_SQL = "strip_accents(REPLACE(UPPER(COALESCE(ho_ten, '')), 'Đ', 'D'))"
+
+# Keyset sort for batch search: status priority, newest arrival, passport (tie-breaker)
+BATCH_SORT_COLUMNS = [
+    ("_sort_priority", "ASC"),
+    ("_sort_date", "DESC"),
+    ("so_ho_chieu", "ASC"),
+]
+
+
 # ============================================
 # SINGLE SEARCH
 # ============================================
 
-def search_single(keyword: str) -> List[Dict[str, Any]]:
+def search_single(keyword: str, limit: int = SINGLE_SEARCH_LIMIT) -> List[Dict[str, Any]]:
     """
-    Search for a single passport or name.
+    Search for a single passport or name, ranked by match quality.
+    
+    Tiered search with early termination - each tier only runs if the
+    previous ones returned fewer than `limit` records, and an exact passport
+    hit ends the search right away (a passport identifies one person):
+    1. Exact passport key (score 1.0)
+    2. Passport prefix (score 0.8)
+    3. All name tokens match whole words, accents ignored (score 0.6)
+    4. Substring match on passport/name ignoring spaces (score 0.4)
     
     Features:
     - Fuzzy search ignoring spaces and case
@@ -75,9 +125,11 @@ def search_single(keyword: str) -> List[Dict[str, Any]]:
     
     Args:
         keyword: Passport number or name to search
+        limit: Max number of results
         
     Returns:
-        List of matching records
+        List of matching records, best matches first. Each record carries
+        'match_tier' and 'match_score'.
     """
     if not keyword or len(keyword.strip()) < 2:
         return []
@@ -87,31 +139,68 @@ def search_single(keyword: str) -> List[Dict[str, Any]]:
     # Pre-normalize keyword in Python (faster than SQL functions on every row)
     # Normalize: UPPER, remove spaces, remove diacritics
     clean_keyword = remove_diacritics(raw_keyword).upper().replace(" ", "")
+    passport_key = normalize_passport(raw_keyword)
+    name_tokens = normalize_for_search(raw_keyword).upper().split()
     
-    # Build optimized query
-    # The view already has so_ho_chieu as TRIM(UPPER(...)), so we can match directly
-    sql = f"""
-    SELECT {SEARCH_COLUMNS}
-    FROM view_tong_hop_final
-    WHERE 
-        -- Passport search: view already has normalized so_ho_chieu (TRIM UPPER)
-        -- We still need REPLACE for space-insensitive matching
-        REPLACE(so_ho_chieu, ' ', '') LIKE ? 
-        
-        -- Name search: ignore spaces for fuzzy matching
-        OR REPLACE(UPPER(ho_ten), ' ', '') LIKE ?
-        
-        -- Fallback: Original keyword for exact match
-        OR UPPER(ho_ten) LIKE ?
-    ORDER BY ngay_den DESC
-    LIMIT 100
-    """
+    tiers = []
+    
+    # Passport tiers only make sense for passport-like keywords
+    if passport_key and passport_key.isalnum():
+        tiers.append(("exact", "so_ho_chieu = ?", [passport_key]))
+        tiers.append(("prefix", "so_ho_chieu LIKE ?", [f"{passport_key}%"]))
     
-    # Search patterns
+    if any(c.isalpha() for c in clean_keyword):
+        token_conds = " AND ".join([f"(' ' || {NAME_KEY_SQL} || ' ') LIKE ?" for _ in name_tokens])
+        tiers.append(("name_token", token_conds, [f"% {t} %" for t in name_tokens]))
+    
+    # Fallback: the original fuzzy conditions
+    # The view already has so_ho_chieu as TRIM(UPPER(...)), so we can match directly
     pattern_normalized = f"%{clean_keyword}%"
     pattern_original = f"%{raw_keyword.upper()}%"
+    tiers.append((
+        "substring",
+        """(
+            REPLACE(so_ho_chieu, ' ', '') LIKE ?
+            OR REPLACE(UPPER(ho_ten), ' ', '') LIKE ?
+            OR UPPER(ho_ten) LIKE ?
+        )""",
+        [pattern_normalized, pattern_normalized, pattern_original]
+    ))
+    
+    results = []
+    found = []
+    
+    for tier_name, condition, tier_params in tiers:
+        remaining = limit - len(results)
+        if remaining <= 0:
+            break
+        
+        params = list(tier_params)
+        exclude_clause = ""
+        if found:
+            exclude_clause = f"AND so_ho_chieu NOT IN ({', '.join(['?' for _ in found])})"
+            params.extend(found)
+        
+        sql = f"""
+        SELECT {SEARCH_COLUMNS}
+        FROM view_tong_hop_final
+        WHERE {condition}
+        {exclude_clause}
+        ORDER BY ngay_den DESC
+        LIMIT ?
+        """
+        params.append(remaining)
+        
+        for record in execute_query(sql, tuple(params)):
+            record["match_tier"] = tier_name
+            record["match_score"] = MATCH_SCORES[tier_name]
+            results.append(record)
+            found.append(record["so_ho_chieu"])
+        
+        if tier_name == "exact" and results:
+            break
     
-    return execute_query(sql, (pattern_normalized, pattern_normalized, pattern_original))
+    return results
 
 
 # ============================================
@@ -121,88 +210,141 @@ def search_single(keyword: str) -> List[Dict[str, Any]]:
 def search_batch(
     keywords: List[str], 
     limit: int = PAGE_SIZE, 
-    offset: int = 0
+    offset: int = 0,
+    cursor: Optional[str] = None
 ) -> Dict[str, Any]:
     """
     Search for multiple passports (batch search).
     
     Optimized: Uses window function COUNT(*) OVER() to avoid separate COUNT query.
+    The first page (offset = 0) also carries the exact not-found list for the
+    whole batch under "notFound"; later pages skip it so the caller keeps the
+    list computed once with the batch.
+    
+    Passports the Bloom filter rules out (never imported) are classified as
+    not found without querying DuckDB; only the remaining candidates are
+    looked up.
+    
+    Keyset pagination: pass the "nextCursor" of the previous page as `cursor`.
+    The next page is read after the last sort key (status priority, ngay_den,
+    passport) instead of OFFSET, and the total is carried in the cursor, so
+    deep pages cost the same as the first one.
     
     Args:
         keywords: List of passport numbers
         limit: Results per page
-        offset: Pagination offset
+        offset: Pagination offset (ignored when cursor is given)
+        cursor: Continuation token from a previous page (optional)
         
     Returns:
         Dict with results and pagination info
     """
     if not keywords:
-        return {"results": [], "total": 0, "hasMore": False}
+        return {"results": [], "total": 0, "hasMore": False, "nextCursor": None, "notFound": []}
     
     # Pre-normalize keywords in Python (move work to app layer)
     normalized = _deduplicate_and_normalize(keywords)
     
     if not normalized:
-        return {"results": [], "total": 0, "hasMore": False}
+        return {"results": [], "total": 0, "hasMore": False, "nextCursor": None, "notFound": []}
     
     # Limit batch size
     if len(normalized) > MAX_BATCH_SIZE:
         normalized = normalized[:MAX_BATCH_SIZE]
     
+    fingerprint = query_fingerprint("search_batch", normalized)
+    state = decode_cursor(cursor, fingerprint) if cursor else None
+    if state is not None:
+        offset = state["fetched"]
+    
+    # Definite misses are answered by the Bloom filter, only candidates hit DuckDB
+    misses, candidates = split_definite_misses(normalized)
+    
+    # Not-found set is a property of the whole batch, compute it on the first page only
+    not_found = None
+    if offset == 0:
+        missing = set(misses)
+        db_missing = get_not_found_batch(candidates)
+        record_false_positives(len(db_missing))
+        missing.update(db_missing)
+        not_found = [p for p in normalized if p in missing]
+    
+    if not candidates:
+        return {
+            "results": [], "total": 0, "hasMore": False, "nextCursor": None,
+            "offset": offset, "limit": limit, "notFound": not_found or []
+        }
+    
     # Build parameterized IN clause
-    placeholders = ", ".join(["?" for _ in normalized])
+    placeholders = ", ".join(["?" for _ in candidates])
+    params = list(candidates)
+    
+    if state is None:
+        # First page (or legacy offset): single query with window function for total count
+        keyset_clause = "1=1"
+        total_column = "COUNT(*) OVER() as _total_count"
+        page_clause = "LIMIT ? OFFSET ?"
+        page_params = [limit, offset]
+    else:
+        # Next page: seek past the last sort key, total comes from the cursor
+        keyset_clause, keyset_params = build_keyset_condition(BATCH_SORT_COLUMNS, state["key"])
+        params.extend(keyset_params)
+        total_column = "NULL as _total_count"
+        page_clause = "LIMIT ?"
+        page_params = [limit]
     
-    # OPTIMIZED: Single query with window function for total count
-    # This eliminates the need for a separate COUNT(*) query
     sql = f"""
     SELECT 
-        {SEARCH_COLUMNS},
-        COUNT(*) OVER() as _total_count
-    FROM view_tong_hop_final
-    WHERE so_ho_chieu IN ({placeholders})
-    ORDER BY {STATUS_PRIORITY_CASE}, ngay_den DESC
-    LIMIT ? OFFSET ?
+        *,
+        {total_column}
+    FROM (
+        SELECT
+            {SEARCH_COLUMNS},
+            {STATUS_PRIORITY_CASE} as _sort_priority,
+            COALESCE(ngay_den, DATE '{NULL_SORT_DATE}') as _sort_date
+        FROM view_tong_hop_final
+        WHERE so_ho_chieu IN ({placeholders})
+    )
+    WHERE {keyset_clause}
+    ORDER BY _sort_priority, _sort_date DESC, so_ho_chieu
+    {page_clause}
     """
     
-    params = tuple(normalized) + (limit, offset)
-    
     conn = get_connection()
-    result = conn.execute(sql, params)
+    result = conn.execute(sql, tuple(params + page_params))
     columns = [desc[0] for desc in result.description]
     rows = result.fetchall()
     
-    if not rows:
-        return {
-            "results": [],
-            "total": 0,
-            "hasMore": False,
-            "offset": offset,
-            "limit": limit
-        }
-    
-    # Extract total from first row's _total_count column
-    total_idx = columns.index("_total_count")
-    total = rows[0][total_idx]
+    if state is not None:
+        total = state["total"]
+    elif rows:
+        # Extract total from first row's _total_count column
+        total = rows[0][columns.index("_total_count")]
+    else:
+        total = 0
     
-    # Convert to dicts, excluding the _total_count column
-    result_columns = [c for c in columns if c != "_total_count"]
+    # Convert to dicts, excluding internal columns (_total_count, _sort_*)
     results = []
+    last_key = None
     for row in rows:
-        record = {}
-        for i, col in enumerate(columns):
-            if col != "_total_count":
-                record[col] = row[i]
-        results.append(record)
+        record = dict(zip(columns, row))
+        last_key = (record["_sort_priority"], record["_sort_date"], record["so_ho_chieu"])
+        results.append({c: v for c, v in record.items() if not c.startswith("_")})
     
-    has_more = (offset + len(results)) < total
+    fetched = offset + len(results)
+    has_more = fetched < total
     
-    return {
+    response = {
         "results": results,
         "total": total,
         "hasMore": has_more,
+        "nextCursor": encode_cursor(last_key, total, fetched, fingerprint) if has_more and last_key else None,
         "offset": offset,
         "limit": limit
     }
+    if not_found is not None:
+        response["notFound"] = not_found
+    return response
 
 
 def search_batch_all(keywords: List[str]) -> List[Dict[str, Any]]:
@@ -226,16 +368,262 @@ def search_batch_all(keywords: List[str]) -> List[Dict[str, Any]]:
     if len(normalized) > MAX_BATCH_SIZE:
         normalized = normalized[:MAX_BATCH_SIZE]
     
-    placeholders = ", ".join(["?" for _ in normalized])
+    # Same Bloom-filter pre-check as search_batch (not counted in filter metrics)
+    present = get_passport_filter().contains_many(normalized)
+    candidates = [p for p, hit in zip(normalized, present) if hit]
+    if not candidates:
+        return []
+    
+    placeholders = ", ".join(["?" for _ in candidates])
     
     sql = f"""
     SELECT {SEARCH_COLUMNS}
     FROM view_tong_hop_final
     WHERE so_ho_chieu IN ({placeholders})
-    ORDER BY {STATUS_PRIORITY_CASE}, ngay_den DESC
+    ORDER BY {STATUS_PRIORITY_CASE}, ngay_den DESC, so_ho_chieu
     """
     
-    return execute_query(sql, tuple(normalized))
+    return execute_query(sql, tuple(candidates))
+
+
+# ============================================
+# STAY TIMELINE
+# ============================================
+
+def get_timeline(passport: str) -> Dict[str, Any]:
+    """
+    Get the full stay history of one passport.
+    
+    Reads only that passport's rows from raw_immigration, looked up by the
+    normalized passport_key (unique index with ngay_den, the same key as
+    search_batch), and merges stays into islands in Python with the same rules as
+    view_tong_hop_final:
+    - Duplicate (passport, ngay_den): keep latest update
+    - A new island starts when ngay_den > previous max end + 1 day
+    - Open stays (no ngay_di) end today
+    
+    Args:
+        passport: Passport number
+        
+    Returns:
+        Dict with 'passport', 'entries' (deduplicated raw rows, oldest first,
+        each tagged with island_id) and 'islands'
+    """
+    key = normalize_passport(passport)
+    if not key:
+        return {"passport": key, "entries": [], "islands": []}
+    
+    sql = """
+    SELECT * EXCLUDE(rn)
+    FROM (
+        SELECT
+            ngay_den,
+            ngay_di,
+            dia_chi_tam_tru,
+            ho_ten,
+            ngay_sinh,
+            quoc_tich,
+            ket_qua_xac_minh,
+            source_file,
+            thoi_diem_cap_nhat,
+            ROW_NUMBER() OVER(
+                PARTITION BY ngay_den
+                ORDER BY
+                    thoi_diem_cap_nhat DESC,
+                    CASE WHEN ngay_di IS NULL THEN 1 ELSE 0 END,
+                    ngay_di DESC
+            ) AS rn
+        FROM raw_immigration
+        WHERE passport_key = ?
+    )
+    WHERE rn = 1
+    ORDER BY ngay_den NULLS FIRST
+    """
+    
+    entries = execute_query(sql, (key,))
+    
+    today = date.today()
+    islands = []
+    current = None
+    prev_max_end = None
+    
+    for entry in entries:
+        arrival = entry["ngay_den"]
+        if arrival is None:
+            entry["island_id"] = None
+            continue
+        
+        end_eff = entry["ngay_di"] or today
+        
+        if prev_max_end is None or arrival > prev_max_end + timedelta(days=1):
+            current = {
+                "island_id": len(islands) + 1,
+                "ngay_den": arrival,
+                "ngay_di": None,
+                "end_eff": end_eff,
+                "dia_chi": [],
+                "source_files": [],
+                "so_lan": 0,
+            }
+            islands.append(current)
+        
+        prev_max_end = end_eff if prev_max_end is None else max(prev_max_end, end_eff)
+        entry["island_id"] = current["island_id"]
+        
+        current["so_lan"] += 1
+        if entry["ngay_di"] and (current["ngay_di"] is None or entry["ngay_di"] > current["ngay_di"]):
+            current["ngay_di"] = entry["ngay_di"]
+        if entry["dia_chi_tam_tru"] and entry["dia_chi_tam_tru"] not in current["dia_chi"]:
+            current["dia_chi"].append(entry["dia_chi_tam_tru"])
+        if entry["source_file"] and entry["source_file"] not in current["source_files"]:
+            current["source_files"].append(entry["source_file"])
+    
+    for island in islands:
+        # Same as view: island end = max real departure, else today
+        island["end_eff"] = island["ngay_di"] or today
+        island["so_ngay"] = (min(island["end_eff"], today) - island["ngay_den"]).days + 1
+    
+    return {"passport": key, "entries": entries, "islands": islands}
+
+
+# ============================================
+# TRAVEL GROUPS (người đi cùng)
+# ============================================
+
+def find_companions(passport: str, limit: int = 200) -> List[Dict[str, Any]]:
+    """
+    Find people who arrived on the same day at the same address.
+    
+    Answered from the precomputed travel_group table (index lookups on
+    so_ho_chieu and group_id), not from the summary view.
+    
+    Args:
+        passport: Passport number
+        limit: Max companions returned
+        
+    Returns:
+        Companion records (group_id, ngay_den, so_ho_chieu, ho_ten, ngay_sinh,
+        quoc_tich, dia_chi_tam_tru), newest arrival first
+    """
+    key = normalize_passport(passport)
+    if not key:
+        return []
+    
+    sql = """
+    SELECT
+        c.group_id,
+        c.ngay_den,
+        c.so_ho_chieu,
+        c.ho_ten,
+        c.ngay_sinh,
+        c.quoc_tich,
+        c.dia_chi_tam_tru
+    FROM travel_group g
+    JOIN travel_group c ON c.group_id = g.group_id
+    WHERE g.so_ho_chieu = ?
+      AND c.so_ho_chieu != g.so_ho_chieu
+    ORDER BY c.ngay_den DESC, c.ho_ten
+    LIMIT ?
+    """
+    
+    return execute_query(sql, (key, limit))
+
+
+# ============================================
+# ADDRESS SEARCH (tra cứu theo địa chỉ)
+# ============================================
+
+ADDRESS_SEARCH_LIMIT = 500
+
+
+def search_by_address(
+    query: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    limit: int = ADDRESS_SEARCH_LIMIT
+) -> Dict[str, Any]:
+    """
+    Find current and past residents of an address.
+    
+    The query is tokenized with the same normalization as the stored
+    address_key (lowercase, no diacritics, non-alphanumerics as separators);
+    a stay matches when its address contains every query token. Lookups hit
+    the address_token index instead of scanning dia_chi_tam_tru with LIKE.
+    
+    Args:
+        query: Address text (e.g. "12 Trần Phú, Ba Đình")
+        date_from: Only stays that overlap [date_from, date_to] (optional)
+        date_to: See date_from (optional)
+        limit: Max stays returned
+        
+    Returns:
+        Dict with keys: results, current, past, tokens
+        Each record: so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den,
+        ngay_di, dia_chi_tam_tru, dang_o (still staying today)
+    """
+    empty = {"results": [], "current": [], "past": [], "tokens": []}
+    if not query or not query.strip():
+        return empty
+    
+    conn = get_connection()
+    
+    # Tokenize with the same SQL expression used to build the index
+    tokens_row = conn.execute(
+        f"SELECT list_distinct(string_split({address_key_sql('?')}, ' '))",
+        [query]
+    ).fetchone()
+    tokens = [t for t in (tokens_row[0] if tokens_row else None) or [] if t]
+    if not tokens:
+        return empty
+    
+    conditions = []
+    params: List[Any] = [tokens, len(tokens)]
+    
+    if date_to:
+        conditions.append("g.ngay_den <= ?")
+        params.append(date_to)
+    if date_from:
+        conditions.append("COALESCE(g.ngay_di, CURRENT_DATE) >= ?")
+        params.append(date_from)
+    
+    where_clause = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+    params.append(limit)
+    
+    sql = f"""
+    WITH matched AS (
+        SELECT so_ho_chieu, ngay_den
+        FROM address_token
+        WHERE token IN (SELECT UNNEST(?::VARCHAR[]))
+        GROUP BY so_ho_chieu, ngay_den
+        HAVING COUNT(DISTINCT token) = ?
+    )
+    SELECT
+        g.so_ho_chieu,
+        g.ho_ten,
+        g.ngay_sinh,
+        g.quoc_tich,
+        g.ngay_den,
+        g.ngay_di,
+        g.dia_chi_tam_tru,
+        (g.ngay_di IS NULL OR g.ngay_di >= CURRENT_DATE) AS dang_o
+    FROM matched m
+    JOIN travel_group g
+      ON g.so_ho_chieu = m.so_ho_chieu AND g.ngay_den = m.ngay_den
+    {where_clause}
+    ORDER BY dang_o DESC, g.ngay_den DESC, g.so_ho_chieu
+    LIMIT ?
+    """
+    
+    # Query errors propagate like the other searches: an empty result must
+    # mean "no residents", not "the query failed"
+    results = execute_query(sql, tuple(params))
+    
+    return {
+        "results": results,
+        "current": [r for r in results if r.get("dang_o")],
+        "past": [r for r in results if not r.get("dang_o")],
+        "tokens": tokens,
+    }
 
 
 # ============================================
@@ -263,6 +651,42 @@ def _deduplicate_and_normalize(keywords: List[str]) -> List[str]:
     return result
 
 
+def get_not_found_batch(normalized: List[str]) -> List[str]:
+    """
+    Get passports of a batch that do not exist in the database.
+    
+    Computed in SQL as an anti-join of the keyword list against the indexed
+    raw_immigration.passport_key (TRIM(UPPER(so_ho_chieu)), kept by
+    upsert_raw_immigration), so the result covers the whole batch regardless
+    of pagination.
+    
+    Args:
+        normalized: Normalized, deduplicated passport list
+        
+    Returns:
+        Not found passports, in input order
+    """
+    if not normalized:
+        return []
+    
+    sql = """
+    WITH keywords AS (
+        SELECT UNNEST(?::VARCHAR[]) AS passport
+    )
+    SELECT k.passport
+    FROM keywords k
+    WHERE NOT EXISTS (
+        SELECT 1 FROM raw_immigration r
+        WHERE r.passport_key = k.passport
+    )
+    """
+    
+    conn = get_connection()
+    missing = {row[0] for row in conn.execute(sql, (list(normalized),)).fetchall()}
+    
+    return [p for p in normalized if p in missing]
+
+
 def get_not_found(keywords: List[str], found_passports: List[str]) -> List[str]:
     """
     Get list of passports that were not found in search.
@@ -18,6 +18,20 @@ from utils.filter_utils import (
     build_date_conditions, 
     build_residence_status_condition
 )
+from utils.pagination import (
+    NULL_SORT_DATE,
+    build_keyset_condition,
+    decode_cursor,
+    encode_cursor,
+    query_fingerprint
+)
+
+
+# Keyset sort for person list: newest arrival first, passport as tie-breaker
+PERSON_LIST_SORT_COLUMNS = [
+    ("_sort_date", "DESC"),
+    ("so_ho_chieu", "ASC"),
+]
 
 
 def get_statistics(
@@ -174,13 +188,19 @@ def get_person_list(
     residence_status: str = None,
     limit: int = PAGE_SIZE,
     offset: int = 0,
-    min_days: int = None
+    min_days: int = None,
+    cursor: str = None
 ) -> Dict[str, Any]:
     """
     Get detailed list of persons with pagination
     
+    Keyset pagination: pass the "nextCursor" of the previous page as `cursor`.
+    The COUNT query runs only for the first page; later pages seek past the
+    last (ngay_den, so_ho_chieu) instead of using OFFSET.
+    
     Args:
         Same as get_statistics plus limit/offset
+        cursor: Continuation token from a previous page (optional)
         
     Returns:
         Dict with results and pagination info
@@ -212,51 +232,78 @@ def get_person_list(
     
     where_clause = " AND ".join(conditions) if conditions else "1=1"
     
-    # Count total
-    count_sql = f"""
-    SELECT COUNT(*) as total
-    FROM view_tong_hop_final
-    WHERE {where_clause}
-    """
+    fingerprint = query_fingerprint("get_person_list", where_clause, params)
+    state = decode_cursor(cursor, fingerprint) if cursor else None
     
     conn = get_connection()
-    total_result = conn.execute(count_sql, tuple(params)).fetchone()
-    total = total_result[0] if total_result else 0
+    
+    if state is None:
+        # Count total (first page only, carried in the cursor afterwards)
+        count_sql = f"""
+        SELECT COUNT(*) as total
+        FROM view_tong_hop_final
+        WHERE {where_clause}
+        """
+        
+        total_result = conn.execute(count_sql, tuple(params)).fetchone()
+        total = total_result[0] if total_result else 0
+        keyset_clause = "1=1"
+        keyset_params = []
+        page_clause = "LIMIT ? OFFSET ?"
+        page_params = [limit, offset]
+    else:
+        total = state["total"]
+        offset = state["fetched"]
+        keyset_clause, keyset_params = build_keyset_condition(PERSON_LIST_SORT_COLUMNS, state["key"])
+        page_clause = "LIMIT ?"
+        page_params = [limit]
     
     # Get results
     sql = f"""
-    SELECT 
-        ho_ten,
-        ngay_sinh,
-        quoc_tich,
-        so_ho_chieu,
-        ngay_den,
-        ngay_di,
-        dia_chi_tam_tru,
-        so_lan_nhap_canh,
-        tong_ngay_luu_tru_2025,
-        tong_ngay_tich_luy,
-        ket_qua_xac_minh,
-        muc_dich_he_thong,
-        trang_thai_cuoi_cung,
-        labor_detail,
-        marriage_detail,
-        watchlist_detail
-    FROM view_tong_hop_final
-    WHERE {where_clause}
-    ORDER BY ngay_den DESC
-    LIMIT ? OFFSET ?
+    SELECT *
+    FROM (
+        SELECT 
+            ho_ten,
+            ngay_sinh,
+            quoc_tich,
+            so_ho_chieu,
+            ngay_den,
+            ngay_di,
+            dia_chi_tam_tru,
+            so_lan_nhap_canh,
+            tong_ngay_luu_tru_2025,
+            tong_ngay_tich_luy,
+            ket_qua_xac_minh,
+            muc_dich_he_thong,
+            trang_thai_cuoi_cung,
+            labor_detail,
+            marriage_detail,
+            watchlist_detail,
+            COALESCE(ngay_den, DATE '{NULL_SORT_DATE}') as _sort_date
+        FROM view_tong_hop_final
+        WHERE {where_clause}
+    )
+    WHERE {keyset_clause}
+    ORDER BY _sort_date DESC, so_ho_chieu
+    {page_clause}
     """
     
-    query_params = list(params) + [limit, offset]
-    results = execute_query(sql, tuple(query_params))
+    query_params = list(params) + keyset_params + page_params
+    rows = execute_query(sql, tuple(query_params))
+    
+    last_key = None
+    if rows:
+        last_key = (rows[-1]["_sort_date"], rows[-1]["so_ho_chieu"])
+    results = [{c: v for c, v in r.items() if c != "_sort_date"} for r in rows]
     
-    has_more = (offset + len(results)) < total
+    fetched = offset + len(results)
+    has_more = fetched < total
     
     return {
         "results": results,
         "total": total,
         "hasMore": has_more,
+        "nextCursor": encode_cursor(last_key, total, fetched, fingerprint) if has_more and last_key else None,
         "offset": offset,
         "limit": limit
     }
@@ -9,7 +9,10 @@ import sys
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from modules.search import search_single, search_batch, search_batch_all, get_not_found
+from modules.search import (
+    search_single, search_batch, search_batch_all,
+    find_companions, get_timeline, search_by_address
+)
 from modules.export_data import export_to_xlsx
 from utils.text_utils import split_passports, normalize_passport
 from utils.date_utils import format_date_vn
@@ -51,8 +54,115 @@ def get_status_class(status: str) -> str:
     return ""
 
 
-def render_result_card(record: dict):
-    """Render a single result card"""
+def render_timeline(passport: str):
+    """Render stay timeline: merged islands and every raw entry"""
+    import pandas as pd
+    import plotly.express as px
+    from datetime import timedelta
+    
+    timeline = get_timeline(passport)
+    entries = [e for e in timeline["entries"] if e.get("ngay_den")]
+    
+    if not entries:
+        st.caption("Không có dữ liệu lưu trú")
+        return
+    
+    rows = []
+    for island in timeline["islands"]:
+        rows.append({
+            "Dòng": "Đợt lưu trú",
+            "Bắt đầu": island["ngay_den"],
+            # +1 day so same-day stays are still visible as bars
+            "Kết thúc": island["end_eff"] + timedelta(days=1),
+            "Địa chỉ": f"Đợt {island['island_id']} ({island['so_ngay']} ngày)",
+        })
+    for entry in entries:
+        rows.append({
+            "Dòng": "Khai báo",
+            "Bắt đầu": entry["ngay_den"],
+            "Kết thúc": (entry["ngay_di"] or entry["ngay_den"]) + timedelta(days=1),
+            "Địa chỉ": entry.get("dia_chi_tam_tru") or "(Không rõ)",
+        })
+    
+    fig = px.timeline(
+        pd.DataFrame(rows),
+        x_start="Bắt đầu",
+        x_end="Kết thúc",
+        y="Dòng",
+        color="Địa chỉ"
+    )
+    fig.update_layout(height=250, showlegend=False, margin=dict(l=0, r=0, t=10, b=0))
+    st.plotly_chart(fig, use_container_width=True)
+    
+    st.dataframe(
+        [
+            {
+                "Đợt": e.get("island_id"),
+                "Ngày đến": format_date_vn(e.get("ngay_den")),
+                "Ngày đi": format_date_vn(e.get("ngay_di")) or "(Chưa đi)",
+                "Địa chỉ": e.get("dia_chi_tam_tru"),
+                "Nguồn": e.get("source_file"),
+            }
+            for e in reversed(entries)
+        ],
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+def render_companions(passport: str):
+    """Render people who arrived on the same day at the same address"""
+    companions = find_companions(passport)
+    
+    if not companions:
+        st.caption("Không có người đi cùng")
+        return
+    
+    st.caption(f"{len(companions)} người cùng ngày đến, cùng địa chỉ")
+    st.dataframe(
+        [
+            {
+                "Ngày đến": format_date_vn(c.get("ngay_den")),
+                "Họ tên": c.get("ho_ten"),
+                "Số hộ chiếu": c.get("so_ho_chieu"),
+                "Quốc tịch": c.get("quoc_tich"),
+                "Ngày sinh": format_date_vn(c.get("ngay_sinh")),
+                "Địa chỉ": c.get("dia_chi_tam_tru"),
+            }
+            for c in companions
+        ],
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+def render_address_residents(records: list):
+    """Render residents found by address search"""
+    st.dataframe(
+        [
+            {
+                "Họ tên": r.get("ho_ten"),
+                "Số hộ chiếu": r.get("so_ho_chieu"),
+                "Quốc tịch": r.get("quoc_tich"),
+                "Ngày sinh": format_date_vn(r.get("ngay_sinh")),
+                "Ngày đến": format_date_vn(r.get("ngay_den")),
+                "Ngày đi": format_date_vn(r.get("ngay_di")),
+                "Địa chỉ": r.get("dia_chi_tam_tru"),
+            }
+            for r in records
+        ],
+        use_container_width=True,
+        hide_index=True
+    )
+
+
+def render_result_card(record: dict, details_key: str = None):
+    """
+    Render a single result card.
+    
+    details_key: enables the stay history / co-traveller toggle; the queries
+    and the chart only run while the toggle is on (expander bodies run eagerly)
+    """
     status = record.get("trang_thai_cuoi_cung", "")
     status_class = get_status_class(status)
     
@@ -115,6 +225,15 @@ def render_result_card(record: dict):
         elif status == "Đối tượng chú ý" and record.get('watchlist_detail'):
             st.error(f"⚠️ {record.get('watchlist_detail')}")
         
+        # Stay history + co-travellers (same arrival day + same address), on demand
+        if details_key and record.get('so_ho_chieu'):
+            if st.toggle("📅 Lịch sử lưu trú & 👥 người đi cùng", key=f"details_{details_key}"):
+                history_tab, companions_tab = st.tabs(["📅 Lịch sử lưu trú", "👥 Người đi cùng"])
+                with history_tab:
+                    render_timeline(record.get('so_ho_chieu'))
+                with companions_tab:
+                    render_companions(record.get('so_ho_chieu'))
+        
         st.markdown("---")
 
 
@@ -125,7 +244,7 @@ def render_result_card(record: dict):
 st.title("🔍 Tra cứu người nước ngoài")
 
 # Tabs for different search modes
-tab1, tab2 = st.tabs(["📝 Tra cứu đơn", "📋 Tra cứu hàng loạt"])
+tab1, tab2, tab3 = st.tabs(["📝 Tra cứu đơn", "📋 Tra cứu hàng loạt", "🏠 Tra cứu theo địa chỉ"])
 
 # ============================================
 # TAB 1: Single Search
@@ -147,10 +266,19 @@ with tab1:
         with col2:
             search_btn = st.form_submit_button("🔍 Tìm kiếm", use_container_width=True, type="primary")
     
+    # Kết quả giữ trong session: bật chi tiết một thẻ làm chạy lại trang
+    if "single_results" not in st.session_state:
+        st.session_state.single_results = None
+    
     if search_btn and keyword:
         with st.spinner("Đang tìm kiếm..."):
-            results = search_single(keyword)
-        
+            st.session_state.single_results = search_single(keyword)
+    elif search_btn:
+        st.session_state.single_results = None
+        st.warning("Vui lòng nhập từ khóa tìm kiếm")
+    
+    results = st.session_state.single_results
+    if results is not None:
         if results:
             st.success(f"✅ Tìm thấy {len(results)} kết quả")
             
@@ -166,13 +294,10 @@ with tab1:
                     )
             
             # Render results
-            for record in results:
-                render_result_card(record)
+            for index, record in enumerate(results):
+                render_result_card(record, details_key=f"single_{index}_{record.get('so_ho_chieu')}")
         else:
             st.warning("❌ Không tìm thấy kết quả nào")
-    
-    elif search_btn:
-        st.warning("Vui lòng nhập từ khóa tìm kiếm")
 
 
 # ============================================
@@ -188,6 +313,7 @@ with tab2:
         st.session_state.batch_results = None
         st.session_state.batch_keywords = []
         st.session_state.batch_offset = 0
+        st.session_state.batch_not_found = []
     
     batch_input = st.text_area(
         "Danh sách số hộ chiếu",
@@ -215,6 +341,7 @@ with tab2:
             st.session_state.batch_results = result
             st.session_state.batch_keywords = keywords
             st.session_state.batch_offset = 0
+            st.session_state.batch_not_found = result.get("notFound", [])
     
     # Display batch results
     if st.session_state.batch_results:
@@ -225,16 +352,14 @@ with tab2:
         
         st.success(f"✅ Tìm thấy {total} kết quả")
         
-        # Not found passports
-        if records:
-            found_passports = [r["so_ho_chieu"] for r in records]
-            not_found = get_not_found(st.session_state.batch_keywords, found_passports)
-            
-            if not_found:
-                with st.expander(f"⚠️ {len(not_found)} số hộ chiếu không tìm thấy"):
-                    st.write(", ".join(not_found[:50]))
-                    if len(not_found) > 50:
-                        st.write(f"...và {len(not_found) - 50} số khác")
+        # Not found passports (computed once for the whole batch)
+        not_found = st.session_state.batch_not_found
+        
+        if not_found:
+            with st.expander(f"⚠️ {len(not_found)} số hộ chiếu không tìm thấy"):
+                st.write(", ".join(not_found[:50]))
+                if len(not_found) > 50:
+                    st.write(f"...và {len(not_found) - 50} số khác")
         
         # Export all button
         col1, col2 = st.columns([1, 4])
@@ -242,7 +367,7 @@ with tab2:
             if st.button("📥 Xuất tất cả Excel"):
                 with st.spinner("Đang tải toàn bộ dữ liệu..."):
                     all_results = search_batch_all(st.session_state.batch_keywords)
-                    file_path = export_to_xlsx(all_results)
+                    file_path = export_to_xlsx(all_results, not_found=not_found)
                     
                     with open(file_path, "rb") as f:
                         st.download_button(
@@ -267,12 +392,13 @@ with tab2:
                     more_results = search_batch(
                         st.session_state.batch_keywords,
                         limit=PAGE_SIZE,
-                        offset=new_offset
+                        cursor=result.get("nextCursor")
                     )
                 
                 # Append results
                 st.session_state.batch_results["results"].extend(more_results["results"])
                 st.session_state.batch_results["hasMore"] = more_results["hasMore"]
+                st.session_state.batch_results["nextCursor"] = more_results.get("nextCursor")
                 st.session_state.batch_offset = new_offset
                 
                 st.rerun()
@@ -280,6 +406,60 @@ with tab2:
             st.info("📌 Đã hiển thị tất cả kết quả")
 
 
+# ============================================
+# TAB 3: Address Search
+# ============================================
+
+with tab3:
+    st.markdown("### Tìm người đang/đã lưu trú tại một địa chỉ")
+    st.caption("Có thể viết không dấu. Kết quả chứa đủ tất cả các từ đã nhập.")
+    
+    with st.form(key="address_search_form"):
+        address_query = st.text_input(
+            "Địa chỉ",
+            placeholder="VD: Tổ 5 phường Tân Lập"
+        )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            addr_date_from = st.date_input("Từ ngày", value=None, format="DD/MM/YYYY")
+        with col2:
+            addr_date_to = st.date_input("Đến ngày", value=None, format="DD/MM/YYYY")
+        
+        address_btn = st.form_submit_button("🔍 Tìm kiếm", type="primary")
+    
+    if address_btn and address_query:
+        with st.spinner("Đang tìm kiếm..."):
+            address_result = search_by_address(
+                address_query,
+                date_from=addr_date_from,
+                date_to=addr_date_to
+            )
+        
+        if address_result["results"]:
+            st.success(
+                f"✅ {len(address_result['current'])} người đang lưu trú, "
+                f"{len(address_result['past'])} người đã từng lưu trú"
+            )
+            
+            st.markdown("#### 🟢 Đang lưu trú")
+            if address_result["current"]:
+                render_address_residents(address_result["current"])
+            else:
+                st.caption("Không có")
+            
+            st.markdown("#### ⚪ Đã từng lưu trú")
+            if address_result["past"]:
+                render_address_residents(address_result["past"])
+            else:
+                st.caption("Không có")
+        else:
+            st.warning("❌ Không tìm thấy kết quả nào")
+    
+    elif address_btn:
+        st.warning("Vui lòng nhập địa chỉ")
+
+
 # ============================================
 # SIDEBAR INFO
 # ============================================
@@ -290,6 +470,7 @@ with st.sidebar:
     - **Số hộ chiếu**: Nhập chính xác (VD: E1234567)
     - **Họ tên**: Có thể viết không dấu
     - **Hàng loạt**: Copy paste từ Excel
+    - **Địa chỉ**: Nhập vài từ khóa của địa chỉ
     
     ---
     
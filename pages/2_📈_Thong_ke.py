@@ -343,9 +343,13 @@ with tab2:
 with tab3:
     st.markdown("### 📋 Danh sách chi tiết")
     
-    # Session state for pagination
+    # Session state for pagination (keyset cursors of visited pages)
     if "stats_offset" not in st.session_state:
         st.session_state.stats_offset = 0
+    if "stats_cursors" not in st.session_state:
+        st.session_state.stats_cursors = []
+    
+    current_cursor = st.session_state.stats_cursors[-1] if st.session_state.stats_cursors else None
     
     result = get_person_list(
         date_from=date_from_str,
@@ -354,9 +358,14 @@ with tab3:
         residence_status=residence_status,
         min_days=min_days_val,
         limit=PAGE_SIZE,
-        offset=st.session_state.stats_offset
+        cursor=current_cursor
     )
     
+    # Filters changed -> cursor rejected, back to first page
+    if current_cursor and result["offset"] == 0:
+        st.session_state.stats_cursors = []
+        st.session_state.stats_offset = 0
+    
     total = result["total"]
     records = result["results"]
     has_more = result["hasMore"]
@@ -439,6 +448,7 @@ with tab3:
             if st.session_state.stats_offset > 0:
                 if st.button("← Trang trước"):
                     st.session_state.stats_offset -= PAGE_SIZE
+                    st.session_state.stats_cursors.pop()
                     st.rerun()
         
         with col2:
@@ -450,6 +460,7 @@ with tab3:
             if has_more:
                 if st.button("Trang sau →"):
                     st.session_state.stats_offset += PAGE_SIZE
+                    st.session_state.stats_cursors.append(result["nextCursor"])
                     st.rerun()
     else:
         st.info("Không có dữ liệu")
@@ -1,22 +1,25 @@
 """
 QLNNN Offline - Trang Import dữ liệu
 Import từ Excel/CSV/JSF (Admin only)
-Hỗ trợ chunk processing với progress bar cho file lớn
+Import chạy nền qua hàng đợi job, trang theo dõi tiến độ
 """
 
 import streamlit as st
 from pathlib import Path
 import sys
-import tempfile
-import os
+import time
 
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from modules.import_data import import_excel, import_csv, import_verification_results
-from modules.import_jsf import import_jsf, import_jsf_chunked, CHUNK_SIZE
+from modules.import_data import import_verification_results
+from modules.import_jsf import CHUNK_SIZE
+from modules.import_jobs import submit_import_job, submit_bulk_import_job, start_worker, get_jobs, has_active_jobs
+from modules.import_batches import list_batches, rollback_batch
 from modules.export_data import generate_template
 from database.connection import get_table_count
+from database.passport_filter import get_filter_metrics
 from utils.menu import menu
+from config import JOB_POLL_SECONDS
 
 st.set_page_config(page_title="Nhập liệu - QLNNN", page_icon="📥", layout="wide")
 
@@ -51,65 +54,111 @@ with col3:
     except (ValueError, Exception):
         st.metric("⚠️ Đối tượng chú ý", "N/A")
 
+with st.expander("🧮 Bộ lọc hộ chiếu (Bloom filter)"):
+    try:
+        filter_metrics = get_filter_metrics()
+        fcol1, fcol2, fcol3, fcol4 = st.columns(4)
+        fcol1.metric("Số khóa", f"{filter_metrics['keys']:,}")
+        fcol2.metric("FPR ước tính", f"{filter_metrics['estimated_fpr']:.4%}")
+        fcol3.metric("FPR thực tế", f"{filter_metrics['observed_fpr']:.4%}")
+        fcol4.metric("Loại trừ không cần DB", f"{filter_metrics['definite_misses']:,}")
+        st.caption(
+            f"Dung lượng {filter_metrics['size_kb']:,} KB, {filter_metrics['num_hashes']} hàm băm, "
+            f"sức chứa {filter_metrics['capacity']:,} khóa. "
+            f"Đã kiểm tra {filter_metrics['lookups']:,} số, {filter_metrics['db_checks']:,} số phải tra DB "
+            f"({filter_metrics['false_positives']:,} dương tính giả)."
+        )
+    except Exception as e:
+        st.caption(f"Không đọc được bộ lọc: {e}")
+
 st.markdown("---")
 
 # File upload
 st.markdown("### 📋 Upload file dữ liệu")
-st.caption(f"Hỗ trợ: Excel (.xlsx, .xls), CSV (.csv), và **JSF/PDF** (.jsf, .pdf). File lớn sẽ được xử lý theo chunks {CHUNK_SIZE:,} dòng.")
+st.caption(
+    f"Hỗ trợ: Excel (.xlsx, .xls), CSV (.csv), **JSF/PDF** (.jsf, .pdf) và **.zip** chứa các file đó. "
+    f"File được đưa vào hàng đợi và import nền theo thứ tự (chunks {CHUNK_SIZE:,} dòng), "
+    f"có thể rời trang hoặc làm mới trang trong lúc chạy."
+)
 
-uploaded_file = st.file_uploader(
+uploaded_files = st.file_uploader(
     "Chọn file dữ liệu", 
-    type=["xlsx", "xls", "csv", "pdf", "jsf"],
+    type=["xlsx", "xls", "csv", "pdf", "jsf", "zip"],
+    accept_multiple_files=True,
     help="File JSF là báo cáo tạm trú người nước ngoài từ hệ thống PA61"
 )
 
-if uploaded_file:
-    file_ext = Path(uploaded_file.name).suffix.lower()
-    file_size_mb = len(uploaded_file.getvalue()) / (1024 * 1024)
+if uploaded_files:
+    total_mb = sum(len(f.getvalue()) for f in uploaded_files) / (1024 * 1024)
+    st.info(f"📁 {len(uploaded_files)} file ({total_mb:.1f} MB): " + ", ".join(f"**{f.name}**" for f in uploaded_files))
     
-    # Hiển thị thông tin file
-    if file_ext in ['.pdf', '.jsf']:
-        st.info(f"📄 File JSF: **{uploaded_file.name}** ({file_size_mb:.1f} MB)")
-    else:
-        st.info(f"📁 File: **{uploaded_file.name}** ({file_size_mb:.1f} MB)")
+    bulk = st.checkbox(
+        "📦 Gộp thành một lần import",
+        value=len(uploaded_files) > 1,
+        disabled=len(uploaded_files) < 2,
+        help="Đọc các file song song, gộp và lọc trùng (giữ dòng đầy đủ nhất, bằng nhau thì file sau thắng), ghi trong một transaction. "
+             "File .zip luôn được import gộp."
+    )
     
-    if st.button("📤 Tiến hành nhập liệu", type="primary"):
-        # Xác định suffix cho temp file
-        suffix = file_ext if file_ext else '.tmp'
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(uploaded_file.getvalue())
-            tmp_path = tmp.name
-        
-        try:
-            # Xử lý theo loại file
-            if file_ext in ['.pdf', '.jsf']:
-                # Sử dụng progress bar cho file JSF
-                progress_bar = st.progress(0)
-                status_text = st.empty()
-                
-                def update_progress(progress: float, message: str):
-                    progress_bar.progress(progress)
-                    status_text.text(message)
-                
-                result = import_jsf_chunked(tmp_path, progress_callback=update_progress)
-                
-                # Xóa progress bar khi hoàn thành
-                progress_bar.empty()
-                status_text.empty()
-                
-            elif file_ext == '.csv':
-                with st.spinner("Đang xử lý file CSV..."):
-                    result = import_csv(tmp_path)
-            else:
-                with st.spinner("Đang xử lý file Excel..."):
-                    result = import_excel(tmp_path)
-            
-            if result["success"]:
-                # Hiển thị kết quả chi tiết
-                st.success(f"✅ Import thành công!")
+    if st.button("📤 Thêm vào hàng đợi nhập liệu", type="primary"):
+        username = st.session_state.user.get("username")
+        if bulk and len(uploaded_files) > 1:
+            job_id = submit_bulk_import_job([(f.name, f.getvalue()) for f in uploaded_files], username=username)
+            st.toast(f"Đã thêm job #{job_id}: {len(uploaded_files)} file")
+        else:
+            for f in uploaded_files:
+                job_id = submit_import_job(f.name, f.getvalue(), username=username)
+                st.toast(f"Đã thêm job #{job_id}: {f.name}")
+
+# Hàng đợi import (worker chạy nền, trang đọc trạng thái từ bảng jobs)
+start_worker()
+jobs = get_jobs(limit=20)
+
+if jobs:
+    st.markdown("### ⏳ Hàng đợi nhập liệu")
+    
+    for job in [j for j in jobs if j["state"] in ("queued", "running")][::-1]:
+        if job["state"] == "running":
+            st.progress(min(job["progress"] or 0.0, 1.0), text=f"#{job['id']} {job['source_file']}: {job['message'] or ''}")
+        else:
+            st.caption(f"🕒 #{job['id']} {job['source_file']}: đang chờ")
+    
+    job_state_labels = {
+        "queued": "🕒 Chờ",
+        "running": "⏳ Đang chạy",
+        "done": "✅ Xong",
+        "failed": "❌ Lỗi",
+    }
+    st.dataframe(
+        [
+            {
+                "Job": j["id"],
+                "File": j["source_file"],
+                "Trạng thái": job_state_labels.get(j["state"], j["state"]),
+                "Kết quả": j["message"],
+                "Batch": j["batch_id"],
+                "Thời gian (s)": (j["timings"] or {}).get("total"),
+                "Tạo lúc": j["created_at"],
+            }
+            for j in jobs
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
+    
+    # Chi tiết job xong gần nhất
+    finished = [j for j in jobs if j["state"] in ("done", "failed") and j["result"]]
+    if finished:
+        job = finished[0]
+        result = job["result"]
+        with st.expander(f"📋 Chi tiết job #{job['id']} ({job['source_file']})", expanded=job["state"] == "failed"):
+            if result.get("already_imported"):
+                # Cùng nội dung file, DB không đổi kể từ lần import trước
+                st.info(f"ℹ️ {result['message']}")
+            elif result.get("success"):
+                if result.get("from_cache"):
+                    st.caption("♻️ File đã được trích xuất trước đó, dùng bảng trong cache (bỏ qua bước đọc file)")
                 
-                # Thống kê
                 col_a, col_b, col_c = st.columns(3)
                 with col_a:
                     st.metric("📊 Tổng import", f"{result.get('rows_imported', 0):,}")
@@ -118,38 +167,121 @@ if uploaded_file:
                         st.metric("➕ Mới thêm", f"{result.get('rows_inserted', 0):,}")
                     if 'rows_updated' in result:
                         st.metric("🔄 Cập nhật", f"{result.get('rows_updated', 0):,}")
+                    if 'rows_unchanged' in result:
+                        st.metric("⏸️ Không đổi", f"{result.get('rows_unchanged', 0):,}")
                 with col_c:
                     st.metric("⏭️ Bỏ qua", f"{result.get('rows_skipped', 0):,}")
                 
-                # Thông tin chunk nếu có
+                if result.get("files"):
+                    st.caption(f"🔀 {result.get('rows_superseded', 0):,} dòng trùng (passport, ngày đến) được thay bằng bản đọc sau")
+                    st.dataframe(
+                        [
+                            {
+                                "File": f["source_file"],
+                                "Dòng đọc": f["rows_read"],
+                                "Hợp lệ": f["rows_valid"],
+                                "Bị thay": f["rows_superseded"],
+                                "Đọc (s)": f["parse_s"],
+                                "Dòng/s": f["rows_per_s"],
+                                "Lỗi": f["error"],
+                            }
+                            for f in result["files"]
+                        ],
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+
+                if result.get("sheets"):
+                    st.dataframe(
+                        [
+                            {
+                                "Sheet": s["sheet"],
+                                "Dòng tiêu đề": s["header_row"],
+                                "Dòng đọc": s["rows_read"],
+                                "Đã ghi": s["rows_imported"],
+                                "Bỏ qua": s["rows_skipped"],
+                                "Ghi chú": s["error"],
+                            }
+                            for s in result["sheets"]
+                        ],
+                        use_container_width=True,
+                        hide_index=True,
+                    )
+
                 if result.get('total_chunks'):
                     st.caption(f"📦 Đã xử lý {result['total_chunks']} chunks (mỗi chunk {result['chunk_size']:,} dòng)")
-                
-                # Báo cáo validation nếu có warnings
-                if result.get('validation_report'):
-                    report = result['validation_report']
-                    if report.get('total_warnings', 0) > 0:
-                        with st.expander(f"⚠️ {report['total_warnings']} cảnh báo validation"):
-                            for detail in report.get('details', [])[:10]:
-                                for w in detail.get('warnings', []):
-                                    st.warning(f"Dòng {w.get('row')}: {w.get('message')}")
+                if result.get("throughput"):
+                    st.caption("🚀 " + ", ".join(
+                        f"{stage}: {rate:,.0f} dòng/s" for stage, rate in result["throughput"].items() if rate
+                    ))
+                if result.get("validation_warnings"):
+                    st.caption(f"⚠️ {result['validation_warnings']} cảnh báo validation")
             else:
-                st.error(f"❌ Lỗi: {result.get('error', 'Unknown error')}")
-                
-                # Hiển thị chi tiết lỗi nếu có
+                st.error(f"❌ Lỗi: {job.get('error') or result.get('error', 'Unknown error')}")
                 if result.get('errors'):
-                    with st.expander(f"🔍 Chi tiết lỗi ({len(result['errors'])} chunks)"):
-                        for err in result['errors'][:10]:
-                            st.error(err)
-                
-                if result.get('validation_report'):
-                    report = result['validation_report']
-                    if report.get('total_errors', 0) > 0:
-                        with st.expander(f"🔍 Chi tiết lỗi validation ({report['total_errors']} lỗi)"):
-                            for detail in report.get('details', [])[:10]:
-                                for e in detail.get('errors', []):
-                                    st.error(f"Dòng {e.get('row')}, cột {e.get('column')}: {e.get('message')}")
-        finally:
-            os.unlink(tmp_path)
+                    for err in result['errors'][:10]:
+                        st.error(err)
+                if result.get("validation_errors"):
+                    st.caption(f"🔍 {result['validation_errors']} lỗi validation")
+            
+            if job["timings"]:
+                st.caption("⏱️ " + ", ".join(f"{k}: {v:.2f}s" for k, v in job["timings"].items()))
+
+
+st.markdown("---")
+
+# Lịch sử import + rollback
+st.markdown("### 🗂️ Lịch sử import")
+try:
+    batches = list_batches(limit=20)
+except Exception as e:
+    batches = []
+    st.caption(f"Không đọc được lịch sử import: {e}")
 
+if batches:
+    status_labels = {
+        "running": "⏳ Đang chạy",
+        "committed": "✅ Thành công",
+        "failed": "❌ Lỗi",
+        "rolled_back": "↩️ Đã rollback",
+    }
+    st.dataframe(
+        [
+            {
+                "ID": b["id"],
+                "File": b["source_file"],
+                "Người import": b["username"],
+                "Bắt đầu": b["started_at"],
+                "Thời gian (s)": round(b["duration_s"] or 0, 1),
+                "Mới thêm": b["rows_inserted"],
+                "Cập nhật": b["rows_updated"],
+                "Không đổi": b["rows_unchanged"],
+                "Bỏ qua": b["rows_skipped"],
+                "Trạng thái": status_labels.get(b["status"], b["status"]),
+            }
+            for b in batches
+        ],
+        use_container_width=True,
+        hide_index=True,
+    )
+    
+    rollbackable = [b["id"] for b in batches if b["status"] in ("committed", "failed")]
+    if rollbackable:
+        rcol1, rcol2 = st.columns([1, 3])
+        with rcol1:
+            batch_to_rollback = st.selectbox("Batch cần rollback", rollbackable)
+        with rcol2:
+            st.write("")
+            if st.button("↩️ Rollback batch", help="Xóa dòng batch đã thêm, khôi phục dòng batch đã cập nhật"):
+                rb = rollback_batch(batch_to_rollback, username=st.session_state.user.get("username"))
+                if rb["success"]:
+                    st.success(f"✅ {rb['message']}")
+                else:
+                    st.error(f"❌ {rb['error']}")
+else:
+    st.caption("Chưa có lần import nào")
 
+# Tự làm mới trang khi còn job chờ/đang chạy
+if has_active_jobs():
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
@@ -0,0 +1,65 @@
+"""
+QLNNN - Benchmark trích xuất JSF theo số worker
+Đo extract_jsf_data trên file mẫu với các số process khác nhau
+và kiểm tra kết quả giống hệt bản tuần tự dùng extract_table().
+
+Usage:
+    python scripts/bench_jsf_extract.py [file.jsf] [--workers 1 2 4] [--skip-baseline]
+"""
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add parent to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from modules import import_jsf
+from modules.import_jsf import extract_jsf_data
+
+SAMPLE_FILE = Path(__file__).parent.parent / "30.01.jsf"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSF extraction")
+    parser.add_argument("file", nargs="?", default=str(SAMPLE_FILE))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--skip-baseline", action="store_true",
+                        help="Không chạy bản extract_table() tuần tự (chậm)")
+    args = parser.parse_args()
+
+    print(f"File: {args.file} ({os.path.getsize(args.file) / 1024:,.0f} KB), CPU: {os.cpu_count()}")
+
+    baseline = None
+    baseline_time = None
+    if not args.skip_baseline:
+        import_jsf.JSF_LAYOUT_EXTRACT = False
+        start = time.perf_counter()
+        baseline = extract_jsf_data(args.file, workers=1)
+        baseline_time = time.perf_counter() - start
+        import_jsf.JSF_LAYOUT_EXTRACT = True
+        print(f"extract_table {baseline_time:8.2f}s  {len(baseline):,} rows  (baseline)")
+
+    print(f"Layout: {import_jsf._learn_jsf_layout(args.file)}")
+    for workers in args.workers:
+        start = time.perf_counter()
+        df = extract_jsf_data(args.file, workers=workers)
+        elapsed = time.perf_counter() - start
+
+        if df is None:
+            print(f"workers={workers}: extraction failed")
+            continue
+
+        if baseline is None:
+            baseline, baseline_time = df, elapsed
+            note = "baseline"
+        else:
+            note = f"x{baseline_time / elapsed:.2f}, {'identical' if df.equals(baseline) else 'MISMATCH'}"
+
+        print(f"workers={workers:<3} {elapsed:8.2f}s  {len(df):,} rows  ({note})")
+
+
+if __name__ == "__main__":
+    main()
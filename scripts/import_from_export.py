@@ -17,7 +17,8 @@ if sys.platform.startswith('win'):
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from database.connection import get_connection
-from database.models import init_database
+from database.models import init_database, refresh_derived_tables
+from modules.import_csv import csv_reader_sql, detect_csv_encoding
 
 # ============================================
 # CẤU HÌNH
@@ -26,20 +27,30 @@ from database.models import init_database
 EXPORT_DIR = Path(__file__).parent.parent / "data" / "bigquery_export"
 
 
-def read_csv_safe(file_path):
-    """Read CSV with encoding fallback"""
-    encodings = ["utf-8-sig", "utf-8", "cp1252", "utf-16"]
+def read_csv_safe(conn, file_path, view_name):
+    """
+    Expose a CSV export as a DuckDB view (read_csv, all columns VARCHAR),
+    encoding detected from a byte sample. cp1252 files, which DuckDB cannot
+    decode, are read with pandas and registered instead.
     
-    for enc in encodings:
-        try:
-            return pd.read_csv(file_path, encoding=enc)
-        except UnicodeDecodeError:
-            continue
-        except Exception as e:
-            # If it's not an encoding error, raise it
-            raise e
-            
-    raise ValueError(f"Could not decode {file_path} with supported encodings")
+    Returns:
+        List of column names
+    """
+    encoding = detect_csv_encoding(file_path)
+    if encoding is not None:
+        conn.execute(f"CREATE OR REPLACE TEMP VIEW {view_name} AS SELECT * FROM {csv_reader_sql(file_path, encoding)}")
+    else:
+        conn.register(view_name, pd.read_csv(file_path, encoding="cp1252", dtype=str))
+    return [row[0] for row in conn.execute(f"DESCRIBE {view_name}").fetchall()]
+
+
+def drop_csv_view(conn, view_name):
+    """Remove the view/registration created by read_csv_safe"""
+    conn.execute(f"DROP VIEW IF EXISTS {view_name}")
+    try:
+        conn.unregister(view_name)
+    except Exception:
+        pass
 
 
 def import_main_table(conn, csv_path):
@@ -47,49 +58,48 @@ def import_main_table(conn, csv_path):
     print(f"📥 Importing {csv_path.name}...")
     
     try:
-        df = read_csv_safe(csv_path)
+        columns = read_csv_safe(conn, csv_path, "temp_main_import")
     except Exception as e:
         print(f"   ❌ Failed to read file: {e}")
         return
 
-    print(f"   Found {len(df)} rows. Bulk inserting...")
-    
-    # Pre-process data
-    if 'so_ho_chieu' in df.columns:
-        df['so_ho_chieu'] = df['so_ho_chieu'].astype(str).str.strip().str.upper()
+    total = conn.execute("SELECT COUNT(*) FROM temp_main_import").fetchone()[0]
+    print(f"   Found {total} rows. Bulk inserting...")
     
-    # Add source column
-    df['source_file'] = 'bigquery_export'
-    
-    # Ensure all columns exist
+    # Missing columns -> NULL; passport trimmed + uppercased
     required_cols = ["so_ho_chieu", "ho_ten", "ngay_sinh", "quoc_tich", "ngay_den", 
                      "ngay_di", "dia_chi_tam_tru", "ket_qua_xac_minh", "thoi_diem_cap_nhat"]
-    
-    for col in required_cols:
-        if col not in df.columns:
-            df[col] = None
+    select = {col: (col if col in columns else "NULL") for col in required_cols}
+    if "so_ho_chieu" in columns:
+        select["so_ho_chieu"] = "TRIM(UPPER(so_ho_chieu))"
             
     try:
-        # Register DataFrame as a virtual table
-        conn.register('temp_main_import', df)
-        
-        # Bulk Insert
-        conn.execute("""
-            INSERT INTO raw_immigration 
-            (so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den, ngay_di,
+        # Bulk Insert (export có thể trùng (passport, ngay_den): giữ bản cập nhật mới nhất)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO raw_immigration 
+            (so_ho_chieu, passport_key, ho_ten, ngay_sinh, quoc_tich, ngay_den, ngay_di,
              dia_chi_tam_tru, ket_qua_xac_minh, thoi_diem_cap_nhat, source_file)
             SELECT 
-                so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den, ngay_di,
-                dia_chi_tam_tru, ket_qua_xac_minh, thoi_diem_cap_nhat, source_file
-            FROM temp_main_import
+                so_ho_chieu, so_ho_chieu, ho_ten, ngay_sinh, quoc_tich, ngay_den, ngay_di,
+                dia_chi_tam_tru, ket_qua_xac_minh, thoi_diem_cap_nhat, 'bigquery_export'
+            FROM (
+                SELECT {', '.join(f"{expr} AS {col}" for col, expr in select.items())}
+                FROM temp_main_import
+            )
+            WHERE so_ho_chieu IS NOT NULL AND so_ho_chieu != ''
+            QUALIFY ngay_den IS NULL OR ROW_NUMBER() OVER(
+                PARTITION BY so_ho_chieu, ngay_den
+                ORDER BY thoi_diem_cap_nhat DESC NULLS LAST
+            ) = 1
         """)
         
-        conn.unregister('temp_main_import')
         conn.commit()
-        print(f"   ✅ Imported {len(df)} rows successfully!")
+        print(f"   ✅ Imported {total} rows successfully!")
         
     except Exception as e:
         print(f"   ❌ Bulk insert failed: {e}")
+    finally:
+        drop_csv_view(conn, "temp_main_import")
 
 
 def import_ref_table(conn, csv_path, table_name, columns):
@@ -100,37 +110,35 @@ def import_ref_table(conn, csv_path, table_name, columns):
         print(f"   ⚠️ File not found, skipping")
         return
     
+    table_alias = f"temp_{table_name}_import"
     try:
-        df = read_csv_safe(csv_path)
+        file_columns = read_csv_safe(conn, csv_path, table_alias)
     except Exception as e:
         print(f"   ❌ Failed to read file: {e}")
         return
 
-    print(f"   Found {len(df)} rows. Bulk inserting...")
-    
-    # Pre-process
+    # Pre-process: missing columns -> NULL, strings trimmed, passport uppercased
+    select = []
     for col in columns:
-        if col not in df.columns:
-            df[col] = None
+        if col not in file_columns:
+            select.append(f"NULL AS {col}")
         elif col == "so_ho_chieu":
-            df[col] = df[col].astype(str).str.strip().str.upper()
-        # Clean up strings
-        elif df[col].dtype == object:
-             df[col] = df[col].astype(str).str.strip()
-             
+            select.append(f"TRIM(UPPER({col})) AS {col}")
+        else:
+            select.append(f"TRIM(CAST({col} AS VARCHAR)) AS {col}")
+    
     # Filter valid rows (has passport)
-    if 'so_ho_chieu' in columns:
-        df = df[df['so_ho_chieu'].notna() & (df['so_ho_chieu'] != '') & (df['so_ho_chieu'] != 'NAN')]
+    where = "WHERE so_ho_chieu IS NOT NULL AND so_ho_chieu != '' AND so_ho_chieu != 'NAN'" if "so_ho_chieu" in columns else ""
+    source = f"(SELECT {', '.join(select)} FROM {table_alias}) {where}"
     
-    if df.empty:
+    total = conn.execute(f"SELECT COUNT(*) FROM {source}").fetchone()[0]
+    if total == 0:
         print("   ⚠️ No valid data found")
+        drop_csv_view(conn, table_alias)
         return
+    print(f"   Found {total} rows. Bulk inserting...")
 
     try:
-        # Register DataFrame
-        table_alias = f"temp_{table_name}_import"
-        conn.register(table_alias, df)
-        
         # Build SQL
         col_list = ", ".join(columns)
         
@@ -138,15 +146,16 @@ def import_ref_table(conn, csv_path, table_name, columns):
         # Using INSERT OR IGNORE to skip duplicates
         conn.execute(f"""
             INSERT OR IGNORE INTO {table_name} ({col_list})
-            SELECT {col_list} FROM {table_alias}
+            SELECT {col_list} FROM {source}
         """)
         
-        conn.unregister(table_alias)
         conn.commit()
-        print(f"   ✅ Imported {len(df)} rows successfully!")
+        print(f"   ✅ Imported {total} rows successfully!")
         
     except Exception as e:
         print(f"   ❌ Bulk insert failed: {e}")
+    finally:
+        drop_csv_view(conn, table_alias)
 
 
 def main():
@@ -188,6 +197,12 @@ def main():
     else:
         print(f"⚠️ Main table not found: {main_csv}")
     
+    # Rebuild derived tables
+    print("🔄 Rebuilding derived tables (travel groups, address tokens)...")
+    conn.begin()
+    refresh_derived_tables(conn)
+    conn.commit()
+    
     # Import reference tables
     ref_tables = {
         "ref_labor": ["so_ho_chieu", "vi_tri", "noi_lam_viec", "ngay_cap"],
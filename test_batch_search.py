@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Test script - Tra cứu hàng loạt trên database tạm
+Phân trang keyset (cursor) phải cho cùng các trang như phân trang OFFSET
+Bloom filter hộ chiếu không được có âm tính giả (số đã import luôn tra DB)
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+import database.connection as db_connection
+import database.passport_filter as passport_filter
+from conftest import TEST_DIR, fresh_database
+from database.passport_filter import PassportBloomFilter, split_definite_misses
+from modules.import_data import import_csv
+from modules.search import search_batch, search_batch_all
+
+HEADER = "Số hộ chiếu,Họ tên,Ngày đến,Ngày đi,Quốc tịch,Địa chỉ tạm trú"
+NATIONALITIES = ["CHN", "KOR", "JPN", "USA", "FRA"]
+
+
+def passports(count: int, prefix: str = "P"):
+    return [f"{prefix}{i:07d}" for i in range(count)]
+
+
+def write_csv(name: str, keys) -> str:
+    """1-3 lần đến cho mỗi hộ chiếu, nhiều lần đến trùng ngày giữa các hộ chiếu"""
+    lines = [HEADER]
+    for i, key in enumerate(keys):
+        for stay in range(i % 3 + 1):
+            day = (i * 7 + stay * 11) % 28 + 1
+            month = stay * 4 + 1
+            departure = f"{day:02d}/{month + 1:02d}/2024" if (i + stay) % 2 else ""
+            lines.append(
+                f"{key},Nguoi {i},{day:02d}/{month:02d}/2024,{departure},"
+                f"{NATIONALITIES[i % len(NATIONALITIES)]},{i % 5} Tran Phu"
+            )
+    path = TEST_DIR / name
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def _page_keys(results):
+    return [(r["so_ho_chieu"], str(r["ngay_den"])) for r in results]
+
+
+def test_cursor_pages_match_offset_pages():
+    """Đi theo nextCursor và đi theo offset cho cùng từng trang"""
+    conn = fresh_database()
+    keys = passports(45)
+    assert import_csv(write_csv("stays.csv", keys), conn=conn)["success"]
+
+    keywords = keys + passports(5, prefix="MISS")
+    limit = 7
+
+    first = search_batch(keywords, limit=limit)
+    total = first["total"]
+    assert total == len(keys)  # Một dòng (lần đến mới nhất) mỗi hộ chiếu
+    assert first["notFound"] == passports(5, prefix="MISS")
+
+    cursor_pages = [_page_keys(first["results"])]
+    page = first
+    while page["hasMore"]:
+        page = search_batch(keywords, limit=limit, cursor=page["nextCursor"])
+        assert page["total"] == total
+        assert "notFound" not in page
+        cursor_pages.append(_page_keys(page["results"]))
+    assert page["nextCursor"] is None
+
+    offset_pages = [
+        _page_keys(search_batch(keywords, limit=limit, offset=offset)["results"])
+        for offset in range(0, total, limit)
+    ]
+
+    assert cursor_pages == offset_pages
+    flat = [k for p in cursor_pages for k in p]
+    assert len(flat) == len(set(flat)) == total
+    assert flat == _page_keys(search_batch_all(keywords))
+
+
+def test_cursor_from_other_batch_is_ignored():
+    """Cursor của batch khác -> đọc lại từ trang đầu"""
+    conn = fresh_database()
+    keys = passports(20)
+    assert import_csv(write_csv("stays.csv", keys), conn=conn)["success"]
+
+    other = search_batch(keys[:10], limit=3)
+    assert other["nextCursor"]
+
+    page = search_batch(keys, limit=3, cursor=other["nextCursor"])
+    assert _page_keys(page["results"]) == _page_keys(search_batch(keys, limit=3)["results"])
+
+
+def test_bloom_filter_no_false_negatives():
+    """Mọi khóa đã thêm đều được báo là có trong filter"""
+    bloom = PassportBloomFilter(capacity=2000)
+    keys = passports(5000)  # Vượt sức chứa: FPR tăng nhưng vẫn không âm tính giả
+    bloom.add_many(keys)
+    assert bloom.contains_many(keys).all()
+
+
+def test_imported_passports_are_candidates():
+    """Hộ chiếu đã import (lần đầu và import thêm) không bị loại bởi filter"""
+    conn = fresh_database()
+
+    first = passports(300)
+    assert import_csv(write_csv("first.csv", first), conn=conn)["success"]
+    misses, _ = split_definite_misses(first)
+    assert misses == []
+
+    # Import thêm: khóa mới được thêm vào filter đang dùng
+    more = passports(200, prefix="Q")
+    assert import_csv(write_csv("more.csv", more), conn=conn)["success"]
+    misses, _ = split_definite_misses(first + more)
+    assert misses == []
+
+    # Đọc lại filter từ file sau khi mở lại DB
+    db_connection.close_connection()
+    passport_filter.load_passport_filter()
+    misses, _ = split_definite_misses(first + more)
+    assert misses == []
+
+    page = search_batch(first + more, limit=10)
+    assert page["total"] == len(first) + len(more)
+    assert page["notFound"] == []
+
+
+def test_committed_passports_survive_refresh_failure():
+    """Lô đã commit nhưng làm mới bảng dẫn xuất lỗi: hộ chiếu vẫn có trong filter"""
+    conn = fresh_database()
+    import_csv_module = sys.modules["modules.import_csv"]
+    refresh = import_csv_module.refresh_derived_tables
+
+    def failing_refresh(*args, **kwargs):
+        raise RuntimeError("refresh failed")
+
+    import_csv_module.refresh_derived_tables = failing_refresh
+    try:
+        keys = passports(50)
+        assert import_csv(write_csv("stays.csv", keys), conn=conn)["success"]
+    finally:
+        import_csv_module.refresh_derived_tables = refresh
+
+    misses, _ = split_definite_misses(keys)
+    assert misses == []
+    assert search_batch(keys, limit=10)["notFound"] == []
+
+
+if __name__ == "__main__":
+    for test in (test_cursor_pages_match_offset_pages, test_cursor_from_other_batch_is_ignored,
+                 test_bloom_filter_no_false_negatives, test_imported_passports_are_candidates,
+                 test_committed_passports_survive_refresh_failure):
+        try:
+            test()
+            print(f"✅ PASS: {test.__name__}")
+        except AssertionError as e:
+            print(f"❌ FAIL: {test.__name__}: {e}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Test script - format_date_column so với parse_date_vn
+Chuyển ngày theo cột phải cho cùng kết quả với format_date_for_db từng giá trị
+"""
+
+import sys
+from datetime import date, datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.date_utils import format_date_column, format_date_for_db, parse_date_vn
+
+VALUES = [
+    "15/03/2024", "1/2/2024", "31/12/2023",        # DD/MM/YYYY
+    "03/15/2024",                                  # Chỉ đọc được dạng MM/DD
+    "2024-03-15", "15-03-2024", "15.03.2024",      # Các dấu phân cách khác
+    "13/13/2024", "30/02/2024",                    # Không hợp lệ
+    "5/6/24", "5/6/99",                            # Năm 2 chữ số
+    " 15/03/2024 ", "15/03/2024 10:30",            # Khoảng trắng, kèm giờ
+    "abc", "", "nan", None, np.nan,                # Rỗng / rác
+    date(2024, 3, 15), datetime(2024, 3, 15, 8, 0),
+]
+
+
+def _expected(value):
+    """Kết quả từng giá trị (đường cũ qua format_date_for_db/parse_date_vn)"""
+    if value is None or (not isinstance(value, (date, datetime)) and pd.isna(value)):
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.strftime("%Y-%m-%d")
+    text = str(value).strip()
+    if text in ("", "nan"):
+        return None
+    parsed = parse_date_vn(text)
+    assert (parsed.strftime("%Y-%m-%d") if parsed else "") == format_date_for_db(text)
+    return parsed.strftime("%Y-%m-%d") if parsed else None
+
+
+def test_column_matches_parse_date_vn():
+    """Mỗi giá trị trong cột cho cùng ngày với parse_date_vn"""
+    series = pd.Series(VALUES * 3, dtype=object)
+    values, _ = format_date_column(series)
+
+    expected = [_expected(v) for v in series]
+    assert values.tolist() == expected, [
+        (v, got, want) for v, got, want in zip(series, values, expected) if got != want
+    ]
+    assert values.index.equals(series.index)
+
+
+def test_column_hits_cover_all_rows():
+    """Tổng số đếm theo định dạng bằng số dòng"""
+    series = pd.Series(VALUES, dtype=object)
+    _, hits = format_date_column(series)
+    assert sum(hits.values()) == len(series), hits
+
+
+def test_column_small_sample():
+    """Mẫu dò định dạng nhỏ: giá trị ngoài mẫu vẫn khớp parse_date_vn"""
+    strings = [v for v in VALUES if isinstance(v, str)]
+    series = pd.Series(strings * 50, index=range(100, 100 + len(strings) * 50), dtype=object)
+    values, _ = format_date_column(series, sample_size=2)
+    assert values.tolist() == [_expected(v) for v in series]
+
+
+if __name__ == "__main__":
+    for test in (test_column_matches_parse_date_vn, test_column_hits_cover_all_rows, test_column_small_sample):
+        try:
+            test()
+            print(f"✅ PASS: {test.__name__}")
+        except AssertionError as e:
+            print(f"❌ FAIL: {test.__name__}: {e}")
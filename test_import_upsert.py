@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Test script - Import CSV vào database tạm
+Import lại cùng dữ liệu phải báo "không đổi", không thêm/cập nhật dòng nào
+Dòng trùng trong cùng file: giữ dòng đầy đủ nhất (bằng nhau thì dòng sau)
+Rollback batch: khôi phục đúng trạng thái trước khi import
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from conftest import TEST_DIR, fresh_database
+from database.models import dedupe_import_rows
+from modules.import_batches import RAW_COLUMNS, rollback_batch
+from modules.import_data import import_csv
+
+HEADER = "Số hộ chiếu,Họ tên,Ngày đến,Ngày đi,Quốc tịch,Địa chỉ tạm trú"
+ROWS = [
+    "B1234567,Nguyen A,01/01/2024,05/01/2024,CHN,1 Tran Phu",
+    "C7654321,Le B,02/01/2024,,KOR,2 Le Loi",
+    "D1111111,Tran C,03/01/2024,10/01/2024,JPN,3 Hung Vuong",
+    "E2222222,Pham D,04/01/2024,,USA,4 Nguyen Hue",
+]
+
+
+def write_csv(name: str, rows) -> str:
+    path = TEST_DIR / name
+    path.write_text(HEADER + "\n" + "\n".join(rows) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_reimport_reports_unchanged():
+    """Cùng dữ liệu (thứ tự dòng khác, file khác) -> toàn bộ dòng không đổi"""
+    conn = fresh_database()
+
+    first = import_csv(write_csv("first.csv", ROWS), conn=conn)
+    assert first["success"], first.get("error")
+    assert first["rows_inserted"] == len(ROWS)
+
+    second = import_csv(write_csv("second.csv", ROWS[::-1]), conn=conn)
+    assert second["success"], second.get("error")
+    assert second["rows_inserted"] == 0, second
+    assert second["rows_updated"] == 0, second
+    assert second["rows_unchanged"] == len(ROWS), second
+    assert conn.execute("SELECT COUNT(*) FROM raw_immigration").fetchone()[0] == len(ROWS)
+
+
+def test_reimport_changed_row_is_updated():
+    """Chỉ dòng có nội dung khác mới được tính là cập nhật"""
+    conn = fresh_database()
+
+    assert import_csv(write_csv("first.csv", ROWS), conn=conn)["success"]
+
+    changed = ROWS[:1] + ["C7654321,Le B,02/01/2024,20/01/2024,KOR,2 Le Loi"] + ROWS[2:]
+    second = import_csv(write_csv("second.csv", changed), conn=conn)
+    assert second["success"], second.get("error")
+    assert (second["rows_inserted"], second["rows_updated"], second["rows_unchanged"]) == (0, 1, len(ROWS) - 1), second
+
+
+def test_same_file_already_imported():
+    """Cùng file, DB không đổi -> báo đã import, không ghi lại"""
+    conn = fresh_database()
+
+    path = write_csv("first.csv", ROWS)
+    assert import_csv(path, conn=conn)["success"]
+
+    again = import_csv(path, conn=conn)
+    assert again["success"] and again.get("already_imported"), again
+    assert conn.execute("SELECT COUNT(*) FROM import_batches").fetchone()[0] == 1
+
+
+def test_dedupe_keeps_most_complete_row():
+    """Trùng (passport, ngày đến): giữ dòng đầy đủ nhất, bằng nhau thì dòng sau"""
+    df = pd.DataFrame({
+        "so_ho_chieu": ["a1234567", "A1234567", "a1234567", "B7654321", "B7654321", "C1111111", "C1111111"],
+        "ngay_den": ["2024-01-01"] * 3 + ["2024-02-01"] * 2 + [None, None],
+        "ho_ten": ["X", "X2", None, "Y", "Y2", "Z", "Z"],
+        "quoc_tich": ["CHN", "CHN", None, "KOR", "KOR", None, None],
+        "ket_qua_xac_minh": [None, None, "OK", None, None, None, None],
+    })
+
+    kept, collapsed = dedupe_import_rows(df)
+
+    # a1234567: dòng 0 và 1 đầy đủ như nhau -> dòng 1 (sau), nhận ket_qua_xac_minh của dòng 2
+    # B7654321: bằng nhau -> dòng 4; C1111111: không có ngày đến -> không gộp
+    assert collapsed.tolist() == [True, False, True, True, False, False, False]
+    assert kept.index.tolist() == [1, 4, 5, 6]
+    assert kept.loc[1, "ho_ten"] == "X2"
+    assert kept.loc[1, "ket_qua_xac_minh"] == "OK"
+    assert kept.loc[4, "ho_ten"] == "Y2"
+
+
+def test_import_dedupes_within_file():
+    """Import file có dòng trùng: DB chỉ còn dòng được giữ"""
+    conn = fresh_database()
+
+    rows = [
+        "B1234567,Nguyen A,01/01/2024,,,",
+        "B1234567,Nguyen A,01/01/2024,05/01/2024,CHN,1 Tran Phu",
+        "B1234567,Nguyen A2,01/01/2024,06/01/2024,CHN,1 Tran Phu",
+    ]
+    result = import_csv(write_csv("dupes.csv", rows), conn=conn)
+    assert result["success"], result.get("error")
+    assert result["rows_inserted"] == 1, result
+
+    stored = conn.execute("SELECT ho_ten, quoc_tich, CAST(ngay_di AS VARCHAR) FROM raw_immigration").fetchall()
+    assert stored == [("Nguyen A2", "CHN", "2024-01-06")], stored
+
+
+def snapshot(conn):
+    """Nội dung raw_immigration và các bảng dẫn xuất (để so sánh)"""
+    return {
+        "raw_immigration": conn.execute(
+            f"SELECT {RAW_COLUMNS}, batch_id FROM raw_immigration ORDER BY id"
+        ).fetchall(),
+        "travel_group": conn.execute(
+            "SELECT * FROM travel_group ORDER BY ALL"
+        ).fetchall(),
+        "address_token": conn.execute(
+            "SELECT * FROM address_token ORDER BY ALL"
+        ).fetchall(),
+    }
+
+
+def test_rollback_restores_snapshot():
+    """Rollback batch cập nhật + thêm mới -> DB như trước khi import"""
+    conn = fresh_database()
+
+    first = import_csv(write_csv("first.csv", ROWS), conn=conn)
+    assert first["success"], first.get("error")
+    before = snapshot(conn)
+
+    changed = [
+        "B1234567,Nguyen A,01/01/2024,05/01/2024,CHN,9 Ba Trieu",       # Đổi địa chỉ
+        "C7654321,Le B,02/01/2024,20/01/2024,KOR,1 Tran Phu",           # Cùng nhóm với B1234567 cũ
+        "F3333333,Hoang E,01/01/2024,05/01/2024,CHN,9 Ba Trieu",        # Mới
+    ]
+    second = import_csv(write_csv("second.csv", changed), conn=conn)
+    assert second["success"], second.get("error")
+    assert (second["rows_inserted"], second["rows_updated"]) == (1, 2), second
+    assert snapshot(conn) != before
+
+    # Batch đầu đã bị batch sau ghi đè -> phải rollback batch sau trước
+    refused = rollback_batch(first["batch_id"])
+    assert not refused["success"], refused
+
+    result = rollback_batch(second["batch_id"])
+    assert result["success"], result.get("error")
+    assert (result["rows_deleted"], result["rows_restored"]) == (1, 2), result
+    assert snapshot(conn) == before
+
+    assert rollback_batch(first["batch_id"])["success"]
+    assert conn.execute("SELECT COUNT(*) FROM raw_immigration").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM travel_group").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM address_token").fetchone()[0] == 0
+
+
+if __name__ == "__main__":
+    for test in (test_reimport_reports_unchanged, test_reimport_changed_row_is_updated,
+                 test_same_file_already_imported, test_dedupe_keeps_most_complete_row,
+                 test_import_dedupes_within_file, test_rollback_restores_snapshot):
+        try:
+            test()
+            print(f"✅ PASS: {test.__name__}")
+        except AssertionError as e:
+            print(f"❌ FAIL: {test.__name__}: {e}")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Test script - validate_import_frame so với ImportValidator
+Validation theo cột phải cho cùng kết quả với validate_import_row từng dòng
+"""
+
+import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from utils.validators import ImportValidator, validate_import_row, validate_import_frame
+
+FUTURE = (date.today() + timedelta(days=30)).strftime("%Y-%m-%d")
+
+ROWS = [
+    {"so_ho_chieu": "ABC12345", "ngay_den": "2025-01-01", "ngay_di": "2025-02-01", "quoc_tich": "CHN"},
+    {"so_ho_chieu": "", "ngay_den": "2025-01-01", "quoc_tich": "KOR"},          # Trống
+    {"so_ho_chieu": None, "ngay_den": "2025-01-01"},                             # Trống (None)
+    {"so_ho_chieu": "XYZ", "ngay_den": "2025-01-01"},                            # Quá ngắn
+    {"so_ho_chieu": "AB#12345", "ngay_den": "2025-01-01"},                       # Ký tự lạ
+    {"so_ho_chieu": "ab-123 45", "ngay_den": "2025-01-01"},                      # Hợp lệ sau chuẩn hóa
+    {"so_ho_chieu": "FUTURE123", "ngay_den": FUTURE},                            # Ngày đến tương lai
+    {"so_ho_chieu": "FUTURE456", "ngay_sinh": FUTURE, "ngay_den": "2025-01-01"}, # Ngày sinh tương lai
+    {"so_ho_chieu": "BACK12345", "ngay_den": "2025-03-01", "ngay_di": "2025-02-01"},  # Đi trước đến
+    {"so_ho_chieu": "OBJ12345", "ngay_den": date(2025, 1, 1), "ngay_di": datetime(2025, 1, 5, 8, 30)},
+    {"so_ho_chieu": "NAT12345", "ngay_den": "2025-01-01", "quoc_tich": "ATLANTIS"},  # Cảnh báo
+    {"so_ho_chieu": "BAD12345", "ngay_den": "01/02/2025", "ngay_di": "nan"},     # Không phải YYYY-MM-DD
+    {"so_ho_chieu": "ABC12345", "ngay_den": "2025-01-01", "ngay_di": "2025-02-01", "quoc_tich": "CHN"},
+]
+
+
+def _clean(record: dict) -> dict:
+    """NaN của DataFrame -> None (như dòng đọc từ file)"""
+    return {k: (None if not isinstance(v, (date, datetime)) and pd.isna(v) else v) for k, v in record.items()}
+
+
+def _row_by_row(df: pd.DataFrame):
+    """validate_import_row cho từng dòng -> (valid flags, {(row, column, message, severity)})"""
+    flags = []
+    issues = set()
+    for i, record in enumerate(df.to_dict("records")):
+        record = _clean(record)
+        validator = validate_import_row(record, i + 2, ImportValidator())
+        result = validator.get_result()
+        flags.append(not result.errors)
+        issues.update((e.row, e.column, e.message, "error") for e in result.errors)
+        issues.update((w.row, w.column, w.message, "warning") for w in result.warnings)
+    return flags, issues
+
+
+def test_frame_matches_row_validator():
+    """valid_mask và bảng lỗi khớp với ImportValidator từng dòng"""
+    df = pd.DataFrame(ROWS)
+
+    expected_flags, expected_issues = _row_by_row(df)
+    frame = validate_import_frame(df)
+
+    assert frame.valid_mask.tolist() == expected_flags, (frame.valid_mask.tolist(), expected_flags)
+    assert frame.valid_count == sum(expected_flags)
+
+    issues = set(zip(frame.errors["row"], frame.errors["column"], frame.errors["message"], frame.errors["severity"]))
+    assert issues == expected_issues, (issues ^ expected_issues)
+
+
+def test_frame_report_counts():
+    """to_report() đếm lỗi/cảnh báo giống ValidationResult gộp"""
+    df = pd.DataFrame(ROWS)
+
+    validator = ImportValidator()
+    for i, record in enumerate(df.to_dict("records")):
+        record = _clean(record)
+        validate_import_row(record, i + 2, validator)
+    expected = validator.get_result()
+
+    report = validate_import_frame(df).to_report()
+    assert report["total_errors"] == len(expected.errors)
+    assert report["total_warnings"] == len(expected.warnings)
+
+
+def test_frame_missing_columns():
+    """Thiếu cột ngày/quốc tịch: chỉ kiểm tra số hộ chiếu"""
+    df = pd.DataFrame({"so_ho_chieu": ["ABC12345", "X", ""]})
+    frame = validate_import_frame(df)
+    assert frame.valid_mask.tolist() == [True, False, False]
+    assert frame.warning_count == 0
+
+
+if __name__ == "__main__":
+    for test in (test_frame_matches_row_validator, test_frame_report_counts, test_frame_missing_columns):
+        try:
+            test()
+            print(f"✅ PASS: {test.__name__}")
+        except AssertionError as e:
+            print(f"❌ FAIL: {test.__name__}: {e}")
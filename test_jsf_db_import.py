@@ -55,6 +55,7 @@ def test_import_jsf():
         print(f"   📊 Tổng xử lý: {result.get('rows_imported', 0)}")
         print(f"   ➕ Thêm mới: {result.get('rows_inserted', 0)}")
         print(f"   🔄 Cập nhật: {result.get('rows_updated', 0)}")
+        print(f"   ⏸️ Không đổi: {result.get('rows_unchanged', 0)}")
         print(f"   ⏭️ Bỏ qua: {result.get('rows_skipped', 0)}")
         
         # Thống kê sau import
@@ -97,7 +98,8 @@ def test_duplicate_detection():
     if result['success']:
         print(f"✅ Kết quả lần 2:")
         print(f"   ➕ Thêm mới: {result.get('rows_inserted', 0)} (nên = 0)")
-        print(f"   🔄 Cập nhật: {result.get('rows_updated', 0)} (nên = tổng import)")
+        print(f"   🔄 Cập nhật: {result.get('rows_updated', 0)} (nên = 0)")
+        print(f"   ⏸️ Không đổi: {result.get('rows_unchanged', 0)} (nên = tổng import)")
         
         if result.get('rows_inserted', 0) == 0:
             print("✅ PASS: Logic lọc trùng hoạt động đúng!")
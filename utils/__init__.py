@@ -2,17 +2,25 @@
 QLNNN Offline - Utils Package
 """
 
-from .date_utils import format_date_vn, parse_date_vn, format_date_for_db
-from .text_utils import normalize_passport, remove_diacritics, normalize_header
+from .date_utils import format_date_vn, parse_date_vn, format_date_for_db, format_date_column
+from .text_utils import (
+    normalize_passport, remove_diacritics, normalize_header,
+    normalize_passport_series, remove_diacritics_series, normalize_for_search_series
+)
 from .security import hash_password, verify_password
 from .filter_utils import build_continent_condition, build_date_conditions
-from .validators import ImportValidator, ValidationResult, validate_import_row
+from .validators import (
+    ImportValidator, ValidationResult, validate_import_row,
+    FrameValidationResult, validate_import_frame
+)
 
 __all__ = [
-    "format_date_vn", "parse_date_vn", "format_date_for_db",
+    "format_date_vn", "parse_date_vn", "format_date_for_db", "format_date_column",
     "normalize_passport", "remove_diacritics", "normalize_header",
+    "normalize_passport_series", "remove_diacritics_series", "normalize_for_search_series",
     "hash_password", "verify_password",
     "build_continent_condition", "build_date_conditions",
-    "ImportValidator", "ValidationResult", "validate_import_row"
+    "ImportValidator", "ValidationResult", "validate_import_row",
+    "FrameValidationResult", "validate_import_frame"
 ]
 
@@ -4,9 +4,26 @@ Port từ SharedUtils.gs - formatDateVN, parseDateVN, formatDateForBQ
 """
 
 from datetime import datetime, date
-from typing import Union, Optional
+from typing import Union, Optional, Dict, List, Tuple
 import re
 
+import numpy as np
+import pandas as pd
+
+
+# Formats tried by parse_date_vn, in priority order
+DATE_FORMATS = [
+    "%d/%m/%Y",     # DD/MM/YYYY (Vietnamese)
+    "%d-%m-%Y",     # DD-MM-YYYY
+    "%Y-%m-%d",     # YYYY-MM-DD (ISO)
+    "%Y/%m/%d",     # YYYY/MM/DD
+    "%d.%m.%Y",     # DD.MM.YYYY
+    "%m/%d/%Y",     # MM/DD/YYYY (US)
+]
+
+# Values sampled to sniff which formats a column uses
+DATE_SNIFF_SAMPLE = 200
+
 
 def format_date_vn(date_input: Union[datetime, date, str, None]) -> str:
     """
@@ -54,16 +71,7 @@ def parse_date_vn(date_str: str) -> Optional[date]:
         return None
     
     # Try various formats
-    formats = [
-        "%d/%m/%Y",     # DD/MM/YYYY (Vietnamese)
-        "%d-%m-%Y",     # DD-MM-YYYY
-        "%Y-%m-%d",     # YYYY-MM-DD (ISO)
-        "%Y/%m/%d",     # YYYY/MM/DD
-        "%d.%m.%Y",     # DD.MM.YYYY
-        "%m/%d/%Y",     # MM/DD/YYYY (US)
-    ]
-    
-    for fmt in formats:
+    for fmt in DATE_FORMATS:
         try:
             return datetime.strptime(date_str, fmt).date()
         except ValueError:
@@ -120,6 +128,191 @@ def format_date_for_db(date_input: Union[datetime, date, str, None]) -> str:
     return ""
 
 
+def _format_separator(fmt: str) -> str:
+    """Separator character of a DATE_FORMATS entry ('/', '-', '.')"""
+    return fmt.replace("%d", "").replace("%m", "").replace("%Y", "")[:1]
+
+
+def _sniff_formats(sample: pd.Series) -> list:
+    """
+    Formats that parse at least one sampled value, plus every higher-priority
+    format with the same separator (so a value that parse_date_vn would read
+    with an earlier format, e.g. DD/MM before MM/DD, is never read differently).
+    """
+    found = [
+        fmt for fmt in DATE_FORMATS
+        if pd.to_datetime(sample, format=fmt, errors="coerce").notna().any()
+    ]
+    
+    selected = set(found)
+    for fmt in found:
+        for earlier in DATE_FORMATS[:DATE_FORMATS.index(fmt)]:
+            if _format_separator(earlier) == _format_separator(fmt):
+                selected.add(earlier)
+    
+    return [fmt for fmt in DATE_FORMATS if fmt in selected]
+
+
+def format_date_column(
+    series: pd.Series,
+    sample_size: int = DATE_SNIFF_SAMPLE
+) -> Tuple[pd.Series, Dict[str, int]]:
+    """
+    Column-level format_date_for_db: parse a whole import column to YYYY-MM-DD.
+    
+    Each distinct value is parsed once. The formats in use are sniffed from a
+    sample, then each is applied to the remaining values in one vectorized
+    pd.to_datetime pass (in parse_date_vn's priority order). Only the residue
+    goes through parse_date_vn, which keeps the day/month swap and
+    2-digit-year handling.
+    
+    Args:
+        series: Raw column (strings, date/datetime objects, NaN)
+        sample_size: Number of values sampled to sniff formats
+        
+    Returns:
+        Tuple of (Series of 'YYYY-MM-DD' or None, hit counts per format plus
+        'date_object', 'fallback', 'invalid' and 'empty')
+    """
+    n = len(series)
+    result = np.full(n, None, dtype=object)
+    hits: Dict[str, int] = {}
+    
+    if n == 0:
+        return pd.Series(result, index=series.index, dtype=object), hits
+    
+    values = series.to_numpy(dtype=object)
+    missing = pd.isna(series).to_numpy()
+    
+    # date/datetime objects (Excel cells) need no parsing
+    is_date = np.fromiter((isinstance(v, date) for v in values), dtype=bool, count=n) & ~missing
+    if is_date.any():
+        result[is_date] = [v.strftime("%Y-%m-%d") for v in values[is_date]]
+        hits["date_object"] = int(is_date.sum())
+    
+    text = pd.Series(values, dtype=object).where(~(missing | is_date)).astype(str).str.strip()
+    empty = missing | (~is_date & text.isin(["", "nan"]).to_numpy())
+    hits["empty"] = int((empty & ~is_date).sum())
+    pending = ~(empty | is_date)
+    
+    if not pending.any():
+        return pd.Series(result, index=series.index, dtype=object), hits
+    
+    # Parse each distinct string once (dates repeat a lot), weight hits by occurrences
+    positions = np.flatnonzero(pending)
+    codes, uniques = pd.factorize(text.iloc[positions])
+    uniques = pd.Series(uniques, dtype=object)
+    weights = np.bincount(codes, minlength=len(uniques))
+    parsed_uniques = np.full(len(uniques), None, dtype=object)
+    todo = np.ones(len(uniques), dtype=bool)
+    
+    step = max(len(uniques) // sample_size, 1)
+    sample = uniques.iloc[::step].head(sample_size)
+    
+    # Fast path: one vectorized pass per format in use
+    for fmt in _sniff_formats(sample):
+        remaining = np.flatnonzero(todo)
+        if len(remaining) == 0:
+            break
+        parsed = pd.to_datetime(uniques.iloc[remaining], format=fmt, errors="coerce")
+        ok = parsed.notna().to_numpy()
+        if ok.any():
+            parsed_uniques[remaining[ok]] = parsed[ok].dt.strftime("%Y-%m-%d").to_numpy()
+            todo[remaining[ok]] = False
+            hits[fmt] = int(weights[remaining[ok]].sum())
+    
+    # Slow path for the residue (regex, day/month swap, 2-digit years)
+    remaining = np.flatnonzero(todo)
+    if len(remaining):
+        slow = np.array([format_date_for_db(u) or None for u in uniques.iloc[remaining]], dtype=object)
+        parsed_uniques[remaining] = slow
+        ok = pd.notna(slow)
+        hits["fallback"] = int(weights[remaining[ok]].sum())
+        hits["invalid"] = int(weights[remaining[~ok]].sum())
+    
+    result[positions] = parsed_uniques[codes]
+    
+    return pd.Series(result, index=series.index, dtype=object), hits
+
+
+# Every date shape parse_date_vn accepts: digits, separator, digits, separator, digits, rest
+_DATE_PARTS_PATTERN = r"^(\d{1,4})([/.\-])(\d{1,2})([/.\-])(\d{1,4})(.*)$"
+
+
+def date_parts_sql(column: str) -> str:
+    """
+    SQL (DuckDB) expression splitting a date string into a struct
+    (a, s1, b, s2, c, rest) with one regex; all '' when it does not match.
+    Select it once as a column, then parse it with date_parse_sql().
+    
+    Args:
+        column: SQL expression of the trimmed text value
+    """
+    return f"regexp_extract({column}, '{_DATE_PARTS_PATTERN}', ['a', 's1', 'b', 's2', 'c', 'rest'])"
+
+
+def _make_date_sql(year: str, month: str, day: str) -> str:
+    """
+    DATE from integer parts, NULL when they do not form a valid date (like
+    datetime.date raising). Range-checked instead of try(make_date(...)):
+    DuckDB's try() is slow when most rows fail, e.g. DD/MM values read as MM/DD.
+    """
+    return (
+        f"CASE WHEN {year} >= 1 AND {month} BETWEEN 1 AND 12 THEN "
+        f"CASE WHEN {day} BETWEEN 1 AND day(last_day(make_date({year}, {month}, 1))) "
+        f"THEN make_date({year}, {month}, {day}) END END"
+    )
+
+
+def date_parse_sql(parts: str) -> List[Tuple[str, str]]:
+    """
+    SQL (DuckDB) counterpart of format_date_column / parse_date_vn, over the
+    struct column produced by date_parts_sql().
+    
+    One DATE expression per DATE_FORMATS entry, in priority order (strptime
+    widths: 1-2 digit day/month, 4-digit year, nothing after), then the
+    regex fallback (2-digit years, day/month swap); each is NULL when its
+    rule does not apply. COALESCE of the expressions is the parsed date, the
+    first non-NULL one names the format for the hit counts.
+    
+    Args:
+        parts: Column holding date_parts_sql() of the value
+        
+    Returns:
+        List of (hit label, SQL expression) - format strings, then 'fallback'
+    """
+    def number(field: str) -> str:
+        return f"TRY_CAST({parts}.{field} AS INTEGER)"
+    
+    cases = []
+    for fmt in DATE_FORMATS:
+        sep = _format_separator(fmt)
+        order = [fmt[i + 1] for i in range(len(fmt)) if fmt[i] == "%"]
+        fields = dict(zip(order, ["a", "b", "c"]))
+        widths = " AND ".join(
+            f"LENGTH({parts}.{field}) {'= 4' if part == 'Y' else '<= 2'}"
+            for part, field in fields.items()
+        )
+        cases.append((
+            fmt,
+            f"CASE WHEN {parts}.s1 = '{sep}' AND {parts}.s2 = '{sep}' AND {parts}.rest = '' AND {widths} "
+            f"THEN {_make_date_sql(number(fields['Y']), number(fields['m']), number(fields['d']))} END"
+        ))
+    
+    # parse_date_vn's regex: prefix d/m/y (any separators), 2-digit year -> 19xx/20xx, swap if invalid
+    year = (
+        f"(CASE WHEN {number('c')} < 50 THEN {number('c')} + 2000 "
+        f"WHEN {number('c')} < 100 THEN {number('c')} + 1900 ELSE {number('c')} END)"
+    )
+    cases.append((
+        "fallback",
+        f"CASE WHEN LENGTH({parts}.a) <= 2 AND LENGTH({parts}.c) >= 2 THEN COALESCE("
+        f"{_make_date_sql(year, number('b'), number('a'))}, "
+        f"{_make_date_sql(year, number('a'), number('b'))}) END"
+    ))
+    return cases
+
+
 def days_between(date1: Union[date, str], date2: Union[date, str] = None) -> int:
     """
     Calculate days between two dates
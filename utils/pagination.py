@@ -0,0 +1,118 @@
+"""
+QLNNN Offline - Pagination Utilities
+Keyset (cursor) pagination helpers
+
+Thay vì LIMIT/OFFSET (phải sắp xếp và bỏ qua toàn bộ các dòng trước offset),
+trang sau được lấy bằng điều kiện "sau khóa sắp xếp cuối cùng" của trang trước.
+Tổng số dòng được tính một lần ở trang đầu và mang theo trong cursor.
+"""
+
+import base64
+import hashlib
+import json
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+
+# Sentinel for NULL dates in sort keys (sorts last in DESC order)
+NULL_SORT_DATE = "0001-01-01"
+
+
+def query_fingerprint(*parts: Any) -> str:
+    """
+    Build a short fingerprint of a query's parameters.
+    Used to reject a cursor issued for a different filter set.
+
+    Args:
+        parts: Query parameters (filters, keyword list...)
+
+    Returns:
+        Short hex digest
+    """
+    raw = json.dumps(parts, default=str, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def encode_cursor(
+    sort_key: Sequence[Any],
+    total: int,
+    fetched: int,
+    fingerprint: str
+) -> str:
+    """
+    Encode a continuation token.
+
+    Args:
+        sort_key: Sort key values of the last returned row
+        total: Total rows of the query (computed once on the first page)
+        fetched: Number of rows returned so far
+        fingerprint: Query fingerprint (see query_fingerprint)
+
+    Returns:
+        Opaque URL-safe token
+    """
+    key = [v.isoformat() if isinstance(v, (date, datetime)) else v for v in sort_key]
+    payload = {"k": key, "t": total, "n": fetched, "q": fingerprint}
+    raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(token: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+    """
+    Decode a continuation token.
+
+    Args:
+        token: Token from encode_cursor
+        fingerprint: Fingerprint of the current query
+
+    Returns:
+        Dict with keys 'key', 'total', 'fetched' or None if invalid/mismatched
+    """
+    if not token:
+        return None
+
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8"))
+    except (ValueError, UnicodeError):
+        return None
+
+    if not isinstance(payload, dict) or payload.get("q") != fingerprint:
+        return None
+
+    return {
+        "key": payload.get("k") or [],
+        "total": int(payload.get("t", 0)),
+        "fetched": int(payload.get("n", 0)),
+    }
+
+
+def build_keyset_condition(
+    sort_columns: List[Tuple[str, str]],
+    last_key: Sequence[Any]
+) -> Tuple[str, List[Any]]:
+    """
+    Build the "row after last_key" condition for a multi-column sort.
+
+    Example for [(a, ASC), (b, DESC)]:
+        (a > ?) OR (a = ? AND b < ?)
+
+    Args:
+        sort_columns: List of (column expression, 'ASC' | 'DESC')
+        last_key: Sort key values of the last row of the previous page
+
+    Returns:
+        Tuple of (condition SQL, parameters)
+    """
+    branches = []
+    params: List[Any] = []
+
+    for i, (column, direction) in enumerate(sort_columns):
+        parts = []
+        for prev_column, _ in sort_columns[:i]:
+            parts.append(f"{prev_column} = ?")
+        op = "<" if direction.upper() == "DESC" else ">"
+        parts.append(f"{column} {op} ?")
+        branches.append("(" + " AND ".join(parts) + ")")
+        params.extend(last_key[:i + 1])
+
+    return "(" + " OR ".join(branches) + ")", params
@@ -4,7 +4,11 @@ Xử lý chuỗi, chuẩn hóa text, remove diacritics
 """
 
 import re
+from functools import lru_cache
 from typing import Optional
+
+import numpy as np
+import pandas as pd
 from unidecode import unidecode
 
 
@@ -19,9 +23,9 @@ def normalize_passport(passport: str) -> str:
         passport: Raw passport string
         
     Returns:
-        Normalized passport number
+        Normalized passport number ("" for None/NaN/pd.NA/empty)
     """
-    if not passport:
+    if passport is None or pd.isna(passport) or passport == "":
         return ""
     
     # Convert to uppercase and strip
@@ -77,6 +81,117 @@ def normalize_for_search(text: str) -> str:
     return result
 
 
+# ============================================
+# COLUMN (pandas Series) VERSIONS
+# Same output as the scalar functions above, element by element
+# ============================================
+
+# Distinct strings kept by the unidecode memo (names/addresses repeat across imports)
+UNIDECODE_CACHE_SIZE = 200_000
+
+
+@lru_cache(maxsize=UNIDECODE_CACHE_SIZE)
+def _unidecode_cached(text: str) -> str:
+    return unidecode(text)
+
+
+# Separators removed from passport numbers (same pattern as normalize_passport)
+_PASSPORT_SEPARATORS = re.compile(r'[\s\-_.]+')
+
+
+def normalize_passport_sql(column: str) -> str:
+    """
+    SQL (DuckDB) expression equivalent to normalize_passport_series:
+    uppercase, separators removed, '' for NULL/empty values.
+    
+    Args:
+        column: SQL expression of the raw passport (VARCHAR)
+    """
+    return f"regexp_replace(UPPER(COALESCE({column}, '')), '{_PASSPORT_SEPARATORS.pattern}', '', 'g')"
+
+
+def normalize_passport_series(series: pd.Series) -> pd.Series:
+    """
+    Column version of normalize_passport.
+    
+    Vectorized str operations: upper() on the whole column, the separator
+    regex (which also covers strip()) only on values that are not already
+    alphanumeric.
+    Missing values (None, NaN, pd.NA) of any dtype become "", never "NAN".
+    
+    Args:
+        series: Raw passport column
+        
+    Returns:
+        Series of normalized passport numbers ("" for empty values)
+    """
+    missing = series.isna().to_numpy()
+    text = series.astype(object).where(~missing, "").astype(str)
+    result = text.str.upper()
+    
+    needs_regex = ~result.str.isalnum()
+    if needs_regex.any():
+        result[needs_regex] = result[needs_regex].str.replace(_PASSPORT_SEPARATORS, "", regex=True)
+    
+    return result.astype(object)
+
+
+def _unique_diacritics_removed(series: pd.Series):
+    """
+    Factorize a column and remove diacritics from each distinct value once.
+    
+    Returns:
+        (codes, converted uniques as an object Series); code -1 = missing
+    """
+    codes, uniques = pd.factorize(series)
+    converted = pd.Series([_unidecode_cached(v) if v else "" for v in uniques], dtype=object)
+    return codes, converted
+
+
+def _broadcast(codes: np.ndarray, values: pd.Series, index: pd.Index) -> pd.Series:
+    """Expand per-unique results back to the column ("" for missing values)"""
+    out = np.full(len(codes), "", dtype=object)
+    present = codes >= 0
+    out[present] = values.to_numpy(dtype=object)[codes[present]]
+    return pd.Series(out, index=index, dtype=object)
+
+
+def remove_diacritics_series(series: pd.Series) -> pd.Series:
+    """
+    Vectorized remove_diacritics for a whole column.
+    unidecode runs once per distinct value (memoized across calls).
+    
+    Args:
+        series: Text column
+        
+    Returns:
+        Series without diacritics ("" for empty/missing values)
+    """
+    codes, converted = _unique_diacritics_removed(series)
+    return _broadcast(codes, converted, series.index)
+
+
+def normalize_for_search_series(series: pd.Series) -> pd.Series:
+    """
+    Vectorized normalize_for_search for a whole column.
+    Works on distinct values only, then expands back to the column.
+    
+    Args:
+        series: Text column
+        
+    Returns:
+        Series of normalized search text ("" for empty/missing values)
+    """
+    codes, converted = _unique_diacritics_removed(series)
+    normalized = (
+        converted
+        .str.lower()
+        .str.replace(r'\s+', ' ', regex=True)
+        .str.strip()
+    )
+    return _broadcast(codes, normalized, series.index)
+
+
 def normalize_header(header: str) -> str:
     """
     Normalize column header for matching
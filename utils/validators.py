@@ -1,14 +1,21 @@
 """
 QLNNN Offline - Data Validators
 Validation framework for import data
+
+- ImportValidator / validate_import_row: per-row validation
+- validate_import_frame: columnar (vectorized) validation of a whole DataFrame
+- validate_import_table: the same rules in SQL over a staged DuckDB table
 """
 
 from dataclasses import dataclass, field
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Dict
 from datetime import date, datetime
 import sys
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from config import CONTINENT_RULES
@@ -268,3 +275,318 @@ def validate_import_row(row: dict, row_index: int, validator: ImportValidator =
     validator.validate_nationality(row.get('quoc_tich'), row_index)
     
     return validator
+
+
+# ============================================
+# COLUMNAR VALIDATION
+# ============================================
+
+# Error codes -> (severity, message). Messages are the same as ImportValidator's.
+VALIDATION_CODES = {
+    "passport_empty": ("error", "Số hộ chiếu không được để trống"),
+    "passport_too_short": ("error", "Số hộ chiếu quá ngắn (tối thiểu 5 ký tự)"),
+    "passport_not_alnum": ("error", "Số hộ chiếu chỉ được chứa chữ và số"),
+    "date_in_future": ("error", "Ngày không thể nằm trong tương lai"),
+    "departure_before_arrival": ("error", None),  # Message built per row
+    "unknown_nationality": ("warning", "Quốc tịch chưa được định nghĩa trong hệ thống"),
+}
+
+ERROR_TABLE_COLUMNS = ["row", "column", "code", "value", "message", "severity"]
+
+
+@dataclass
+class FrameValidationResult:
+    """
+    Result of validate_import_frame.
+    
+    valid_mask is aligned with the validated DataFrame's index (True = no
+    errors; warnings do not reject a row). errors is a compact table with
+    one line per failed check: row, column, code, value, message, severity.
+    """
+    valid_mask: pd.Series
+    errors: pd.DataFrame
+    
+    @property
+    def error_count(self) -> int:
+        return int((self.errors["severity"] == "error").sum())
+    
+    @property
+    def warning_count(self) -> int:
+        return int((self.errors["severity"] == "warning").sum())
+    
+    @property
+    def valid_count(self) -> int:
+        return int(self.valid_mask.sum())
+    
+    def to_report(self, max_rows: int = 100) -> Dict[str, Any]:
+        """
+        Build the validation_report dict returned by the import functions
+        (same layout as ValidationResult.to_dict(), one detail per row).
+        
+        Args:
+            max_rows: Max rows listed in details
+        """
+        report = {
+            "total_errors": self.error_count,
+            "total_warnings": self.warning_count,
+            "details": []
+        }
+        
+        if self.errors.empty:
+            return report
+        
+        first_rows = self.errors["row"].drop_duplicates().head(max_rows)
+        subset = self.errors[self.errors["row"].isin(first_rows)]
+        
+        for row, group in subset.groupby("row", sort=True):
+            items = group[["row", "column", "message", "value"]].to_dict("records")
+            errors = [i for i, sev in zip(items, group["severity"]) if sev == "error"]
+            warnings = [i for i, sev in zip(items, group["severity"]) if sev == "warning"]
+            report["details"].append({
+                "is_valid": not errors,
+                "error_count": len(errors),
+                "warning_count": len(warnings),
+                "errors": errors[:50],
+                "warnings": warnings[:50],
+            })
+        
+        return report
+
+
+def _map_unique(series: pd.Series, func, dtype) -> np.ndarray:
+    """
+    Apply a scalar rule once per distinct value and broadcast it back.
+    
+    Import columns repeat a lot (dates, nationalities), so factorizing first
+    keeps the Python-level work proportional to the number of distinct values.
+    """
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    results = np.array([func(v) for v in uniques], dtype=dtype)
+    return results[codes] if len(results) else np.zeros(len(series), dtype=dtype)
+
+
+def _is_blank(value: Any) -> bool:
+    """Missing (None/NaN) or empty/whitespace string"""
+    return value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == ""
+
+
+# Passport check codes (index into PASSPORT_CODES)
+PASSPORT_CODES = [None, "passport_empty", "passport_too_short", "passport_not_alnum"]
+
+
+def _passport_check(value: Any) -> int:
+    """Same rules as ImportValidator.validate_passport, as a code"""
+    if _is_blank(value):
+        return 1
+    normalized = str(value).upper().strip().replace(" ", "").replace("-", "")
+    if len(normalized) < 5:
+        return 2
+    if not normalized.isalnum():
+        return 3
+    return 0
+
+
+def _as_date(value: Any) -> Optional[np.datetime64]:
+    """Read a date the way ImportValidator does (strings must be YYYY-MM-DD)"""
+    try:
+        if isinstance(value, str):
+            return np.datetime64(datetime.strptime(value, "%Y-%m-%d").date(), "D")
+        if isinstance(value, datetime):
+            return np.datetime64(value.date(), "D")
+        if isinstance(value, date):
+            return np.datetime64(value, "D")
+    except ValueError:
+        pass
+    return np.datetime64("NaT", "D")
+
+
+def _to_strings(values: np.ndarray) -> List[str]:
+    """Stringify reported values (dates as YYYY-MM-DD)"""
+    if np.issubdtype(values.dtype, np.datetime64):
+        return np.datetime_as_string(values, unit="D").tolist()
+    return [str(v) for v in values]
+
+
+def _error_rows(
+    mask: np.ndarray,
+    column: str,
+    code: str,
+    values: List[str],
+    row_offset: int,
+    messages: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Build error-table lines for the rows selected by mask.
+    values (and messages, if per row) cover the selected rows only.
+    """
+    positions = np.flatnonzero(mask)
+    severity, message = VALIDATION_CODES[code]
+    return pd.DataFrame({
+        "row": positions + row_offset,
+        "column": column,
+        "code": code,
+        "value": values,
+        "message": messages if messages is not None else message,
+        "severity": severity,
+    })
+
+
+def validate_import_frame(df: pd.DataFrame, row_offset: int = 2) -> FrameValidationResult:
+    """
+    Validate a whole import DataFrame column by column.
+    
+    Same rules and messages as validate_import_row, but each rule is
+    evaluated once per distinct value and applied to the column with NumPy
+    masks, instead of one ImportValidator pass per record.
+    
+    Args:
+        df: Import data (so_ho_chieu, ngay_sinh, ngay_den, ngay_di, quoc_tich)
+        row_offset: Added to the 0-based position for reported row numbers
+                    (2 = 1-based + header line)
+        
+    Returns:
+        FrameValidationResult (valid_mask, errors table)
+    """
+    n = len(df)
+    empty_column = pd.Series([None] * n, index=df.index, dtype=object)
+    
+    def column(name: str) -> pd.Series:
+        return df[name] if name in df.columns else empty_column
+    
+    error_mask = np.zeros(n, dtype=bool)
+    parts = []
+    
+    # Passport (required): empty -> too short -> not alphanumeric
+    passport = column("so_ho_chieu")
+    passport_codes = _map_unique(passport, _passport_check, np.int8)
+    for code_index in range(1, len(PASSPORT_CODES)):
+        mask = passport_codes == code_index
+        if mask.any():
+            parts.append(_error_rows(mask, "so_ho_chieu", PASSPORT_CODES[code_index], _to_strings(passport.to_numpy()[mask]), row_offset))
+            error_mask |= mask
+    
+    # Dates must not be in the future
+    today = np.datetime64(date.today(), "D")
+    dates = {}
+    for name in ("ngay_sinh", "ngay_den", "ngay_di"):
+        dates[name] = _map_unique(column(name), _as_date, "datetime64[D]")
+        future = dates[name] > today
+        if future.any():
+            parts.append(_error_rows(future, name, "date_in_future", _to_strings(dates[name][future]), row_offset))
+            error_mask |= future
+    
+    # Departure not before arrival (NaT compares False -> skipped)
+    arrival, departure = dates["ngay_den"], dates["ngay_di"]
+    before = departure < arrival
+    if before.any():
+        pairs = list(zip(_to_strings(arrival[before]), _to_strings(departure[before])))
+        messages = [f"Ngày đi ({dep}) không thể trước ngày đến ({arr})" for arr, dep in pairs]
+        values = [f"{arr} -> {dep}" for arr, dep in pairs]
+        parts.append(_error_rows(before, "ngay_di", "departure_before_arrival", values, row_offset, messages))
+        error_mask |= before
+    
+    # Nationality (warning only)
+    nationality = column("quoc_tich")
+    known = ImportValidator()._all_countries
+    unknown = _map_unique(
+        nationality,
+        lambda v: not _is_blank(v) and str(v).upper().strip() not in known,
+        bool
+    )
+    if unknown.any():
+        parts.append(_error_rows(unknown, "quoc_tich", "unknown_nationality", _to_strings(nationality.to_numpy()[unknown]), row_offset))
+    
+    if parts:
+        errors = pd.concat(parts, ignore_index=True).sort_values("row", kind="stable", ignore_index=True)
+    else:
+        errors = pd.DataFrame(columns=ERROR_TABLE_COLUMNS)
+    
+    return FrameValidationResult(
+        valid_mask=pd.Series(~error_mask, index=df.index),
+        errors=errors
+    )
+
+
+def validate_import_table(conn, table: str, max_rows: int = 100) -> Dict[str, Any]:
+    """
+    SQL (DuckDB) counterpart of validate_import_frame, for an import staged
+    in a table instead of a DataFrame. Same rules, codes and messages; the
+    rules run as one query over the table, so memory does not grow with
+    the file.
+    
+    The table needs row_no (reported row number), so_ho_chieu (normalized),
+    ngay_sinh/ngay_den/ngay_di (DATE) and quoc_tich. Its `valid` column is
+    set to FALSE for rows with errors (warnings do not reject a row).
+    
+    Args:
+        conn: DuckDB connection holding the table
+        table: Staged import table
+        max_rows: Max rows listed in details
+        
+    Returns:
+        validation_report dict (same layout as FrameValidationResult.to_report)
+    """
+    errors_table = f"{table}_errors"
+    checks = []
+    
+    def check(code: str, column: str, condition: str, value: str, message: Optional[str] = None):
+        severity, default_message = VALIDATION_CODES[code]
+        checks.append(f"""
+            SELECT row_no AS "row", '{column}' AS "column", '{code}' AS code,
+                   {value} AS value, {message or "'" + default_message.replace("'", "''") + "'"} AS message,
+                   '{severity}' AS severity
+            FROM {table} WHERE {condition}
+        """)
+    
+    # Passport (required): empty -> too short -> not alphanumeric
+    passport = "REPLACE(REPLACE(UPPER(TRIM(COALESCE(so_ho_chieu, ''))), ' ', ''), '-', '')"
+    check("passport_empty", "so_ho_chieu", "TRIM(COALESCE(so_ho_chieu, '')) = ''", "COALESCE(so_ho_chieu, '')")
+    check("passport_too_short", "so_ho_chieu",
+          f"TRIM(COALESCE(so_ho_chieu, '')) != '' AND LENGTH({passport}) < 5", "so_ho_chieu")
+    check("passport_not_alnum", "so_ho_chieu",
+          f"LENGTH({passport}) >= 5 AND NOT regexp_full_match({passport}, '[\\pL\\pN]+')", "so_ho_chieu")
+    
+    # Dates must not be in the future
+    for name in ("ngay_sinh", "ngay_den", "ngay_di"):
+        check("date_in_future", name, f"{name} > current_date", f"strftime({name}, '%Y-%m-%d')")
+    
+    # Departure not before arrival (NULL compares NULL -> skipped)
+    check(
+        "departure_before_arrival", "ngay_di", "ngay_di < ngay_den",
+        "strftime(ngay_den, '%Y-%m-%d') || ' -> ' || strftime(ngay_di, '%Y-%m-%d')",
+        "'Ngày đi (' || strftime(ngay_di, '%Y-%m-%d') || ') không thể trước ngày đến ('"
+        " || strftime(ngay_den, '%Y-%m-%d') || ')'"
+    )
+    
+    # Nationality (warning only)
+    known = sorted(ImportValidator()._all_countries)
+    conn.execute(f"CREATE OR REPLACE TEMP TABLE {table}_countries AS SELECT UNNEST(?::VARCHAR[]) AS country", (known,))
+    check(
+        "unknown_nationality", "quoc_tich",
+        f"TRIM(COALESCE(quoc_tich, '')) != '' AND UPPER(TRIM(quoc_tich)) NOT IN (SELECT country FROM {table}_countries)",
+        "quoc_tich"
+    )
+    
+    conn.execute(f"CREATE OR REPLACE TEMP TABLE {errors_table} AS {' UNION ALL '.join(checks)}")
+    conn.execute(f"DROP TABLE {table}_countries")
+    conn.execute(f"""
+        UPDATE {table} SET valid = FALSE
+        WHERE row_no IN (SELECT "row" FROM {errors_table} WHERE severity = 'error')
+    """)
+    
+    totals = conn.execute(f"""
+        SELECT COUNT(*) FILTER (WHERE severity = 'error'), COUNT(*) FILTER (WHERE severity = 'warning')
+        FROM {errors_table}
+    """).fetchone()
+    
+    # Details of the first rows only, laid out by to_report()
+    subset = conn.execute(f"""
+        SELECT {', '.join(f'"{c}"' for c in ERROR_TABLE_COLUMNS)} FROM {errors_table}
+        WHERE "row" IN (SELECT DISTINCT "row" FROM {errors_table} ORDER BY "row" LIMIT ?)
+        ORDER BY "row"
+    """, (max_rows,)).df()
+    conn.execute(f"DROP TABLE {errors_table}")
+    
+    report = FrameValidationResult(valid_mask=pd.Series(dtype=bool), errors=subset).to_report(max_rows)
+    report["total_errors"], report["total_warnings"] = int(totals[0]), int(totals[1])
+    return report